@@ -64,6 +64,29 @@ DATABASES = {
     )
 }
 
+# The quote, search and active-portfolio caches invalidate by bumping version
+# keys, and the writers (run_market_feed, the run_jobs ingest) are separate
+# processes from the web workers, so the cache must be shared between
+# processes: files on this host by default, or Redis across hosts with
+# REDIS_URL (needs the redis package). Never a per-process LocMemCache.
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': config('CACHE_DIR', default=str(BASE_DIR / 'data' / 'cache')),
+            # One entry per stock quote; culling could otherwise drop most of a warm cache
+            'OPTIONS': {'MAX_ENTRIES': 100000},
+        }
+    }
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -103,6 +126,28 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD', default='')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'data')
 
+# Run background jobs inline instead of queueing them for the run_jobs worker
+TRADING_JOBS_SYNC = config('TRADING_JOBS_SYNC', default=False, cast=bool)
+
+# NSE site the index CSV downloader talks to (see trading.downloader)
+NSE_BASE_URL = config('NSE_BASE_URL', default='https://www.nseindia.com')
+
+# Default source for run_market_feed: nse, archive or replay (see trading.providers)
+MARKET_DATA_PROVIDER = config('MARKET_DATA_PROVIDER', default='nse')
+
+# Where NSE CSV downloads land before they are archived (see trading.downloader)
+NSE_DATA_DIR = config('NSE_DATA_DIR', default=os.path.join(BASE_DIR, 'data', 'nse'))
+
+# Content-addressed gzip store for downloaded NSE CSVs (see trading.archive)
+NSE_ARCHIVE_DIR = config('NSE_ARCHIVE_DIR', default=os.path.join(MEDIA_ROOT, 'nse_archive'))
+
+# Memory-mapped per-symbol OHLCV files written by the NSE ingest (see trading.price_history)
+PRICE_HISTORY_DIR = config('PRICE_HISTORY_DIR', default=os.path.join(MEDIA_ROOT, 'price_history'))
+
+# Rendered report PDF/Excel exports (see trading.exports), evicted least recently served first
+EXPORT_CACHE_DIR = config('EXPORT_CACHE_DIR', default=os.path.join(MEDIA_ROOT, 'export_cache'))
+EXPORT_CACHE_MAX_BYTES = config('EXPORT_CACHE_MAX_BYTES', default=256 * 1024 * 1024, cast=int)
+
 LOGIN_URL = 'trading:login'
 LOGIN_REDIRECT_URL = 'trading:dashboard'
 LOGOUT_REDIRECT_URL = 'trading:dashboard'
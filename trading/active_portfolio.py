@@ -0,0 +1,96 @@
+# trading/active_portfolio.py
+"""The user's active portfolio, resolved at most once per request.
+
+Views and the ``active_portfolio`` context processor share one lookup,
+memoised on the request. The session remembers the portfolio's id and
+name, stamped with a per-user version kept in the cache; creating,
+deleting or saving any of the user's portfolios bumps the version, so a
+stale entry is resolved again instead of trusted.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Case, IntegerField, Value, When
+
+from .models import Portfolio
+
+SESSION_KEY = 'active_portfolio'
+_UNRESOLVED = object()
+
+
+def _version_key(user_id):
+    return f"portfolios:version:{user_id}"
+
+
+def invalidate_active_portfolio(user_id):
+    """Expire the remembered active portfolio in every session of ``user_id``."""
+    cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def _version(user_id):
+    return cache.get_or_set(_version_key(user_id), time.time_ns, None)
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def remembered_portfolio(request):
+    """``{'id', 'name'}`` from the session if still current, else ``None``; no database query."""
+    entry = request.session.get(SESSION_KEY)
+    if not entry or entry.get('version') != _version(request.user.pk):
+        return None
+    return entry
+
+
+def set_active_portfolio(request, portfolio):
+    request._active_portfolio = portfolio
+    entry = {
+        'id': portfolio.pk if portfolio else None,
+        'name': portfolio.name if portfolio else None,
+        'version': _version(request.user.pk),
+    }
+    if request.session.get(SESSION_KEY) != entry:
+        request.session[SESSION_KEY] = entry
+
+
+def get_active_portfolio(request, portfolio_id=None):
+    """The active public portfolio of ``request.user``, or ``None``.
+
+    ``portfolio_id`` (e.g. ``?portfolio=``) asks for a specific one; otherwise
+    the remembered one is used, and the user's first public portfolio is the
+    fallback. All three are decided by a single query.
+    """
+    if not request.user.is_authenticated:
+        return None
+    wanted = _as_id(portfolio_id)
+    portfolio = getattr(request, '_active_portfolio', _UNRESOLVED)
+    if portfolio is not _UNRESOLVED and (wanted is None or (portfolio and portfolio.pk == wanted)):
+        return portfolio
+
+    if wanted is None:
+        remembered = request.session.get(SESSION_KEY) or {}
+        wanted = _as_id(remembered.get('id'))
+    portfolios = Portfolio.objects.filter(user=request.user, visibility='PUBLIC')
+    if wanted is not None:
+        preferred = Case(When(pk=wanted, then=Value(0)), default=Value(1), output_field=IntegerField())
+        portfolios = portfolios.order_by(preferred, 'pk')
+    else:
+        portfolios = portfolios.order_by('pk')
+    portfolio = portfolios.first()
+    set_active_portfolio(request, portfolio)
+    return portfolio
+
+
+def active_portfolio_name(request):
+    """The active portfolio's name, from the session when it is current."""
+    if not request.user.is_authenticated:
+        return ''
+    remembered = remembered_portfolio(request)
+    if remembered is not None:
+        return remembered['name'] or ''
+    portfolio = get_active_portfolio(request)
+    return portfolio.name if portfolio else ''
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Stock, Portfolio, Holding, Transaction, Watchlist, PortfolioReport, HoldingReport
+from .models import Stock, Portfolio, Holding, Transaction, Watchlist, PortfolioReport, HoldingReport, Job, SnapshotFile
 
 admin.site.register(Stock)
 # admin.site.register(Portfolio)
@@ -8,8 +8,11 @@ admin.site.register(Transaction)
 admin.site.register(Watchlist)
 admin.site.register(PortfolioReport)
 admin.site.register(HoldingReport)
+admin.site.register(Job)
+admin.site.register(SnapshotFile)
 # trading/admin.py
 from django.contrib import admin
+from .active_portfolio import invalidate_active_portfolio
 from .models import Portfolio
 
 
@@ -20,12 +23,26 @@ class PortfolioAdmin(admin.ModelAdmin):
     list_editable = ['visibility']  # Allows quick editing from the list view
     actions = ['make_public', 'make_private']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('user').with_valuation()
+
+    @admin.display(description='Total value', ordering='valuation_total')
+    def total_value(self, obj):
+        return obj.total_value
+
+    def _set_visibility(self, queryset, visibility):
+        user_ids = set(queryset.values_list('user_id', flat=True))
+        queryset.update(visibility=visibility)
+        # update() sends no signals: expire the owners' remembered portfolios here
+        for user_id in user_ids:
+            invalidate_active_portfolio(user_id)
+
     def make_public(self, request, queryset):
-        queryset.update(visibility='PUBLIC')
+        self._set_visibility(queryset, 'PUBLIC')
 
     make_public.short_description = "Make selected portfolios visible to users"
 
     def make_private(self, request, queryset):
-        queryset.update(visibility='PRIVATE')
+        self._set_visibility(queryset, 'PRIVATE')
 
     make_private.short_description = "Hide selected portfolios from users"
@@ -2,15 +2,33 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.response import Response
 from rest_framework.decorators import action
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from .models import Stock, Portfolio, Holding, Transaction, Watchlist, PortfolioReport
 from .serializers import (
     StockSerializer, PortfolioSerializer, HoldingSerializer,
     TransactionSerializer, WatchlistSerializer, PortfolioReportSerializer
 )
 from django.contrib.auth.models import User
-from datetime import date, timedelta
+from .performance import performance_series
+from .search import search_stocks
+from .conditional import (
+    report_etag, report_last_modified, stock_list_etag, stock_list_last_modified, stock_price_etag,
+    stock_price_last_modified,
+)
+
+
+# Router lookups are any string; leave non-numeric ones to the viewset's 404
+def _stock_etag(request, pk=None):
+    return stock_price_etag(request, pk) if str(pk).isdigit() else None
 
 
+def _stock_last_modified(request, pk=None):
+    return stock_price_last_modified(request, pk) if str(pk).isdigit() else None
+
+
+@method_decorator(condition(etag_func=stock_list_etag, last_modified_func=stock_list_last_modified), name='list')
+@method_decorator(condition(etag_func=_stock_etag, last_modified_func=_stock_last_modified), name='retrieve')
 class StockViewSet(viewsets.ModelViewSet):
     queryset = Stock.objects.all()
     serializer_class = StockSerializer
@@ -19,10 +37,8 @@ class StockViewSet(viewsets.ModelViewSet):
     @action(detail=False, methods=['get'])
     def search(self, request):
         query = request.query_params.get('q', '')
-        stocks = Stock.objects.filter(
-            models.Q(symbol__icontains=query) |
-            models.Q(name__icontains=query)
-        )[:10]
+        ids = search_stocks(query)
+        stocks = sorted(Stock.objects.filter(pk__in=ids), key=lambda stock: ids.index(stock.pk))
         serializer = self.get_serializer(stocks, many=True)
         return Response(serializer.data)
 
@@ -32,7 +48,7 @@ class PortfolioViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return Portfolio.objects.filter(user=self.request.user)
+        return Portfolio.objects.filter(user=self.request.user).with_valuation()
 
     @action(detail=True, methods=['get'])
     def holdings(self, request, pk=None):
@@ -52,20 +68,21 @@ class PortfolioViewSet(viewsets.ModelViewSet):
     def performance(self, request, pk=None):
         portfolio = self.get_object()
 
-        # Generate performance data (last 30 days)
-        end_date = date.today()
-        start_date = end_date - timedelta(days=30)
-
-        reports = PortfolioReport.objects.filter(
-            portfolio=portfolio,
-            report_date__range=[start_date, end_date]
-        ).order_by('report_date')
+        # Real series from stored snapshots, optionally LTTB-downsampled; days and points are clamped
+        try:
+            days = int(request.query_params.get('days', 30))
+            points = request.query_params.get('points')
+            points = int(points) if points else None
+            series = performance_series(portfolio, days=days, interval=request.query_params.get('interval', 'daily'),
+                                        points=points)
+        except (ValueError, OverflowError) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
         data = {
-            'dates': [report.report_date.strftime('%Y-%m-%d') for report in reports],
-            'values': [float(report.total_value) for report in reports],
-            'cash': [float(report.cash_balance) for report in reports],
-            'investments': [float(report.investment_value) for report in reports],
+            'dates': [point['date'] for point in series],
+            'values': [point['value'] for point in series],
+            'cash': [point['cash'] for point in series],
+            'investments': [point['invested'] for point in series],
         }
 
         return Response(data)
@@ -94,9 +111,14 @@ class WatchlistViewSet(viewsets.ModelViewSet):
         serializer.save(user=self.request.user)
 
 
+@method_decorator(condition(etag_func=report_etag, last_modified_func=report_last_modified), name='retrieve')
 class ReportViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = PortfolioReportSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return PortfolioReport.objects.filter(portfolio__user=self.request.user)
\ No newline at end of file
+        reports = PortfolioReport.objects.filter(portfolio__user=self.request.user)
+        if self.action == 'list':
+            # Window annotations are only valid over whole portfolios, not a single pk lookup
+            reports = reports.with_change()
+        return reports
\ No newline at end of file
@@ -0,0 +1,270 @@
+# trading/archive.py
+"""Content-addressed, gzip-compressed archive of downloaded NSE CSVs.
+
+Every file is hashed (SHA-256 of its raw bytes) and stored once as
+``<NSE_ARCHIVE_DIR>/<digest[:2]>/<digest>.csv.gz``; byte-identical downloads
+share that blob. ``SnapshotFile`` rows are the manifest: one per file name,
+with its digest, sizes, index and snapshot time. Readers go through
+``open_snapshot`` or ``SnapshotReader`` and never need to know whether a
+file was archived.
+"""
+import codecs
+import csv
+import gzip
+import hashlib
+import os
+import tempfile
+from array import array
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.functions import Coalesce
+
+from .ingest import parse_snapshot_name
+from .models import SnapshotFile
+
+CHUNK_SIZE = 64 * 1024
+
+
+def raw_dir():
+    """Where downloads land before they are archived (and where legacy files live)."""
+    return settings.NSE_DATA_DIR
+
+
+def blob_path(digest):
+    return os.path.join(settings.NSE_ARCHIVE_DIR, digest[:2], f"{digest}.csv.gz")
+
+
+def _hash(path):
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(CHUNK_SIZE), b''):
+            digest.update(block)
+            size += len(block)
+    return digest.hexdigest(), size
+
+
+def index_path(digest):
+    return os.path.join(settings.NSE_ARCHIVE_DIR, digest[:2], f"{digest}.idx")
+
+
+def _store_blob(path, digest):
+    """Compress ``path`` into the blob for ``digest`` unless it already exists; returns (bytes, new).
+
+    The blob is a series of independent gzip members, one per ``CHUNK_SIZE``
+    raw bytes. Together they are an ordinary gzip file, and the ``.idx``
+    sidecar of member offsets lets readers decompress any byte range alone.
+    """
+    target = blob_path(digest)
+    if os.path.exists(target):
+        return os.path.getsize(target), False
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    offsets = array('Q')
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(target), suffix='.tmp')
+    try:
+        with open(path, 'rb') as src, os.fdopen(handle, 'wb') as out:
+            for block in iter(lambda: src.read(CHUNK_SIZE), b''):
+                offsets.append(out.tell())
+                out.write(gzip.compress(block, mtime=0))
+        with open(f"{tmp}.idx", 'wb') as f:
+            offsets.tofile(f)
+        # The blob appears last, so an existing blob always has its index
+        os.replace(f"{tmp}.idx", index_path(digest))
+        os.replace(tmp, target)
+    except BaseException:
+        for leftover in (tmp, f"{tmp}.idx"):
+            if os.path.exists(leftover):
+                os.remove(leftover)
+        raise
+    return os.path.getsize(target), True
+
+
+def archive_file(path, name=None, remove=True):
+    """Archive the CSV at ``path`` under ``name`` (default: its basename).
+
+    Returns ``(entry, stored)``; ``stored`` is False when an identical file was
+    already archived and only the manifest row was added. With ``remove``
+    the original is deleted once the entry is committed.
+    """
+    name = name or os.path.basename(path)
+    digest, size = _hash(path)
+    stored_size, stored = _store_blob(path, digest)
+    snapshot = parse_snapshot_name(name)
+    with transaction.atomic():
+        entry, _ = SnapshotFile.objects.update_or_create(name=name, defaults={
+            'digest': digest,
+            'size': size,
+            'stored_size': stored_size,
+            'index_type': snapshot[0] if snapshot else '',
+            'snapshot_at': snapshot[1] if snapshot else None,
+        })
+    if remove:
+        os.remove(path)
+    return entry, stored
+
+
+def get_snapshot(name):
+    """The manifest entry for ``name``, or ``None``."""
+    return SnapshotFile.objects.filter(name=name).first()
+
+
+def open_snapshot(name, entry=None):
+    """Open a snapshot for sequential binary reading, from the archive or else from ``data/nse``.
+
+    Raises ``FileNotFoundError`` when neither has it.
+    """
+    entry = entry or get_snapshot(name)
+    if entry is not None:
+        return gzip.open(blob_path(entry.digest), 'rb')
+    return open(_raw_path(name), 'rb')
+
+
+def _raw_path(name):
+    if os.path.basename(name) != name:
+        raise FileNotFoundError(name)
+    return os.path.join(raw_dir(), name)
+
+
+class SnapshotReader:
+    """Random access to a snapshot's raw bytes without reading the whole file.
+
+    Archived blobs are read member by member through their offset index;
+    raw files with plain seeks.
+    """
+
+    def __init__(self, name, entry=None):
+        entry = entry or get_snapshot(name)
+        self.offsets = None
+        if entry is not None:
+            self.size = entry.size
+            self._file = open(blob_path(entry.digest), 'rb')
+            if os.path.exists(index_path(entry.digest)):
+                with open(index_path(entry.digest), 'rb') as f:
+                    self.offsets = array('Q', f.read())
+                self._end = os.fstat(self._file.fileno()).st_size
+            else:
+                # Single-member blob: gzip can only seek by decompressing
+                self._file = gzip.GzipFile(fileobj=self._file, mode='rb')
+        else:
+            self._file = open(_raw_path(name), 'rb')
+            self.size = os.fstat(self._file.fileno()).st_size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self._file.close()
+
+    def _block(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i + 1] if i + 1 < len(self.offsets) else self._end
+        self._file.seek(start)
+        return gzip.decompress(self._file.read(end - start))
+
+    def iter_range(self, start=0, end=None):
+        """Yield the bytes ``[start, end)`` in chunks of at most ``CHUNK_SIZE``."""
+        end = self.size if end is None else min(end, self.size)
+        if self.offsets is None:
+            self._file.seek(start)
+            while start < end:
+                chunk = self._file.read(min(CHUNK_SIZE, end - start))
+                if not chunk:
+                    break
+                start += len(chunk)
+                yield chunk
+            return
+        while start < end:
+            block, skip = divmod(start, CHUNK_SIZE)
+            chunk = self._block(block)[skip:skip + end - start]
+            if not chunk:
+                break
+            start += len(chunk)
+            yield chunk
+
+    def read(self, start=0, end=None):
+        return b''.join(self.iter_range(start, end))
+
+    def head(self, lines):
+        """The first ``lines`` lines, reading only as far as needed."""
+        data = b''
+        for chunk in self.iter_range():
+            data += chunk
+            if data.count(b'\n') >= lines:
+                break
+        return b''.join(data.splitlines(keepends=True)[:lines])
+
+    def tail(self, lines):
+        """The last ``lines`` lines, reading backwards from the end of the file."""
+        data = b''
+        position = self.size
+        while position > 0 and data.rstrip(b'\n').count(b'\n') < lines:
+            # Step back whole blocks so each archived member is decompressed once
+            start = (position - 1) // CHUNK_SIZE * CHUNK_SIZE
+            data = self.read(start, position) + data
+            position = start
+        return b''.join(data.splitlines(keepends=True)[-lines:]) if lines else b''
+
+    def rows(self, offset=0, limit=50):
+        """``(header, rows)`` for parsed CSV rows ``offset`` to ``offset + limit``.
+
+        Parsing stops at the end of the window, so later rows are never read.
+        """
+        reader = csv.reader(_lines(codecs.iterdecode(self.iter_range(), 'utf-8-sig')))
+        header = [column.strip() for column in next(reader, [])]
+        return header, list(islice(reader, offset, offset + limit))
+
+
+def _lines(chunks):
+    """Split a stream of text chunks into lines, keeping line endings."""
+    pending = ''
+    for chunk in chunks:
+        pending += chunk
+        lines = pending.splitlines(keepends=True)
+        pending = lines.pop() if lines and not lines[-1].endswith(('\n', '\r')) else ''
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _unarchived(directory, known):
+    """``(name, path)`` of the CSVs in ``directory`` whose names are not in ``known``."""
+    if not os.path.isdir(directory):
+        return
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.lower().endswith('.csv') and name not in known and os.path.isfile(path):
+            yield name, path
+
+
+def list_snapshots():
+    return SnapshotFile.objects.all()
+
+
+def list_downloads():
+    """Every archived snapshot, newest first, from the manifest alone.
+
+    Raw files in ``data/nse`` are not listed until they are archived, which
+    the download paths do (``archive_directory``), so page loads never scan
+    the directory.
+    """
+    return SnapshotFile.objects.order_by(Coalesce('snapshot_at', 'created_at').desc(), '-id')
+
+
+def archive_directory(directory=None, remove=True):
+    """Archive every CSV in ``directory`` not yet in the manifest; returns ``(files, new_blobs)``.
+
+    With ``remove`` (the default, as for ``archive_file``) each raw file is
+    deleted once archived, so later sweeps have nothing left to look at.
+    """
+    known = set(SnapshotFile.objects.values_list('name', flat=True))
+    files = new_blobs = 0
+    for _, path in _unarchived(directory or raw_dir(), known):
+        _, stored = archive_file(path, remove=remove)
+        files += 1
+        new_blobs += stored
+    return files, new_blobs
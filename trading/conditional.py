@@ -0,0 +1,92 @@
+# trading/conditional.py
+"""ETag/Last-Modified validators for ``django.views.decorators.http.condition``.
+
+Each pair costs at most one small query (or a quote-cache read), shared
+between the two functions through the request. When the client's
+validators still match, Django answers ``304 Not Modified`` before the
+view body runs.
+"""
+import hashlib
+
+from django.db.models import Count, Max
+
+from .models import PortfolioReport, Stock
+from .quotes import get_quote
+
+# Exports of a report never change once it exists
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+
+def _etag(*parts):
+    return hashlib.md5('|'.join(map(str, parts)).encode()).hexdigest()
+
+
+def _memo(request, name, load):
+    memo = request.__dict__.setdefault('_conditional', {})
+    if name not in memo:
+        memo[name] = load()
+    return memo[name]
+
+
+def _view_variant(request):
+    """What else shapes the body: the user, HTMX partial vs full page and the query string."""
+    return request.user.pk, request.headers.get('HX-Request') == 'true', request.GET.urlencode()
+
+
+def request_quote(request, stock_id):
+    """The quote for ``stock_id``, looked up once per request by validators and view alike."""
+    return _memo(request, 'quote', lambda: get_quote(stock_id))
+
+
+def stock_price_etag(request, stock_id):
+    quote = request_quote(request, stock_id)
+    if quote is None or quote.get('last_updated') is None:
+        return None
+    return _etag('price', stock_id, quote['last_updated'].isoformat())
+
+
+def stock_price_last_modified(request, stock_id):
+    quote = request_quote(request, stock_id)
+    return None if quote is None else quote.get('last_updated')
+
+
+def _stock_table(request):
+    # Count catches deletions, which do not move the latest last_updated
+    return _memo(request, 'stocks', lambda: Stock.objects.aggregate(latest=Max('last_updated'), count=Count('id')))
+
+
+def stock_list_etag(request):
+    state = _stock_table(request)
+    return _etag('stocks', state['count'], state['latest'], *_view_variant(request))
+
+
+def stock_list_last_modified(request):
+    return _stock_table(request)['latest']
+
+
+def _report(request, pk):
+    return _memo(request, 'report', lambda: (
+        PortfolioReport.objects.filter(pk=pk, portfolio__user=request.user)
+        .values('created_at', 'portfolio__last_updated').first()
+    ))
+
+
+def report_etag(request, pk):
+    report = _report(request, pk)
+    if report is None:
+        return None
+    export = request.GET.get('export')
+    if export:
+        return _etag('report', pk, report['created_at'].isoformat(), export)
+    # The page also lists the portfolio's latest trades, which move Portfolio.last_updated
+    return _etag('report', pk, report['created_at'].isoformat(), report['portfolio__last_updated'].isoformat(),
+                 *_view_variant(request))
+
+
+def report_last_modified(request, pk):
+    report = _report(request, pk)
+    if report is None:
+        return None
+    if request.GET.get('export'):
+        return report['created_at']
+    return max(report['created_at'], report['portfolio__last_updated'])
@@ -0,0 +1,185 @@
+# trading/downloader.py
+"""NSE index CSV downloads shared by the data download view and ``download_nse_data``.
+
+NSE only serves its API to clients holding cookies from a page visit, so
+sessions are warmed once and then reused from a process-wide pool. Several
+indices are fetched concurrently, each with timeouts, exponential-backoff
+retries and a streamed write to a temporary file that is renamed into place
+only when complete.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from .ingest import snapshot_timestamp
+
+WARMUP_PATH = '/market-data/live-equity-market'
+HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept-Encoding": "gzip, deflate",
+}
+RETRY_STATUSES = {401, 403, 429, 500, 502, 503, 504}
+CHUNK_SIZE = 64 * 1024
+
+
+def index_url(index_name, base_url=None):
+    base_url = base_url or settings.NSE_BASE_URL
+    return f"{base_url}/api/equity-stockIndices?csv=true&index={quote(index_name)}&selectValFormat=crores"
+
+
+def snapshot_path(index_name, data_dir=None, when=None):
+    """Timestamped save path, e.g. ``data/nse/NIFTY_50_20250820_163235.csv`` (UTC)."""
+    data_dir = data_dir or settings.NSE_DATA_DIR
+    timestamp = snapshot_timestamp(when or timezone.now())
+    return os.path.join(data_dir, f"{index_name.replace(' ', '_')}_{timestamp}.csv")
+
+
+class SessionPool:
+    """Thread-safe pool of cookie-warmed ``requests.Session`` objects."""
+
+    def __init__(self, size=4, base_url=None, timeout=(5, 30)):
+        self.size = size
+        self.base_url = base_url or settings.NSE_BASE_URL
+        self.timeout = timeout
+        # Most recently used last, so warm sessions are reused first
+        self._idle = []
+        self._created = 0
+        self._available = threading.Condition()
+
+    def _new_session(self):
+        session = requests.Session()
+        session.headers.update(HEADERS)
+        session.headers['Referer'] = f"{self.base_url}{WARMUP_PATH}"
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        self.warm(session)
+        return session
+
+    def warm(self, session):
+        """Visit the market page so the session picks up NSE's cookies."""
+        session.cookies.clear()
+        session.get(f"{self.base_url}{WARMUP_PATH}", timeout=self.timeout).close()
+
+    def acquire(self):
+        """An idle session, a new one while under ``size``, or wait for a release."""
+        with self._available:
+            while not self._idle and self._created >= self.size:
+                # Woken by a release or a discard, which frees a slot to create into
+                self._available.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+        try:
+            return self._new_session()
+        except Exception:
+            self._forget(1)
+            raise
+
+    def _forget(self, count):
+        with self._available:
+            self._created -= count
+            self._available.notify(count)
+
+    def release(self, session, discard=False):
+        if discard:
+            session.close()
+            self._forget(1)
+        else:
+            with self._available:
+                self._idle.append(session)
+                self._available.notify()
+
+    def close(self):
+        """Close the idle sessions; sessions in use are unaffected."""
+        with self._available:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            session.close()
+        self._forget(len(idle))
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(base_url=None):
+    """The process-wide pool for ``base_url``, kept warm between calls."""
+    base_url = base_url or settings.NSE_BASE_URL
+    with _pools_lock:
+        if base_url not in _pools:
+            _pools[base_url] = SessionPool(base_url=base_url)
+        return _pools[base_url]
+
+
+def download_index(index_name, save_path, pool=None, retries=3, backoff=0.5):
+    """Stream one index CSV to ``save_path``; returns a result dict (never raises).
+
+    Failed attempts are retried after ``backoff * 2 ** attempt`` seconds; an
+    auth failure also re-warms the session's cookies first.
+    """
+    pool = pool or get_pool()
+    started = time.perf_counter()
+    result = {'index': index_name, 'path': save_path, 'ok': False, 'bytes': 0, 'attempts': 0, 'error': None}
+    partial = f"{save_path}.part"
+    for attempt in range(retries + 1):
+        result['attempts'] = attempt + 1
+        try:
+            session = pool.acquire()
+        except requests.RequestException as e:
+            result['error'] = f"warm-up failed: {e}"
+            if attempt < retries:
+                time.sleep(backoff * 2 ** attempt)
+            continue
+
+        discard = False
+        try:
+            with session.get(index_url(index_name, pool.base_url), timeout=pool.timeout, stream=True) as response:
+                if response.status_code in (401, 403):
+                    pool.warm(session)
+                response.raise_for_status()
+                os.makedirs(os.path.dirname(save_path) or '.', exist_ok=True)
+                size = 0
+                with open(partial, 'wb') as f:
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        f.write(chunk)
+                        size += len(chunk)
+            os.replace(partial, save_path)
+            result.update(ok=True, bytes=size, error=None)
+            break
+        except requests.HTTPError as e:
+            result['error'] = str(e)
+            if e.response is not None and e.response.status_code not in RETRY_STATUSES:
+                break
+        except (requests.RequestException, OSError) as e:
+            result['error'] = str(e)
+            discard = True
+        finally:
+            pool.release(session, discard=discard)
+            if os.path.exists(partial):
+                os.remove(partial)
+        if attempt < retries:
+            time.sleep(backoff * 2 ** attempt)
+
+    result['seconds'] = time.perf_counter() - started
+    if not result['ok']:
+        print(f"Failed to download {index_name}: {result['error']}")
+    return result
+
+
+def download_indices(targets, pool=None, max_workers=None, **kwargs):
+    """Download ``[(index_name, save_path), ...]`` concurrently; results keep the input order."""
+    targets = list(targets)
+    if not targets:
+        return []
+    pool = pool or get_pool()
+    workers = max_workers or min(len(targets), pool.size)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda target: download_index(*target, pool=pool, **kwargs), targets))
@@ -0,0 +1,334 @@
+# trading/exports.py
+"""PDF and Excel exports of portfolio reports, rendered once and kept on disk.
+
+A ``PortfolioReport`` never changes after it is created, so each export is
+a pure function of the report, the format and ``TEMPLATE_VERSION`` (bump it
+whenever a renderer changes). Files live under ``settings.EXPORT_CACHE_DIR``
+named by a hash of that key plus the report's ``created_at``, so a report id
+reused after a database reset never serves a stale file.
+
+Files are written to a temporary name and renamed into place, so concurrent
+renders of the same export are harmless. Serving a file touches its mtime;
+when the directory grows past ``settings.EXPORT_CACHE_MAX_BYTES`` the least
+recently served files are deleted first. A response opens its file before
+any eviction runs, and eviction never deletes the export just rendered, so
+a download is served even when it alone is larger than the cache.
+
+Querysets are read with ``.iterator()``, and the Excel workbook is
+write-only, so memory stays flat however many rows there are. A
+portfolio's full trade and report histories are not cached; they stream
+out as CSV.
+"""
+import csv
+import hashlib
+import os
+import tempfile
+
+import openpyxl
+from django.conf import settings
+from django.http import FileResponse, StreamingHttpResponse
+from openpyxl.cell import Cell, WriteOnlyCell
+from openpyxl.styles import Font, PatternFill
+from openpyxl.utils import get_column_letter
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+from .models import PortfolioReport, Transaction
+from .quotes import SharedCounters
+
+TEMPLATE_VERSION = 2
+# Rows fetched per round trip when streaming querysets
+CHUNK_SIZE = 2000
+# Rows measured for Excel column widths before the sheet starts streaming
+WIDTH_SAMPLE = 1000
+
+# Shared by all processes, like the quote cache counters
+counters = SharedCounters('exports', ['hits', 'misses', 'renders', 'evictions'])
+
+
+def holding_rows(report):
+    """The report's holding snapshots with their stocks, streamed in chunks from one query."""
+    return report.holding_reports.select_related('holding__stock').order_by('pk').iterator(chunk_size=CHUNK_SIZE)
+
+
+def render_pdf(report, out):
+    doc = SimpleDocTemplate(out, pagesize=A4)
+    elements = []
+    styles = getSampleStyleSheet()
+
+    elements.append(Paragraph(f"Portfolio Report - {report.report_date}", styles['Title']))
+
+    data = [
+        ['Total Value', f'{report.total_value:,.2f}'],
+        ['Cash Balance', f'{report.cash_balance:,.2f}'],
+        ['Invested Value', f'{report.investment_value:,.2f}']
+    ]
+    t = Table(data)
+    t.setStyle(TableStyle([('GRID', (0, 0), (-1, -1), 1, colors.black)]))
+    elements.append(t)
+    elements.append(Spacer(1, 20))
+
+    h_data = [['Symbol', 'Qty', 'Avg Price', 'Current', 'P/L %']]
+    for hr in holding_rows(report):
+        h_data.append([
+            hr.holding.stock.symbol,
+            str(hr.quantity),
+            f'{hr.average_price:.2f}',
+            f'{hr.current_price:.2f}',
+            f'{hr.profit_loss_percentage:.2f}%'
+        ])
+    if len(h_data) > 1:
+        elements.append(Paragraph("Holdings", styles['Heading2']))
+        t2 = Table(h_data)
+        t2.setStyle(TableStyle([('GRID', (0, 0), (-1, -1), 1, colors.black)]))
+        elements.append(t2)
+
+    doc.build(elements)
+
+
+class ColumnWidths:
+    """Running maximum of each column's text length, updated row by row."""
+
+    def __init__(self):
+        self.lengths = []
+
+    def update(self, row):
+        for i, value in enumerate(row):
+            if isinstance(value, Cell):
+                value = value.value
+            length = 0 if value is None else len(str(value))
+            if i == len(self.lengths):
+                self.lengths.append(length)
+            elif length > self.lengths[i]:
+                self.lengths[i] = length
+
+    def apply(self, ws):
+        for i, length in enumerate(self.lengths, 1):
+            ws.column_dimensions[get_column_letter(i)].width = length + 2
+
+
+def write_rows(ws, rows, sample=WIDTH_SAMPLE):
+    """Append ``rows`` to a write-only sheet, sizing columns to fit.
+
+    Write-only sheets emit column widths before the first row, so widths
+    come from the first ``sample`` rows, held back until they are measured;
+    everything after streams straight through.
+    """
+    rows = iter(rows)
+    widths = ColumnWidths()
+    held = []
+    for row in rows:
+        widths.update(row)
+        held.append(row)
+        if len(held) >= sample:
+            break
+    widths.apply(ws)
+    for row in held:
+        ws.append(row)
+    for row in rows:
+        ws.append(row)
+
+
+def _report_sheet_rows(report, ws):
+    def styled(value, **style):
+        cell = WriteOnlyCell(ws, value=value)
+        for name, attr in style.items():
+            setattr(cell, name, attr)
+        return cell
+
+    yield [styled("Portfolio Report", font=Font(size=14, bold=True))]
+    yield []
+    yield ["Date", report.report_date]
+    yield ["Total Value", report.total_value]
+    yield ["Cash Balance", report.cash_balance]
+    yield ["Invested Value", report.investment_value]
+    yield []
+    yield [styled("Holdings Breakdown", font=Font(bold=True))]
+
+    header_fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
+    headers = ['Symbol', 'Quantity', 'Avg Price', 'Current Price', 'Current Value', 'P/L', 'P/L %']
+    yield [styled(header, font=Font(bold=True), fill=header_fill) for header in headers]
+
+    for hr in holding_rows(report):
+        yield [hr.holding.stock.symbol, hr.quantity, hr.average_price, hr.current_price, hr.current_value,
+               hr.profit_loss, hr.profit_loss_percentage]
+
+
+def render_excel(report, out):
+    # Write-only: rows go to a temporary file as they are appended instead of living in memory
+    wb = openpyxl.Workbook(write_only=True)
+    ws = wb.create_sheet(f"Report {report.report_date}")
+    write_rows(ws, _report_sheet_rows(report, ws))
+    wb.save(out)
+
+
+# format -> (renderer, extension, content type, download name)
+FORMATS = {
+    'pdf': (render_pdf, 'pdf', 'application/pdf', lambda report: f"report_{report.id}.pdf"),
+    'excel': (render_excel, 'xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+              lambda report: f"portfolio_report_{report.report_date}.xlsx"),
+}
+
+
+def export_path(report, fmt):
+    _, extension, _, _ = FORMATS[fmt]
+    key = f"{report.pk}:{report.created_at.isoformat()}:{fmt}:{TEMPLATE_VERSION}"
+    digest = hashlib.sha256(key.encode()).hexdigest()
+    return os.path.join(settings.EXPORT_CACHE_DIR, digest[:2], f"{digest}.{extension}")
+
+
+def _write_export(report, fmt, path):
+    render = FORMATS[fmt][0]
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    handle, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(handle, 'wb') as f:
+            render(report, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    counters.incr('renders')
+
+
+def render_export(report, fmt):
+    """Write the export to the cache unless it is already there; returns its path."""
+    path = export_path(report, fmt)
+    if not os.path.exists(path):
+        _write_export(report, fmt, path)
+        evict(keep=path)
+    return path
+
+
+def open_export(report, fmt, attempts=3):
+    """The cached export opened for reading, rendering it on a miss.
+
+    The file is opened before anything is evicted, and an open file stays
+    readable after another process deletes it, so eviction can never pull
+    an export out from under a response.
+    """
+    path = export_path(report, fmt)
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        counters.incr('misses')
+    else:
+        counters.incr('hits')
+        try:
+            # Mark as recently used for eviction
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return f
+    for _ in range(attempts):
+        _write_export(report, fmt, path)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            # Evicted by another process between the rename and the open
+            continue
+        evict(keep=path)
+        return f
+    raise FileNotFoundError(path)
+
+
+def export_response(report, fmt):
+    _, _, content_type, filename = FORMATS[fmt]
+    return FileResponse(open_export(report, fmt), as_attachment=True, filename=filename(report),
+                        content_type=content_type)
+
+
+def _cached_files():
+    """``(mtime, size, path)`` for every cached export."""
+    root = settings.EXPORT_CACHE_DIR
+    if not os.path.isdir(root):
+        return []
+    files = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            if name.endswith('.tmp'):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+    return files
+
+
+def evict(max_bytes=None, keep=None):
+    """Delete least recently served exports until the cache fits in ``max_bytes``; returns the count.
+
+    ``keep`` (the export just rendered) is never deleted, even if it alone
+    exceeds ``max_bytes``.
+    """
+    if max_bytes is None:
+        max_bytes = settings.EXPORT_CACHE_MAX_BYTES
+    files = sorted(_cached_files())
+    total = sum(size for _, size, _ in files)
+    evicted = 0
+    for _, size, path in files:
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        evicted += 1
+    counters.incr('evictions', evicted)
+    return evicted
+
+
+def export_cache_stats():
+    files = _cached_files()
+    hits, misses = counters['hits'], counters['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        'renders': counters['renders'],
+        'evictions': counters['evictions'],
+        'files': len(files),
+        'bytes': sum(size for _, size, _ in files),
+        'max_bytes': settings.EXPORT_CACHE_MAX_BYTES,
+    }
+
+
+class _Echo:
+    """File-like object whose ``write`` hands the line back, so ``csv.writer`` can feed a stream."""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(rows, filename):
+    writer = csv.writer(_Echo())
+    response = StreamingHttpResponse((writer.writerow(row) for row in rows), content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+def transaction_csv_rows(portfolio):
+    """Header, then every trade of ``portfolio`` oldest first, streamed in chunks."""
+    yield ['Timestamp', 'Symbol', 'Type', 'Quantity', 'Price', 'Total', 'Notes']
+    transactions = (Transaction.objects.filter(portfolio=portfolio).select_related('stock')
+                    .order_by('timestamp', 'pk').iterator(chunk_size=CHUNK_SIZE))
+    for t in transactions:
+        yield [t.timestamp.isoformat(), t.stock.symbol, t.transaction_type, t.quantity, t.price_per_share,
+               t.total_cost, t.notes or '']
+
+
+def report_csv_rows(portfolio):
+    """Header, then every report of ``portfolio`` oldest first with its change, streamed in chunks."""
+    yield ['Date', 'Created', 'Total Value', 'Cash Balance', 'Invested Value', 'Change', 'Change %']
+    reports = (PortfolioReport.objects.filter(portfolio=portfolio).with_change()
+               .order_by('report_date', 'created_at', 'id').iterator(chunk_size=CHUNK_SIZE))
+    for r in reports:
+        yield [r.report_date, r.created_at.isoformat(), r.total_value, r.cash_balance, r.investment_value,
+               r.value_change, round(r.value_change_pct, 2)]
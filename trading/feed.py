@@ -0,0 +1,151 @@
+# trading/feed.py
+"""Change-detecting market feed: diff each price snapshot and write only what moved.
+
+``MarketFeed`` keeps the last known price, change from the previous close
+and day/52-week range of every stock in memory. Each tick it compares a snapshot against that map,
+bulk-updates only the stocks whose price or range moved, marks affected
+portfolios to market and sends
+``price_tick`` with the change set, so other components can subscribe
+in-process::
+
+    @receiver(price_tick)
+    def on_tick(sender, changes, at, **kwargs):
+        ...
+"""
+from collections import namedtuple
+from decimal import Decimal
+
+from django.db import connection, transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from .ingest import clean_nse_frame, ohlcv_frame
+from .models import Stock, change_percent
+from .price_history import PriceHistory
+from .quotes import invalidate_quotes
+from .valuation import mark_to_market
+
+# Sent after each tick that changed prices, with ``changes`` (list of PriceChange) and ``at``
+price_tick = Signal()
+
+PriceChange = namedtuple('PriceChange', 'stock_id symbol old new')
+Tick = namedtuple('Tick', 'at prices frame')
+Quote = namedtuple('Quote', 'stock_id price prev_close change_pct day_high day_low year_high year_low')
+QUOTE_FIELDS = ['current_price', 'prev_close', 'change_pct', 'day_high', 'day_low', 'year_high', 'year_low']
+
+
+def snapshot_prices(df):
+    """``{symbol: Decimal price}`` for the valid rows of a raw NSE frame."""
+    frame, _ = clean_nse_frame(df)
+    return {symbol: Decimal(f"{price:.2f}") for symbol, price in zip(frame['symbol'], frame['current_price'])}
+
+
+def write_quotes(quotes, now, batch_size=500):
+    """Persist ``Quote`` rows with one parameterised UPDATE run ``executemany`` per batch.
+
+    ``bulk_update`` compiles a CASE expression per row and field, which
+    dominates once thousands of prices move per tick; the same statement
+    reused for every row costs the database, not Python.
+    """
+    fields = [Stock._meta.get_field(name) for name in QUOTE_FIELDS + ['last_updated']]
+    qn = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        qn(Stock._meta.db_table),
+        ', '.join(f"{qn(field.column)} = %s" for field in fields),
+        qn(Stock._meta.pk.column),
+    )
+    stamp = fields[-1].get_db_prep_save(now, connection)
+    prep = [field.get_db_prep_save for field in fields[:-1]]
+    params = [
+        [f(value, connection) for f, value in zip(prep, quote[1:])] + [stamp, quote.stock_id]
+        for quote in quotes
+    ]
+    with connection.cursor() as cursor:
+        for start in range(0, len(params), batch_size):
+            cursor.executemany(sql, params[start:start + batch_size])
+
+
+class MarketFeed:
+    def __init__(self, history=True, batch_size=500):
+        self.history = PriceHistory() if history else None
+        self.batch_size = batch_size
+        self.last_prices = {}
+        self.ticks = 0
+        self.reload()
+
+    def reload(self):
+        """Resynchronise the last-known-quote map from the database (one query)."""
+        self.last_prices = {}
+        # Date each stock was last written: its quote belongs to that session
+        self.sessions = {}
+        for symbol, *row, last_updated in Stock.objects.values_list('symbol', 'id', *QUOTE_FIELDS, 'last_updated'):
+            self.last_prices[symbol] = Quote(*row)
+            self.sessions[symbol] = last_updated.date() if last_updated else None
+
+    def diff(self, prices):
+        """Changes between ``prices`` and the last known prices; unknown symbols are ignored."""
+        changes = []
+        for symbol, new in prices.items():
+            known = self.last_prices.get(symbol)
+            if known is not None and known.price != new:
+                changes.append(PriceChange(known.stock_id, symbol, known.price, new))
+        return changes
+
+    def quotes(self, tick):
+        """``{symbol: Quote}`` for the stocks whose price or range ``tick`` moves.
+
+        When a stock was last written on an earlier date (including before
+        this feed started) its day range restarts and its last price becomes
+        the previous close.
+        """
+        today = tick.at.date()
+        moved = {}
+        for symbol, price in tick.prices.items():
+            known = self.last_prices.get(symbol)
+            if known is None:
+                continue
+            session = self.sessions.get(symbol)
+            new_day = session is not None and today > session
+            prev_close = known.price if new_day else known.prev_close
+            quote = Quote(
+                known.stock_id,
+                price,
+                prev_close,
+                change_percent(price, prev_close),
+                price if new_day or known.day_high is None else max(known.day_high, price),
+                price if new_day or known.day_low is None else min(known.day_low, price),
+                price if known.year_high is None else max(known.year_high, price),
+                price if known.year_low is None else min(known.year_low, price),
+            )
+            if quote != known:
+                moved[symbol] = quote
+        return moved
+
+    def apply(self, tick):
+        """Write the changed prices and ranges of ``tick`` in one bulk update; returns the price changes."""
+        changes = self.diff(tick.prices)
+        moved = self.quotes(tick)
+        if moved:
+            now = timezone.now()
+            with transaction.atomic():
+                # The in-memory prices go stale when an ingest or a manual update moves a stock,
+                # so mark to market from the stored prices, locked until the new ones are written
+                stored = dict(Stock.objects.select_for_update()
+                              .filter(pk__in=[quote.stock_id for quote in moved.values()])
+                              .values_list('id', 'current_price'))
+                changes = [change._replace(old=stored.get(change.stock_id, change.old)) for change in changes]
+                write_quotes(moved.values(), now, self.batch_size)
+                mark_to_market({quote.stock_id: (stored.get(quote.stock_id), quote.price) for quote in moved.values()})
+                transaction.on_commit(invalidate_quotes)
+            self.last_prices.update(moved)
+            self.sessions.update(dict.fromkeys(moved, tick.at.date()))
+        if self.history is not None and tick.frame is not None:
+            try:
+                rows, _ = ohlcv_frame(tick.frame)
+                self.history.append_snapshot(tick.at, rows.round(2).itertuples(index=False, name=None))
+            except Exception as e:
+                print(f"Error writing price history: {str(e)}")
+        self.ticks += 1
+        if changes:
+            price_tick.send(sender=MarketFeed, changes=changes, at=tick.at)
+        return changes
@@ -21,10 +21,42 @@ from django import forms
 from .models import Transaction, Portfolio, Stock
 
 from django import forms
+from django.urls import reverse
+
 from .models import Transaction, Portfolio, Stock, Holding
+from .quotes import get_quotes
+
+
+class StockSearchSelect(forms.Select):
+    """A stock ``<select>`` that renders only the chosen stock.
+
+    The other options come from the autocomplete endpoint as the user types
+    (see ``js/stock_picker.js``), so the form stays the same size however many
+    stocks exist. Labels come from the quote cache.
+    """
+    template_name = 'trading/widgets/stock_search_select.html'
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        context['widget']['search_url'] = reverse('trading:stock_search')
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        selected = [pk for pk in value if str(pk).isdigit()]
+        quotes = get_quotes(selected)
+        options = [
+            self.create_option(name, q['id'], f"{q['symbol']} - {q['name']} (₹{q['current_price']})", True, i)
+            for i, q in enumerate(quotes[pk] for pk in map(int, selected) if pk in quotes)
+        ]
+        return [(None, options, 0)] if options else []
 
 
 class TradeForm(forms.ModelForm):
+    # Resolved by primary key on submit; the widget never lists the whole table
+    stock = forms.ModelChoiceField(
+        queryset=Stock.objects.all(),
+        widget=StockSearchSelect(attrs={'class': 'form-control', 'id': 'id_stock'}),
+    )
     portfolio = forms.ModelChoiceField(
         queryset=Portfolio.objects.none(),
         widget=forms.Select(attrs={'class': 'form-control'}),
@@ -36,7 +68,6 @@ class TradeForm(forms.ModelForm):
         model = Transaction
         fields = ['portfolio', 'stock', 'transaction_type', 'quantity', 'price_per_share', 'notes']
         widgets = {
-            'stock': forms.Select(attrs={'class': 'form-control', 'id': 'id_stock'}),
             'transaction_type': forms.Select(attrs={'class': 'form-control', 'id': 'id_transaction_type'}),
             'quantity': forms.NumberInput(attrs={'class': 'form-control', 'id': 'id_quantity', 'min': '1'}),
             'price_per_share': forms.NumberInput(
@@ -0,0 +1,139 @@
+# trading/history.py
+"""Historical OHLCV snapshots in ``NSEData``, backfilled from the archived and raw NSE CSVs.
+
+Each CSV is one point-in-time snapshot; its time (UTC, as written by the
+download view) and index come from the filename, e.g.
+``NIFTY_50_20250820_163235.csv``. Parsing is pure pandas so it
+can run in worker processes; only the parent writes to the database.
+"""
+import glob
+import hashlib
+import json
+import os
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+
+from .archive import blob_path
+from .ingest import ohlcv_frame, parse_snapshot_name, read_nse_csv
+from .models import NSEData, SnapshotFile
+from .price_history import PriceHistory
+
+SYMBOL_MAX_LENGTH = NSEData._meta.get_field('symbol').max_length
+
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def parse_snapshot(file_path, name=None, digest=None):
+    """Parse one snapshot CSV into plain row tuples; safe to run in a worker process.
+
+    ``file_path`` may be a raw CSV or an archived ``.csv.gz`` blob, in which
+    case ``name`` gives the original file name. Returns a dict with the
+    file's ``name``, ``digest``, ``index_type``, ``snapshot_at``,
+    ``rows`` as ``(symbol, open, high, low, close, volume)`` tuples and the
+    ``skipped`` row count. Rows missing any price are skipped; a missing
+    volume is stored as 0.
+    """
+    name = name or os.path.basename(file_path)
+    index_type, snapshot_at = parse_snapshot_name(name)
+    df = read_nse_csv(file_path)
+    frame, _ = ohlcv_frame(df)
+    frame = frame[frame['symbol'].str.len() <= SYMBOL_MAX_LENGTH].round(2)
+    rows = list(frame.itertuples(index=False, name=None))
+    return {
+        'name': name,
+        'digest': digest or file_digest(file_path),
+        'index_type': index_type,
+        'snapshot_at': snapshot_at,
+        'rows': rows,
+        'skipped': len(df) - len(rows),
+    }
+
+
+def _decimal(value):
+    return Decimal(f"{value:.2f}")
+
+
+def store_snapshot(parsed, batch_size=1000):
+    """Insert a parsed snapshot into ``NSEData`` and the price history files.
+
+    Rows already stored are ignored in both. Returns the rows inserted.
+    """
+    objs = [
+        NSEData(
+            symbol=symbol, name=symbol, open_price=_decimal(open_), high_price=_decimal(high),
+            low_price=_decimal(low), close_price=_decimal(close), volume=volume,
+            index_type=parsed['index_type'], snapshot_at=parsed['snapshot_at'],
+        )
+        for symbol, open_, high, low, close, volume in parsed['rows']
+    ]
+    stored = NSEData.objects.filter(snapshot_at=parsed['snapshot_at'], index_type=parsed['index_type'])
+    with transaction.atomic():
+        before = stored.count()
+        NSEData.objects.bulk_create(objs, batch_size=batch_size, ignore_conflicts=True)
+        inserted = stored.count() - before
+    PriceHistory().append_snapshot(parsed['snapshot_at'], parsed['rows'])
+    return inserted
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_manifest(path, manifest):
+    """Write the manifest atomically so an interrupted run never leaves it half-written."""
+    tmp = f"{path}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+
+def snapshot_sources(directory):
+    """``(path, name, digest)`` for every archived snapshot and every raw CSV in ``directory``.
+
+    Archived entries win over a raw file of the same name; raw digests are
+    computed lazily by ``pending_snapshots``.
+    """
+    sources = {
+        entry.name: (blob_path(entry.digest), entry.name, entry.digest)
+        for entry in SnapshotFile.objects.only('name', 'digest')
+    }
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        sources.setdefault(os.path.basename(path), (path, os.path.basename(path), None))
+    return [sources[name] for name in sorted(sources)]
+
+
+def pending_snapshots(sources, manifest):
+    """Snapshot sources not yet in ``manifest`` or whose contents changed since."""
+    pending = []
+    for path, name, digest in sources:
+        if parse_snapshot_name(name) is None:
+            continue
+        digest = digest or file_digest(path)
+        entry = manifest.get(name)
+        if entry and entry['digest'] == digest:
+            continue
+        pending.append((path, name, digest))
+    return pending
+
+
+def manifest_entry(parsed, stored):
+    return {
+        'digest': parsed['digest'],
+        'index_type': parsed['index_type'],
+        'snapshot_at': parsed['snapshot_at'].isoformat(),
+        'rows': len(parsed['rows']),
+        'inserted': stored,
+        'skipped': parsed['skipped'],
+        'ingested_at': timezone.now().isoformat(),
+    }
@@ -0,0 +1,235 @@
+# trading/ingest.py
+"""Vectorised NSE CSV ingestion into ``Stock`` via chunked bulk upserts."""
+import os
+import re
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Stock, change_percent
+from .price_history import PriceHistory
+from .quotes import invalidate_quotes
+from .search import invalidate_search_index
+from .valuation import mark_to_market
+
+SYMBOL_MAX_LENGTH = Stock._meta.get_field('symbol').max_length
+SNAPSHOT_FILENAME = re.compile(r'^(NIFTY_50|SECURITIES_IN_F&O)_(\d{8}_\d{6})\.csv$', re.IGNORECASE)
+INDEX_TYPES = {'NIFTY_50': 'NIFTY50', 'SECURITIES_IN_F&O': 'FNO'}
+# Snapshot filenames carry their download time in UTC
+SNAPSHOT_TIME_FORMAT = '%Y%m%d_%H%M%S'
+
+# CSV columns mapped onto Stock fields; the first column present in the file wins
+PRICE_COLUMNS = ['LTP', 'PREV_CLOSE', 'PREV. CLOSE']
+NUMERIC_COLUMNS = {
+    'day_high': ['HIGH'],
+    'day_low': ['LOW'],
+    'year_high': ['52W H'],
+    'year_low': ['52W L'],
+    'prev_close': ['PREV. CLOSE', 'PREV_CLOSE'],
+}
+TEXT_COLUMNS = {
+    'name': ['COMPANY_NAME', 'SERIES'],
+    'sector': ['INDUSTRY', 'SECTOR'],
+}
+
+
+def snapshot_timestamp(when):
+    """The filename timestamp for an aware ``when``, converted to UTC."""
+    return when.astimezone(dt_timezone.utc).strftime(SNAPSHOT_TIME_FORMAT)
+
+
+def parse_snapshot_name(file_path):
+    """Return ``(index_type, snapshot_at)`` for a timestamped snapshot filename, or ``None``."""
+    match = SNAPSHOT_FILENAME.match(os.path.basename(file_path))
+    if not match:
+        return None
+    snapshot_at = datetime.strptime(match.group(2), SNAPSHOT_TIME_FORMAT).replace(tzinfo=dt_timezone.utc)
+    return INDEX_TYPES[match.group(1).upper()], snapshot_at
+
+
+def read_nse_csv(file_path):
+    df = pd.read_csv(file_path, encoding='utf-8-sig', skipinitialspace=True, dtype=str)
+    df.columns = df.columns.str.strip().str.upper()
+    if 'SYMBOL' not in df.columns:
+        raise ValueError("CSV file missing 'SYMBOL' column")
+    return df
+
+
+def to_number(series):
+    """Strip thousands separators and coerce to float; '-' and junk become NaN."""
+    return pd.to_numeric(series.str.replace(',', '', regex=False).str.strip(), errors='coerce')
+
+
+def clean_nse_frame(df):
+    """Return ``(frame, skipped)``: one valid row per symbol with Stock field columns.
+
+    Rows without a symbol, with an over-long symbol or without a usable price
+    are dropped as a mask, never row by row. Duplicate symbols keep the last row.
+    """
+    symbols = df['SYMBOL'].str.strip()
+    price_column = next((c for c in PRICE_COLUMNS if c in df.columns), None)
+    if price_column is None:
+        price = pd.Series(float('nan'), index=df.index)
+    else:
+        price = to_number(df[price_column])
+
+    clean = pd.DataFrame({'symbol': symbols, 'current_price': price.round(2)})
+    for field, columns in NUMERIC_COLUMNS.items():
+        column = next((c for c in columns if c in df.columns), None)
+        if column:
+            clean[field] = to_number(df[column]).round(2)
+    if 'prev_close' in clean.columns:
+        prev_close = clean['prev_close'].where(clean['prev_close'] > 0)
+        clean['change_pct'] = ((clean['current_price'] - prev_close) / prev_close * 100).round(2)
+    volume_column = next((c for c in df.columns if c.startswith('VOLUME')), None)
+    if volume_column:
+        clean['volume'] = to_number(df[volume_column])
+    for field, columns in TEXT_COLUMNS.items():
+        column = next((c for c in columns if c in df.columns), None)
+        if column:
+            clean[field] = df[column].str.strip()
+
+    valid = (
+        symbols.notna() & (symbols != '') & (symbols.str.len() <= SYMBOL_MAX_LENGTH)
+        & clean['current_price'].notna() & (clean['current_price'] > 0)
+    )
+    clean = clean[valid].drop_duplicates('symbol', keep='last')
+    return clean, len(df) - len(clean)
+
+
+def ohlcv_frame(df):
+    """Return ``(frame, skipped)`` with symbol/open/high/low/close/volume columns.
+
+    Close is the LTP (or previous close); rows missing any price are dropped
+    and a missing volume becomes 0.
+    """
+    symbols = df['SYMBOL'].str.strip()
+    close_column = next((c for c in PRICE_COLUMNS if c in df.columns), None)
+    frame = pd.DataFrame({
+        'symbol': symbols,
+        'open': to_number(df['OPEN']) if 'OPEN' in df.columns else float('nan'),
+        'high': to_number(df['HIGH']) if 'HIGH' in df.columns else float('nan'),
+        'low': to_number(df['LOW']) if 'LOW' in df.columns else float('nan'),
+        'close': to_number(df[close_column]) if close_column else float('nan'),
+    })
+    volume_column = next((c for c in df.columns if c.startswith('VOLUME')), None)
+    frame['volume'] = to_number(df[volume_column]).fillna(0).astype('int64') if volume_column else 0
+
+    valid = symbols.notna() & (symbols != '') & frame[['open', 'high', 'low', 'close']].notna().all(axis=1)
+    frame = frame[valid]
+    return frame, len(df) - len(frame)
+
+
+def _decimal(value):
+    return None if pd.isna(value) else Decimal(f"{value:.2f}")
+
+
+def upsert_stocks(frame, chunk_size=1000):
+    """Bulk upsert a cleaned frame; returns ``(created, updated)``.
+
+    Each chunk is one transaction: read the existing prices, previous closes and names, then one
+    ``INSERT ... ON CONFLICT (symbol) DO UPDATE``, then mark affected portfolios
+    to market with the price deltas.
+    """
+    numeric_fields = [f for f in list(NUMERIC_COLUMNS) + ['change_pct'] if f in frame.columns]
+    has_volume = 'volume' in frame.columns
+    has_name = 'name' in frame.columns
+    has_sector = 'sector' in frame.columns
+    # Only overwrite descriptive fields the file actually carries
+    update_fields = ['current_price', 'exchange', 'last_updated'] + numeric_fields
+    update_fields += ['volume'] if has_volume else []
+    update_fields += ['name'] if has_name else []
+    update_fields += ['sector'] if has_sector else []
+    # Without a previous close in the file, change_pct is recomputed against the stored one, as Stock.save() does
+    recompute_change = 'prev_close' not in frame.columns
+    update_fields += ['change_pct'] if recompute_change else []
+
+    created = updated = 0
+    for start in range(0, len(frame), chunk_size):
+        chunk = frame.iloc[start:start + chunk_size]
+        records = chunk.to_dict('records')
+        with transaction.atomic():
+            existing = {
+                symbol: (pk, price, prev_close, name, sector)
+                for symbol, pk, price, prev_close, name, sector
+                in Stock.objects.select_for_update().filter(symbol__in=chunk['symbol'].tolist())
+                .values_list('symbol', 'id', 'current_price', 'prev_close', 'name', 'sector')
+            }
+            stocks = []
+            price_changes = {}
+            for record in records:
+                price = _decimal(record['current_price'])
+                stored = existing.get(record['symbol'])
+                # A blank name or sector cell keeps what is stored rather than clearing it
+                name = record.get('name')
+                if pd.isna(name) or not name:
+                    name = stored[3] if stored else record['symbol']
+                sector = record.get('sector')
+                if pd.isna(sector):
+                    sector = stored[4] if stored else None
+                stock = Stock(
+                    symbol=record['symbol'],
+                    name=name,
+                    current_price=price,
+                    sector=sector,
+                    exchange='NSE',
+                    **{field: _decimal(record[field]) for field in numeric_fields},
+                )
+                if has_volume:
+                    stock.volume = None if pd.isna(record['volume']) else int(record['volume'])
+                if recompute_change:
+                    stock.change_pct = change_percent(price, stored[2] if stored else None)
+                stocks.append(stock)
+                if stored:
+                    price_changes[stored[0]] = (stored[1], price)
+
+            Stock.objects.bulk_create(
+                stocks,
+                update_conflicts=True,
+                unique_fields=['symbol'],
+                update_fields=update_fields,
+            )
+            mark_to_market(price_changes)
+        updated += len(price_changes)
+        created += len(stocks) - len(price_changes)
+    transaction.on_commit(invalidate_quotes)
+    transaction.on_commit(invalidate_search_index)
+    return created, updated
+
+
+def ingest_nse_csv(file_path, chunk_size=1000, name=None):
+    """Parse, clean and upsert one NSE CSV; returns counts and timings.
+
+    ``file_path`` may also be an open binary file, with ``name`` giving its
+    file name. The file's OHLCV rows are also appended to the price history,
+    stamped with the time in its name (or now).
+    """
+    name = name or os.path.basename(str(file_path))
+    started = time.perf_counter()
+    df = read_nse_csv(file_path)
+    frame, skipped = clean_nse_frame(df)
+    parsed = time.perf_counter()
+    created, updated = upsert_stocks(frame, chunk_size=chunk_size)
+    finished = time.perf_counter()
+
+    snapshot = parse_snapshot_name(name)
+    snapshot_at = snapshot[1] if snapshot else timezone.now()
+    try:
+        history, _ = ohlcv_frame(df)
+        history_rows = PriceHistory().append_snapshot(snapshot_at, history.round(2).itertuples(index=False, name=None))
+    except Exception as e:
+        print(f"Error writing price history for {name}: {str(e)}")
+        history_rows = 0
+    return {
+        'created': created,
+        'updated': updated,
+        'skipped': skipped,
+        'history_rows': history_rows,
+        'parse_seconds': parsed - started,
+        'write_seconds': finished - parsed,
+        'seconds': finished - started,
+    }
@@ -0,0 +1,197 @@
+# trading/jobs.py
+"""Local, database-backed job queue.
+
+Jobs are rows in ``Job``; the ``run_jobs`` management command claims and runs
+them. Enqueueing a job whose key matches a job still pending is a no-op, so a
+burst of trades on one portfolio produces a single snapshot. With
+``settings.TRADING_JOBS_SYNC`` set, jobs run inline (used by tests).
+"""
+import json
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Avg, DurationField, ExpressionWrapper, F, Max, Min
+from django.utils import timezone
+
+from .archive import archive_directory, archive_file, open_snapshot
+from .downloader import download_indices, snapshot_path
+from .exports import FORMATS, render_export
+from .ingest import ingest_nse_csv
+from .models import Job, Portfolio, PortfolioReport
+
+HANDLERS = {}
+
+
+def handler(kind):
+    """Register ``func`` as the handler for jobs of ``kind``."""
+    def register(func):
+        HANDLERS[kind] = func
+        return func
+    return register
+
+
+def enqueue(kind, key=None, **payload):
+    """Queue a job, coalescing it with a pending job of the same key.
+
+    Returns the pending ``Job`` (new or existing), or the handler's result in
+    synchronous mode.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    if getattr(settings, 'TRADING_JOBS_SYNC', False):
+        return HANDLERS[kind](**payload)
+
+    if key is None:
+        key = f"{kind}:{json.dumps(payload, sort_keys=True)}"
+    try:
+        with transaction.atomic():
+            return Job.objects.create(kind=kind, key=key, payload=payload)
+    except IntegrityError:
+        existing = Job.objects.filter(key=key, status='PENDING').first()
+        if existing:
+            return existing
+        # The pending job was claimed in between; queue a fresh one
+        return Job.objects.create(kind=kind, key=key, payload=payload)
+
+
+def claim_next():
+    """Atomically move the oldest pending job to RUNNING and return it, or ``None``."""
+    candidates = Job.objects.filter(status='PENDING').order_by('created_at', 'id').values_list('id', flat=True)[:10]
+    for job_id in candidates:
+        # Conditional update: only one worker can win the PENDING -> RUNNING transition
+        claimed = Job.objects.filter(pk=job_id, status='PENDING').update(
+            status='RUNNING', started_at=timezone.now(), attempts=F('attempts') + 1
+        )
+        if claimed:
+            return Job.objects.get(pk=job_id)
+    return None
+
+
+def reclaim_stale(timeout=timedelta(minutes=10), max_attempts=3):
+    """Recover jobs left RUNNING by a worker that died; returns ``(requeued, failed)``.
+
+    A job started more than ``timeout`` ago goes back to PENDING while it has
+    had fewer than ``max_attempts`` runs, and is marked FAILED after that. If a
+    pending job with the same key was queued meanwhile, that one covers it.
+    """
+    now = timezone.now()
+    requeued = failed = 0
+    for job in Job.objects.filter(status='RUNNING', started_at__lt=now - timeout):
+        stale = Job.objects.filter(pk=job.pk, status='RUNNING')
+        if job.attempts < max_attempts:
+            try:
+                with transaction.atomic():
+                    requeued += stale.update(status='PENDING', started_at=None)
+                continue
+            except IntegrityError:
+                error = 'Worker lost; superseded by a newer pending job'
+        else:
+            error = f'Worker lost after {job.attempts} attempts'
+        failed += stale.update(status='FAILED', error=error, finished_at=now)
+    return requeued, failed
+
+
+def run_job(job):
+    try:
+        func = HANDLERS[job.kind]
+        func(**job.payload)
+    except Exception:
+        job.status = 'FAILED'
+        job.error = traceback.format_exc()
+    else:
+        job.status = 'DONE'
+        job.error = ''
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'error', 'finished_at'])
+    return job
+
+
+def run_pending(limit=None):
+    """Run pending jobs until the queue is empty or ``limit`` jobs ran; returns the count."""
+    count = 0
+    while limit is None or count < limit:
+        job = claim_next()
+        if job is None:
+            break
+        run_job(job)
+        count += 1
+    return count
+
+
+def purge_finished(older_than=timedelta(days=7)):
+    """Delete DONE jobs finished before ``older_than`` ago; FAILED jobs are kept for inspection."""
+    cutoff = timezone.now() - older_than
+    deleted, _ = Job.objects.filter(status='DONE', finished_at__lt=cutoff).delete()
+    return deleted
+
+
+def metrics(window=timedelta(hours=1)):
+    """Queue depth and latency figures; latencies cover jobs finished within ``window``."""
+    now = timezone.now()
+    depth = Job.objects.filter(status='PENDING').aggregate(oldest=Min('created_at'))
+    duration = DurationField()
+    finished = Job.objects.filter(status__in=['DONE', 'FAILED'], finished_at__gte=now - window).aggregate(
+        avg_wait=Avg(ExpressionWrapper(F('started_at') - F('created_at'), output_field=duration)),
+        avg_run=Avg(ExpressionWrapper(F('finished_at') - F('started_at'), output_field=duration)),
+        max_latency=Max(ExpressionWrapper(F('finished_at') - F('created_at'), output_field=duration)),
+    )
+
+    def seconds(value):
+        return value.total_seconds() if value is not None else None
+
+    return {
+        'pending': Job.objects.filter(status='PENDING').count(),
+        'running': Job.objects.filter(status='RUNNING').count(),
+        'failed': Job.objects.filter(status='FAILED', finished_at__gte=now - window).count(),
+        'done': Job.objects.filter(status='DONE', finished_at__gte=now - window).count(),
+        'oldest_pending_age': seconds(now - depth['oldest']) if depth['oldest'] else None,
+        'avg_wait': seconds(finished['avg_wait']),
+        'avg_run': seconds(finished['avg_run']),
+        'max_latency': seconds(finished['max_latency']),
+    }
+
+
+@handler('snapshot_portfolio')
+def snapshot_portfolio(portfolio_id):
+    portfolio = Portfolio.objects.filter(pk=portfolio_id).first()
+    if portfolio is None:
+        return None
+    return portfolio.generate_report()
+
+
+def enqueue_snapshot(portfolio):
+    """Queue a coalesced report snapshot for ``portfolio``."""
+    return enqueue('snapshot_portfolio', key=f"snapshot_portfolio:{portfolio.pk}", portfolio_id=portfolio.pk)
+
+
+@handler('render_exports')
+def render_exports(report_id):
+    """Pre-render every export format of a report into the export cache."""
+    report = PortfolioReport.objects.filter(pk=report_id).first()
+    if report is None:
+        return None
+    return [render_export(report, fmt) for fmt in FORMATS]
+
+
+def enqueue_exports(report):
+    """Queue rendering of ``report``'s exports so the first download is a cache hit."""
+    return enqueue('render_exports', key=f"render_exports:{report.pk}", report_id=report.pk)
+
+
+@handler('download_nse')
+def download_nse(index_names):
+    """Download ``index_names`` concurrently, then archive and ingest each file that arrived.
+
+    Any other raw CSVs left in ``data/nse`` (legacy files, earlier failed
+    runs) are archived too, so the download history can list the manifest alone.
+    """
+    results = download_indices((name, snapshot_path(name)) for name in index_names)
+    for result in results:
+        if result['ok']:
+            entry, _ = archive_file(result['path'])
+            with open_snapshot(entry.name, entry) as f:
+                result['ingest'] = ingest_nse_csv(f, name=entry.name)
+    archive_directory()
+    return results
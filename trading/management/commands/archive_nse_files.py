@@ -0,0 +1,36 @@
+# trading/management/commands/archive_nse_files.py
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Sum
+
+from trading.archive import archive_directory, raw_dir
+from trading.models import SnapshotFile
+
+
+class Command(BaseCommand):
+    help = 'Move raw NSE CSVs into the content-addressed archive, storing duplicates once'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            type=str,
+            default=None,
+            help='Directory of raw CSVs (default: data/nse)'
+        )
+        parser.add_argument(
+            '--keep',
+            action='store_true',
+            help='Keep each raw file after archiving it (by default it is deleted)'
+        )
+
+    def handle(self, *args, **options):
+        files, new_blobs = archive_directory(options['dir'] or raw_dir(), remove=not options['keep'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Archived {files} files: {new_blobs} new blobs, {files - new_blobs} duplicates"
+        ))
+
+        totals = SnapshotFile.objects.aggregate(files=Count('id'), raw=Sum('size'))
+        blobs = dict(SnapshotFile.objects.values_list('digest', 'stored_size'))
+        self.stdout.write(
+            f"Archive: {totals['files']} files in {len(blobs)} blobs, "
+            f"{(totals['raw'] or 0) / 1024:.1f} KB raw -> {sum(blobs.values()) / 1024:.1f} KB stored"
+        )
@@ -0,0 +1,93 @@
+# trading/management/commands/backfill_nse_history.py
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from trading.history import (
+    load_manifest, manifest_entry, parse_snapshot, pending_snapshots, save_manifest, snapshot_sources, store_snapshot
+)
+from trading.snapshots import init_worker
+
+
+class Command(BaseCommand):
+    help = 'Backfill NSEData from the timestamped NSE snapshot CSVs (incremental, idempotent)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dir',
+            type=str,
+            default=settings.NSE_DATA_DIR,
+            help='Directory of raw NIFTY_50_* and SECURITIES_IN_F&O_* snapshots, read alongside the archive'
+        )
+        parser.add_argument(
+            '--manifest',
+            type=str,
+            default=None,
+            help='Manifest of ingested files (default: backfill_manifest.json in --dir)'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Parser processes (default: CPU count); only the main process writes'
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Reparse files already in the manifest; stored rows are still not duplicated'
+        )
+
+    def handle(self, *args, **options):
+        manifest_path = options['manifest'] or os.path.join(options['dir'], 'backfill_manifest.json')
+        manifest = load_manifest(manifest_path)
+        sources = snapshot_sources(options['dir'])
+        pending = pending_snapshots(sources, {} if options['force'] else manifest)
+
+        self.stdout.write(f"{len(sources)} files, {len(pending)} to ingest")
+        if not pending:
+            return
+
+        workers = min(options['workers'] or os.cpu_count() or 1, len(pending))
+        started = time.perf_counter()
+        self.stored = self.failed = 0
+        if workers <= 1:
+            for source in pending:
+                try:
+                    self.store(parse_snapshot(*source), manifest, manifest_path)
+                except Exception as e:
+                    self.report_failure(source, e)
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+                futures = {pool.submit(parse_snapshot, *source): source for source in pending}
+                for future in as_completed(futures):
+                    try:
+                        self.store(future.result(), manifest, manifest_path)
+                    except Exception as e:
+                        self.report_failure(futures[future], e)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Stored {self.stored} rows from {len(pending) - self.failed} files in {elapsed:.2f}s on {workers} workers"
+        ))
+        if self.failed:
+            self.stdout.write(self.style.ERROR(f"{self.failed} files failed; rerun to retry them"))
+
+    def store(self, parsed, manifest, manifest_path):
+        stored = store_snapshot(parsed)
+        # Record the file only once its rows are committed
+        manifest[parsed['name']] = manifest_entry(parsed, stored)
+        save_manifest(manifest_path, manifest)
+        self.stored += stored
+        self.stdout.write(
+            f"  {parsed['name']}: {stored} rows at {parsed['snapshot_at']:%Y-%m-%d %H:%M:%S} "
+            f"({parsed['skipped']} skipped)"
+        )
+
+    def report_failure(self, source, error):
+        self.failed += 1
+        self.stdout.write(self.style.ERROR(f"  {source[1]} failed: {error}"))
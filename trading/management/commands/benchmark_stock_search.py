@@ -0,0 +1,101 @@
+# trading/management/commands/benchmark_stock_search.py
+import random
+import string
+import time
+from decimal import Decimal
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from trading.models import Stock
+from trading.search import SymbolIndex
+
+WORDS = [
+    'Tata', 'Reliance', 'Bharat', 'Indian', 'National', 'United', 'Global', 'Adani', 'Hindustan', 'Mahindra',
+    'Infra', 'Power', 'Steel', 'Bank', 'Finance', 'Pharma', 'Tech', 'Motors', 'Energy', 'Cement', 'Chemicals',
+    'Textiles', 'Foods', 'Realty', 'Capital', 'Auto', 'Life', 'Health', 'Ports', 'Telecom', 'Metals', 'Gas',
+]
+
+
+class Command(BaseCommand):
+    help = 'Compare stock search latency: in-memory symbol index vs the icontains ORM query (rolled back)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--stocks',
+            type=int,
+            default=10000,
+            help='Synthetic stocks to add for the run'
+        )
+        parser.add_argument(
+            '--queries',
+            type=int,
+            default=500,
+            help='Autocomplete queries to time on each path'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for the synthetic stocks and queries'
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self.add_stocks(rng, options['stocks'])
+            rows = list(Stock.objects.values_list('id', 'symbol', 'name'))
+            queries = self.make_queries(rng, rows, options['queries'])
+
+            started = time.perf_counter()
+            index = SymbolIndex(rows)
+            build = time.perf_counter() - started
+            self.stdout.write(f"{len(index)} stocks, index built in {build * 1000:.1f} ms, {len(queries)} queries")
+
+            orm = self.time_each(queries, lambda q: list(
+                Stock.objects.filter(Q(symbol__icontains=q) | Q(name__icontains=q)).values_list('id', flat=True)[:10]
+            ))
+            memory = self.time_each(queries, lambda q: index.search(q, 10))
+            transaction.set_rollback(True)
+
+        for label, timings in [('ORM icontains', orm), ('symbol index', memory)]:
+            self.stdout.write(
+                f"  {label:<14} mean {timings.mean():>9.1f} us  p50 {np.percentile(timings, 50):>9.1f} us  "
+                f"p99 {np.percentile(timings, 99):>9.1f} us"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Speed-up {orm.mean() / memory.mean():.0f}x (mean)"))
+
+    def add_stocks(self, rng, count):
+        symbols = set(Stock.objects.values_list('symbol', flat=True))
+        stocks = []
+        while len(stocks) < count:
+            symbol = ''.join(rng.choices(string.ascii_uppercase, k=rng.randint(3, 9)))
+            if symbol in symbols:
+                continue
+            symbols.add(symbol)
+            name = ' '.join(rng.sample(WORDS, rng.randint(1, 3))) + ' Ltd'
+            stocks.append(Stock(symbol=symbol, name=name, current_price=Decimal(rng.randint(1000, 500000)) / 100))
+        Stock.objects.bulk_create(stocks, batch_size=1000)
+
+    def make_queries(self, rng, rows, count):
+        """What people type: symbol prefixes of 1-4 letters, and word fragments of names."""
+        queries = []
+        for _ in range(count):
+            _, symbol, name = rng.choice(rows)
+            if rng.random() < 0.6:
+                queries.append(symbol[:rng.randint(1, 4)])
+            else:
+                word = rng.choice(name.split())
+                start = rng.randint(0, max(0, len(word) - 3))
+                queries.append(word[start:start + rng.randint(3, 6)])
+        return queries
+
+    def time_each(self, queries, search):
+        timings = np.empty(len(queries))
+        for i, query in enumerate(queries):
+            started = time.perf_counter()
+            search(query)
+            timings[i] = (time.perf_counter() - started) * 1e6
+        return timings
@@ -0,0 +1,27 @@
+# trading/management/commands/check_marks.py
+from django.core.management.base import BaseCommand
+
+from trading.valuation import check_marks
+
+
+class Command(BaseCommand):
+    help = 'Compare cached portfolio market values against a full recompute'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Overwrite drifted cached values with the recomputed ones'
+        )
+
+    def handle(self, *args, **options):
+        drift = check_marks(fix=options['fix'])
+        for portfolio_id, cached, actual in drift:
+            self.stdout.write(f"Portfolio {portfolio_id}: cached {cached} != actual {actual}")
+
+        if not drift:
+            self.stdout.write(self.style.SUCCESS("All cached market values are consistent"))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f"Repaired {len(drift)} portfolios"))
+        else:
+            self.stdout.write(self.style.ERROR(f"{len(drift)} portfolios drifted; rerun with --fix to repair"))
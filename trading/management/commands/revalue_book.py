@@ -0,0 +1,116 @@
+# trading/management/commands/revalue_book.py
+import random
+import time
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from trading.models import Holding, Portfolio, Stock
+from trading.valuation import revalue_book, revalue_with_properties
+
+
+class Command(BaseCommand):
+    help = 'Revalue every portfolio with the vectorised valuation engine'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--top',
+            type=int,
+            default=20,
+            help='Number of portfolios to list, largest total value first'
+        )
+        parser.add_argument(
+            '--benchmark',
+            type=int,
+            nargs='*',
+            metavar='PORTFOLIOS',
+            help='Benchmark against the property path on synthetic books of these sizes '
+                 '(default 1000 10000 100000); rolled back afterwards'
+        )
+        parser.add_argument(
+            '--holdings-per-portfolio',
+            type=int,
+            default=5,
+            help='Synthetic holdings per portfolio when benchmarking'
+        )
+        parser.add_argument(
+            '--property-sample',
+            type=int,
+            default=1000,
+            help='Time the property path on at most this many portfolios and extrapolate'
+        )
+
+    def handle(self, *args, **options):
+        if options['benchmark'] is not None:
+            for size in options['benchmark'] or [1000, 10000, 100000]:
+                self.run_benchmark(size, options['holdings_per_portfolio'], options['property_sample'])
+            return
+
+        started = time.perf_counter()
+        book = revalue_book()
+        elapsed = time.perf_counter() - started
+
+        totals = book.totals()
+        self.stdout.write(
+            f"{totals['portfolios']} portfolios, {totals['holdings']} holdings revalued in {elapsed * 1000:.1f} ms"
+        )
+        self.stdout.write(
+            f"Book total: {totals['total_value']:,.2f} (cash {totals['cash_balance']:,.2f}, "
+            f"market {totals['market_value']:,.2f}, unrealized P/L {totals['unrealized_pl']:,.2f})"
+        )
+
+        names = dict(Portfolio.objects.values_list('id', 'name'))
+        for i in book.total_value.argsort()[::-1][:options['top']]:
+            row = book.get(book.portfolio_ids[i])
+            self.stdout.write(
+                f"{row['portfolio_id']:>8}  {names.get(row['portfolio_id'], ''):<30.30} "
+                f"{row['total_value']:>16,.2f} {row['unrealized_pl']:>14,.2f}"
+            )
+
+    def run_benchmark(self, size, holdings_per_portfolio, property_sample):
+        with transaction.atomic():
+            portfolios = self.build_synthetic_book(size, holdings_per_portfolio)
+
+            started = time.perf_counter()
+            book = revalue_book(portfolios)
+            engine = time.perf_counter() - started
+
+            sample = portfolios.order_by('id')[:property_sample]
+            sample_size = min(size, property_sample)
+            started = time.perf_counter()
+            reference = revalue_with_properties(Portfolio.objects.filter(id__in=sample.values('id')))
+            properties = (time.perf_counter() - started) * size / sample_size
+
+            mismatches = sum(1 for pid, value in reference.items() if book.get(pid)['total_value'] != value)
+            transaction.set_rollback(True)
+
+        note = '' if sample_size == size else f' (extrapolated from {sample_size})'
+        self.stdout.write(
+            f"{size:>7} portfolios: engine {engine * 1000:9.1f} ms, "
+            f"properties {properties * 1000:11.1f} ms{note}, "
+            f"speed-up {properties / engine:7.1f}x, mismatches {mismatches}"
+        )
+
+    def build_synthetic_book(self, size, holdings_per_portfolio):
+        rng = random.Random(size)
+        user = User.objects.create(username=f'revalue-bench-{size}-{time.time_ns()}')
+        stocks = Stock.objects.bulk_create(
+            Stock(symbol=f'RB{i:06d}', name=f'Bench {i}', current_price=Decimal(rng.randint(100, 500000)) / 100)
+            for i in range(max(holdings_per_portfolio * 10, 100))
+        )
+        Portfolio.objects.bulk_create(
+            (Portfolio(user=user, name=f'Bench {i}', cash_balance=Decimal(rng.randint(0, 10000000)) / 100)
+             for i in range(size)),
+            batch_size=5000
+        )
+        portfolios = Portfolio.objects.filter(user=user)
+        holdings = (
+            Holding(portfolio_id=pid, stock=stock, quantity=rng.randint(-500, 500) or 1,
+                    average_buy_price=Decimal(rng.randint(100, 500000)) / 100)
+            for pid in list(portfolios.values_list('id', flat=True))
+            for stock in rng.sample(stocks, holdings_per_portfolio)
+        )
+        Holding.objects.bulk_create(holdings, batch_size=5000)
+        return portfolios
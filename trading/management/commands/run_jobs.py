@@ -0,0 +1,84 @@
+# trading/management/commands/run_jobs.py
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from trading.jobs import claim_next, metrics, purge_finished, reclaim_stale, run_job
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (portfolio snapshots etc.)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Drain the queue and exit instead of polling'
+        )
+        parser.add_argument(
+            '--sleep',
+            type=float,
+            default=1.0,
+            help='Seconds to wait between polls when the queue is empty'
+        )
+        parser.add_argument(
+            '--purge-days',
+            type=int,
+            default=7,
+            help='Delete finished jobs older than this many days on start-up'
+        )
+        parser.add_argument(
+            '--stale-minutes',
+            type=float,
+            default=10,
+            help='Requeue jobs RUNNING for longer than this, assuming their worker died'
+        )
+        parser.add_argument(
+            '--max-attempts',
+            type=int,
+            default=3,
+            help='Mark a stale job FAILED instead of requeueing it after this many runs'
+        )
+        parser.add_argument(
+            '--stats',
+            action='store_true',
+            help='Print queue depth and latency metrics and exit'
+        )
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            for name, value in metrics().items():
+                self.stdout.write(f"{name:>20}: {'-' if value is None else value}")
+            return
+
+        purged = purge_finished(timedelta(days=options['purge_days']))
+        if purged:
+            self.stdout.write(f"Purged {purged} finished jobs")
+
+        stale = timedelta(minutes=options['stale_minutes'])
+        self.reclaim(stale, options['max_attempts'])
+
+        while True:
+            job = claim_next()
+            if job is None:
+                # Idle: a cheap moment to pick up jobs orphaned by dead workers
+                if self.reclaim(stale, options['max_attempts']):
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            job = run_job(job)
+            latency = (job.finished_at - job.created_at).total_seconds()
+            if job.status == 'DONE':
+                self.stdout.write(self.style.SUCCESS(f"{job} done in {latency:.3f}s after enqueue"))
+            else:
+                self.stdout.write(self.style.ERROR(f"{job} failed after {latency:.3f}s:\n{job.error}"))
+
+    def reclaim(self, stale, max_attempts):
+        requeued, failed = reclaim_stale(stale, max_attempts)
+        if requeued or failed:
+            self.stdout.write(self.style.WARNING(f"Reclaimed stale jobs: {requeued} requeued, {failed} failed"))
+        return requeued
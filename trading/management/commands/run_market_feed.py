@@ -0,0 +1,179 @@
+# trading/management/commands/run_market_feed.py
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from trading.feed import MarketFeed
+from trading.providers import INDICES, PROVIDERS, create_synthetic_stocks, get_provider
+
+
+class Command(BaseCommand):
+    help = 'Drive stock prices from a market-data provider and write only the prices that changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--provider',
+            choices=sorted(PROVIDERS),
+            default=None,
+            help='nse polls nseindia.com, archive replays archived snapshots as they were, '
+                 'replay interpolates intraday ticks between them, gbm simulates correlated random walks '
+                 '(default: MARKET_DATA_PROVIDER)'
+        )
+        parser.add_argument(
+            '--index',
+            choices=['nifty50', 'fno', 'all'],
+            default='all',
+            help='Which indices to poll (nse provider)'
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=None,
+            help='Seconds between ticks (default 60 for nse, 0 for archive)'
+        )
+        parser.add_argument(
+            '--step',
+            type=float,
+            default=60.0,
+            help='Market seconds between ticks (replay and gbm providers)'
+        )
+        parser.add_argument(
+            '--speed',
+            type=float,
+            default=60.0,
+            help='Replay speed multiplier over real time; 0 runs as fast as possible (replay provider)'
+        )
+        parser.add_argument(
+            '--noise',
+            type=float,
+            default=0.0,
+            help='Relative random jitter added to interpolated prices (replay provider)'
+        )
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Random seed for --noise and the gbm walk'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=1.0,
+            help='Ticks per second; 0 runs as fast as possible (gbm provider)'
+        )
+        parser.add_argument(
+            '--volatility',
+            type=float,
+            default=0.25,
+            help='Annualised volatility (gbm provider)'
+        )
+        parser.add_argument(
+            '--drift',
+            type=float,
+            default=0.08,
+            help='Annualised drift (gbm provider)'
+        )
+        parser.add_argument(
+            '--correlation',
+            type=float,
+            default=0.5,
+            help='Correlation between stocks of the same sector, 0 to 1 (gbm provider)'
+        )
+        parser.add_argument(
+            '--synthetic-stocks',
+            type=int,
+            default=0,
+            help='First add this many SIMnnnnnn stocks across 10 sectors, for load tests'
+        )
+        parser.add_argument(
+            '--loop',
+            action='store_true',
+            help='Start the replay again when it reaches the last snapshot (replay provider)'
+        )
+        parser.add_argument(
+            '--ticks',
+            type=int,
+            default=None,
+            help='Stop after this many ticks'
+        )
+        parser.add_argument(
+            '--duration',
+            type=float,
+            default=None,
+            help='Stop after this many seconds'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='Rows per bulk UPDATE statement'
+        )
+        parser.add_argument(
+            '--quiet',
+            action='store_true',
+            help='Only print the summary, not a line per tick'
+        )
+        parser.add_argument(
+            '--no-history',
+            action='store_true',
+            help='Do not append ticks to the price history files'
+        )
+        parser.add_argument(
+            '--verbose-changes',
+            action='store_true',
+            help='Print every changed symbol on each tick'
+        )
+
+    def handle(self, *args, **options):
+        if options['synthetic_stocks']:
+            created = create_synthetic_stocks(options['synthetic_stocks'], seed=options['seed'])
+            self.stdout.write(f"Added {created} synthetic stocks")
+
+        name = options['provider'] or settings.MARKET_DATA_PROVIDER
+        if name == 'nse':
+            names = list(INDICES.values()) if options['index'] == 'all' else [INDICES[options['index']]]
+            interval = 60.0 if options['interval'] is None else options['interval']
+            source = get_provider(name, index_names=names, interval=interval)
+        elif name == 'replay':
+            source = get_provider(name, step=options['step'], speed=options['speed'], noise=options['noise'],
+                                  seed=options['seed'], loop=options['loop'])
+        elif name == 'gbm':
+            source = get_provider(name, rate=options['rate'], step=options['step'], drift=options['drift'],
+                                  volatility=options['volatility'], correlation=options['correlation'],
+                                  seed=options['seed'])
+        else:
+            source = get_provider(name, interval=options['interval'] or 0.0)
+
+        feed = MarketFeed(history=not options['no_history'], batch_size=options['batch_size'])
+        self.stdout.write(f"Tracking {len(feed.last_prices)} stocks from the {name} provider")
+        count = updates = 0
+        writing = 0.0
+        started = time.perf_counter()
+        try:
+            for count, tick in enumerate(source, start=1):
+                tick_started = time.perf_counter()
+                changes = feed.apply(tick)
+                elapsed = time.perf_counter() - tick_started
+                updates += len(changes)
+                writing += elapsed
+                if not options['quiet']:
+                    self.stdout.write(
+                        f"{tick.at:%Y-%m-%d %H:%M:%S} {len(changes):>4} changed of {len(tick.prices):>4} "
+                        f"in {elapsed * 1000:.1f} ms"
+                    )
+                if options['verbose_changes']:
+                    for change in changes:
+                        self.stdout.write(f"    {change.symbol:<12} {change.old:>10} -> {change.new:>10}")
+                if options['ticks'] and count >= options['ticks']:
+                    break
+                if options['duration'] and time.perf_counter() - started >= options['duration']:
+                    break
+        except KeyboardInterrupt:
+            pass
+        total = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"{count} ticks in {total:.2f}s ({count / total if total else 0.0:.1f} ticks/s), "
+            f"{updates} price updates ({updates / total if total else 0.0:.0f}/s, "
+            f"{updates / writing if writing else 0.0:.0f}/s while writing)"
+        ))
@@ -0,0 +1,98 @@
+# trading/management/commands/snapshot_all_portfolios.py
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.utils import timezone
+
+from trading.models import Portfolio, PortfolioReport
+from trading.snapshots import init_worker, snapshot_chunk
+
+
+class Command(BaseCommand):
+    help = 'Snapshot every portfolio into a report, in chunks across a process pool (resumable)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--run',
+            type=str,
+            default=None,
+            help='Snapshot run name (default eod-YYYY-MM-DD); rerunning a name resumes it'
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=500,
+            help='Portfolios per chunk; each chunk commits in one transaction'
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Worker processes (default: CPU count, or 1 on SQLite, which allows a single writer)'
+        )
+
+    def handle(self, *args, **options):
+        run = options['run'] or f"eod-{timezone.localdate().isoformat()}"
+        chunk_size = options['chunk_size']
+
+        done = PortfolioReport.objects.filter(snapshot_run=run).values('portfolio_id')
+        pending = list(Portfolio.objects.exclude(pk__in=done).order_by('id').values_list('id', flat=True))
+        skipped = Portfolio.objects.count() - len(pending)
+        if skipped:
+            self.stdout.write(f"Resuming run {run}: {skipped} portfolios already snapshotted")
+        if not pending:
+            self.stdout.write(self.style.SUCCESS(f"Run {run} is complete"))
+            return
+
+        workers = options['workers']
+        if workers is None:
+            workers = 1 if connection.vendor == 'sqlite' else (os.cpu_count() or 1)
+
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        self.stdout.write(f"Run {run}: {len(pending)} portfolios in {len(chunks)} chunks on {workers} workers")
+
+        started = time.perf_counter()
+        self.totals = [0, 0]
+        self.failed = 0
+        if workers <= 1:
+            for chunk in chunks:
+                try:
+                    self.report_chunk(snapshot_chunk(chunk, run), started)
+                except Exception as e:
+                    self.report_failure(chunk, e)
+        else:
+            # Children must open their own connections
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+                futures = {pool.submit(snapshot_chunk, chunk, run): chunk for chunk in chunks}
+                for future in as_completed(futures):
+                    try:
+                        self.report_chunk(future.result(), started)
+                    except Exception as e:
+                        self.report_failure(futures[future], e)
+
+        elapsed = time.perf_counter() - started
+        rows = sum(self.totals)
+        self.stdout.write(self.style.SUCCESS(
+            f"Run {run}: {self.totals[0]} reports, {self.totals[1]} holding rows in {elapsed:.1f}s "
+            f"({rows / elapsed if elapsed else 0:,.0f} rows/sec)"
+        ))
+        if self.failed:
+            self.stdout.write(self.style.ERROR(f"{self.failed} chunks failed; rerun with --run {run} to resume"))
+
+    def report_chunk(self, result, started):
+        portfolio_ids, reports, holding_reports = result
+        self.totals[0] += reports
+        self.totals[1] += holding_reports
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"  chunk {portfolio_ids[0]}-{portfolio_ids[-1]}: {reports} reports, {holding_reports} holdings "
+            f"({sum(self.totals) / elapsed if elapsed else 0:,.0f} rows/sec so far)"
+        )
+
+    def report_failure(self, chunk, error):
+        self.failed += 1
+        self.stdout.write(self.style.ERROR(f"  chunk {chunk[0]}-{chunk[-1]} failed: {error}"))
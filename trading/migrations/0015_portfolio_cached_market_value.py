@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:31
+
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+def populate_cached_market_value(apps, schema_editor):
+    Portfolio = apps.get_model('trading', 'Portfolio')
+    Holding = apps.get_model('trading', 'Holding')
+    values = {}
+    for portfolio_id, quantity, price in Holding.objects.values_list('portfolio_id', 'quantity', 'stock__current_price'):
+        values[portfolio_id] = values.get(portfolio_id, 0) + quantity * price
+    for portfolio_id, value in values.items():
+        Portfolio.objects.filter(pk=portfolio_id).update(cached_market_value=value)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0014_alter_holding_quantity_alter_holdingreport_quantity_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolio',
+            name='cached_market_value',
+            field=models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=15),
+        ),
+        migrations.AddIndex(
+            model_name='holding',
+            index=models.Index(fields=['stock', 'portfolio', 'quantity'], name='trading_hol_stock_i_219852_idx'),
+        ),
+        migrations.RunPython(populate_cached_market_value, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0016_job'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='portfolioreport',
+            name='snapshot_run',
+            field=models.CharField(blank=True, max_length=40, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='portfolioreport',
+            index=models.Index(fields=['snapshot_run', 'portfolio'], name='trading_por_snapsho_30785f_idx'),
+        ),
+    ]
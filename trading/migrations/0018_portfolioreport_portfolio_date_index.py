@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0017_portfolioreport_snapshot_run'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='portfolioreport',
+            index=models.Index(fields=['portfolio', 'report_date', 'created_at'], name='trading_por_portfol_4e48f6_idx'),
+        ),
+    ]
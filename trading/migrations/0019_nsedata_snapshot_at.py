@@ -0,0 +1,22 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0018_portfolioreport_portfolio_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='nsedata',
+            name='snapshot_at',
+            field=models.DateTimeField(blank=True, help_text='Time of the NSE snapshot the row came from', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='nsedata',
+            constraint=models.UniqueConstraint(fields=('symbol', 'snapshot_at', 'index_type'), name='unique_nse_snapshot_row'),
+        ),
+    ]
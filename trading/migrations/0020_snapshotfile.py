@@ -0,0 +1,29 @@
+# Generated by Django 4.2.30 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0019_nsedata_snapshot_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SnapshotFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('digest', models.CharField(db_index=True, help_text='SHA-256 of the uncompressed file; names the stored blob', max_length=64)),
+                ('index_type', models.CharField(blank=True, choices=[('NIFTY50', 'Nifty 50'), ('FNO', 'F&O')], max_length=20)),
+                ('snapshot_at', models.DateTimeField(blank=True, null=True)),
+                ('size', models.BigIntegerField(help_text='Uncompressed bytes')),
+                ('stored_size', models.BigIntegerField(help_text='Compressed bytes of the shared blob')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-snapshot_at', '-created_at'],
+            },
+        ),
+    ]
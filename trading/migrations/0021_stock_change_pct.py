@@ -0,0 +1,36 @@
+# Generated by Django 4.2.30 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('trading', '0020_snapshotfile'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stock',
+            name='change_pct',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=8, null=True),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='prev_close',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='stock',
+            name='volume',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['change_pct'], name='trading_sto_change__0c8736_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stock',
+            index=models.Index(fields=['volume'], name='trading_sto_volume_ea2e8b_idx'),
+        ),
+    ]
@@ -1,8 +1,11 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, DecimalField, ExpressionWrapper, F, Q, Sum, Value, When, Window
+from django.db.models.functions import Coalesce, Lag, Round
 from django.contrib.auth.models import User
 from decimal import Decimal
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils.functional import cached_property
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
@@ -22,6 +25,13 @@ def create_user_profile(sender, instance, created, **kwargs):
 def save_user_profile(sender, instance, **kwargs):
     instance.profile.save()
 
+def change_percent(price, prev_close):
+    """% change of ``price`` over ``prev_close`` to 2dp, or ``None`` without a previous close."""
+    if price is None or not prev_close:
+        return None
+    return ((Decimal(price) - Decimal(prev_close)) / Decimal(prev_close) * 100).quantize(Decimal('0.01'))
+
+
 class Stock(models.Model):
     symbol = models.CharField(max_length=10, unique=True)
     name = models.CharField(max_length=100)
@@ -36,16 +46,63 @@ class Stock(models.Model):
     day_low = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     year_high = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
     year_low = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    prev_close = models.DecimalField(max_digits=10, decimal_places=2, blank=True, null=True)
+    # Materialised % change from prev_close; bulk writers refresh it themselves (see change_percent)
+    change_pct = models.DecimalField(max_digits=8, decimal_places=2, blank=True, null=True)
+    volume = models.BigIntegerField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            # Top gainers/losers and most active read the first N rows of these
+            models.Index(fields=['change_pct']),
+            models.Index(fields=['volume']),
+        ]
 
     @property
     def price_change(self):
-        if self.day_high and self.day_low:
-            return ((self.current_price - self.day_low) / self.day_low * 100).quantize(Decimal('0.01'))
-        return Decimal('0.00')
+        return self.change_pct if self.change_pct is not None else Decimal('0.00')
+
+    def save(self, *args, **kwargs):
+        self.change_pct = change_percent(self.current_price, self.prev_close)
+        super().save(*args, **kwargs)
 
     def __str__(self):
         return f"{self.symbol}"
 
+class PortfolioQuerySet(models.QuerySet):
+    def with_valuation(self):
+        """Annotate holdings valuation in a single aggregated query.
+
+        Adds ``market_value`` (sum of quantity * current price), ``invested_cost``
+        (sum of quantity * average buy price), ``unrealized_pl``, ``holding_count``
+        and ``valuation_total`` (cash + market value). ``total_value`` and
+        ``invested_value`` read these instead of walking the holdings.
+        """
+        money = DecimalField(max_digits=15, decimal_places=2)
+        zero = Value(Decimal('0.00'), output_field=money)
+
+        def paise(expression):
+            # SQLite computes decimals as floats; round back to the paisa in SQL
+            return Round(expression, 2, output_field=money)
+
+        market_value = Coalesce(
+            Sum(ExpressionWrapper(F('holdings__quantity') * F('holdings__stock__current_price'), output_field=money)),
+            zero, output_field=money
+        )
+        invested_cost = Coalesce(
+            Sum(ExpressionWrapper(F('holdings__quantity') * F('holdings__average_buy_price'), output_field=money)),
+            zero, output_field=money
+        )
+        return self.annotate(
+            market_value=paise(market_value),
+            invested_cost=paise(invested_cost),
+            holding_count=Count('holdings'),
+        ).annotate(
+            unrealized_pl=paise(F('market_value') - F('invested_cost')),
+            valuation_total=paise(F('cash_balance') + F('market_value')),
+        )
+
+
 class Portfolio(models.Model):
     VISIBILITY_CHOICES = (
         ('PUBLIC', 'Visible to Users'),
@@ -59,15 +116,23 @@ class Portfolio(models.Model):
     cash_balance = models.DecimalField(max_digits=15, decimal_places=2, default=100000.00)
     created_at = models.DateTimeField(auto_now_add=True)
     last_updated = models.DateTimeField(auto_now=True)
+    # Sum of quantity * current price over holdings, kept current by trades and
+    # price ticks (see trading.valuation.mark_to_market)
+    cached_market_value = models.DecimalField(max_digits=15, decimal_places=2, default=Decimal('0.00'))
     visibility = models.CharField(
         max_length=10,
         choices=VISIBILITY_CHOICES,
         default='PUBLIC',
         help_text='Control whether this portfolio is visible to users'
     )
+
+    objects = PortfolioQuerySet.as_manager()
+
     @property
     def total_value(self):
-        holdings = self.holdings.all()
+        if hasattr(self, 'market_value'):  # annotated by with_valuation()
+            return self.cash_balance + self.market_value
+        holdings = self.holdings.select_related('stock')
         total = self.cash_balance
         for holding in holdings:
             total += holding.current_value
@@ -81,33 +146,32 @@ class Portfolio(models.Model):
         # But for total_value calculation: Cash + Sum(Holdings Value).
         # Short Holding Value = -Qty * Price (Negative).
         # So Total Value = Cash + (Negative Value) = Cash - Liability. Correct.
-        return sum(h.current_value for h in self.holdings.all())
+        if hasattr(self, 'market_value'):  # annotated by with_valuation()
+            return self.market_value
+        return sum(h.current_value for h in self.holdings.select_related('stock'))
 
-    def generate_report(self):
+    @property
+    def marked_value(self):
+        """Cash plus the incrementally maintained market value (no holdings query)."""
+        return self.cash_balance + self.cached_market_value
+
+    def generate_report(self, snapshot_run=None):
         """Generate a portfolio report snapshot"""
         from .models import PortfolioReport, HoldingReport
 
-        # Calculate current values
-        holdings = self.holdings.all()
-        investment_value = sum(h.current_value for h in holdings)
-
-        # Create the main report
-        report = PortfolioReport.objects.create(
-            portfolio=self,
-            total_value=self.total_value,
-            cash_balance=self.cash_balance,
-            investment_value=investment_value
-        )
-
-        # Create holding snapshots for the report
-        for holding in holdings:
-            HoldingReport.objects.create(
-                report=report,
-                holding=holding,
-                quantity=holding.quantity,
-                current_price=holding.stock.current_price,
-                average_price=holding.average_buy_price
+        # One fetch of holdings with their stocks serves both totals and snapshots
+        holdings = list(self.holdings.select_related('stock'))
+        investment_value = sum((h.current_value for h in holdings), Decimal('0.00'))
+
+        with transaction.atomic():
+            report = PortfolioReport.objects.create(
+                portfolio=self,
+                total_value=self.cash_balance + investment_value,
+                cash_balance=self.cash_balance,
+                investment_value=investment_value,
+                snapshot_run=snapshot_run
             )
+            HoldingReport.objects.bulk_create([HoldingReport.from_holding(report, h) for h in holdings])
 
         return report
 
@@ -147,6 +211,10 @@ class Holding(models.Model):
 
     class Meta:
         unique_together = ('portfolio', 'stock')
+        indexes = [
+            # Reverse index stock -> (portfolio, quantity) for mark-to-market on price ticks
+            models.Index(fields=['stock', 'portfolio', 'quantity']),
+        ]
 
     def __str__(self):
         return f"{self.quantity} shares of {self.stock.symbol}"
@@ -173,6 +241,37 @@ class Transaction(models.Model):
     def __str__(self):
         return f"{self.transaction_type} {self.quantity} of {self.stock.symbol} at {self.price_per_share}"
 
+class PortfolioReportQuerySet(models.QuerySet):
+    def with_change(self):
+        """Annotate each report with the change since the portfolio's previous report.
+
+        Uses ``LAG(total_value)`` over reports partitioned by portfolio and ordered
+        by ``(report_date, created_at)``, adding ``previous_value``, ``value_change``
+        and ``value_change_pct`` in the same query. Filter by whole portfolios only:
+        filtering out a portfolio's earlier reports changes what "previous" means.
+        """
+        money = DecimalField(max_digits=15, decimal_places=2)
+        previous = Window(
+            Lag('total_value'),
+            partition_by=[F('portfolio_id')],
+            order_by=[F('report_date').asc(), F('created_at').asc(), F('id').asc()],
+            output_field=money,
+        )
+        return self.annotate(previous_value=previous).annotate(
+            value_change=Case(
+                When(previous_value__isnull=False, then=Round(F('total_value') - F('previous_value'), 2)),
+                default=Value(Decimal('0.00')),
+                output_field=money,
+            ),
+            value_change_pct=Case(
+                When(previous_value__gt=0,
+                     then=(F('total_value') - F('previous_value')) * 100 / F('previous_value')),
+                default=Value(Decimal('0.00')),
+                output_field=DecimalField(max_digits=20, decimal_places=6),
+            ),
+        )
+
+
 class PortfolioReport(models.Model):
     portfolio = models.ForeignKey(Portfolio, on_delete=models.CASCADE, related_name='reports')
     report_date = models.DateField(auto_now_add=True)
@@ -180,16 +279,31 @@ class PortfolioReport(models.Model):
     cash_balance = models.DecimalField(max_digits=15, decimal_places=2)
     investment_value = models.DecimalField(max_digits=15, decimal_places=2)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set by snapshot_all_portfolios so an interrupted run can resume
+    snapshot_run = models.CharField(max_length=40, blank=True, null=True)
+
+    objects = PortfolioReportQuerySet.as_manager()
 
     class Meta:
         ordering = ['-report_date']
+        indexes = [
+            models.Index(fields=['snapshot_run', 'portfolio']),
+            models.Index(fields=['portfolio', 'report_date', 'created_at']),
+        ]
+
+    @cached_property
+    def previous_report(self):
+        return PortfolioReport.objects.filter(portfolio_id=self.portfolio_id).filter(
+            Q(report_date__lt=self.report_date) |
+            Q(report_date=self.report_date, created_at__lt=self.created_at) |
+            Q(report_date=self.report_date, created_at=self.created_at, id__lt=self.id)
+        ).order_by('-report_date', '-created_at', '-id').first()
 
     @property
     def profit_loss(self):
-        previous_report = PortfolioReport.objects.filter(
-            portfolio=self.portfolio,
-            report_date__lt=self.report_date
-        ).order_by('-report_date').first()
+        if hasattr(self, 'value_change'):  # annotated by with_change()
+            return self.value_change
+        previous_report = self.previous_report
 
         if previous_report:
             return self.total_value - previous_report.total_value
@@ -197,10 +311,9 @@ class PortfolioReport(models.Model):
 
     @property
     def profit_loss_percentage(self):
-        previous_report = PortfolioReport.objects.filter(
-            portfolio=self.portfolio,
-            report_date__lt=self.report_date
-        ).order_by('-report_date').first()
+        if hasattr(self, 'value_change_pct'):  # annotated by with_change()
+            return self.value_change_pct
+        previous_report = self.previous_report
 
         if previous_report and previous_report.total_value > 0:
             return ((self.total_value - previous_report.total_value) / previous_report.total_value) * 100
@@ -216,6 +329,17 @@ class HoldingReport(models.Model):
     current_price = models.DecimalField(max_digits=10, decimal_places=2)
     average_price = models.DecimalField(max_digits=10, decimal_places=2)
 
+    @classmethod
+    def from_holding(cls, report, holding):
+        """Unsaved snapshot of ``holding``; expects ``holding.stock`` already loaded."""
+        return cls(
+            report=report,
+            holding=holding,
+            quantity=holding.quantity,
+            current_price=holding.stock.current_price,
+            average_price=holding.average_buy_price
+        )
+
     @property
     def current_value(self):
         return self.current_price * Decimal(self.quantity)
@@ -239,6 +363,27 @@ class HoldingReport(models.Model):
     def __str__(self):
         return f"{self.holding.stock.symbol} in {self.report}"
 
+@receiver(post_save, sender=PortfolioReport)
+@receiver(post_save, sender=Transaction)
+def invalidate_portfolio_performance(sender, instance, created, **kwargs):
+    if created:
+        from .performance import invalidate_performance
+        invalidate_performance(instance.portfolio_id)
+
+@receiver(post_save, sender=Stock)
+@receiver(post_delete, sender=Stock)
+def invalidate_stock_caches(sender, instance, **kwargs):
+    from .quotes import invalidate_quotes
+    from .search import invalidate_search_index
+    transaction.on_commit(invalidate_quotes)
+    transaction.on_commit(invalidate_search_index)
+
+@receiver(post_save, sender=Portfolio)
+@receiver(post_delete, sender=Portfolio)
+def invalidate_remembered_portfolio(sender, instance, **kwargs):
+    from .active_portfolio import invalidate_active_portfolio
+    invalidate_active_portfolio(instance.user_id)
+
 class Watchlist(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='watchlists')
     name = models.CharField(max_length=100)
@@ -257,6 +402,7 @@ class NSEData(models.Model):
     close_price = models.DecimalField(max_digits=10, decimal_places=2)
     volume = models.BigIntegerField()
     downloaded_at = models.DateTimeField(auto_now_add=True)
+    snapshot_at = models.DateTimeField(null=True, blank=True, help_text='Time of the NSE snapshot the row came from')
     index_type = models.CharField(max_length=20, choices=[('NIFTY50', 'Nifty 50'), ('FNO', 'F&O')])
 
     class Meta:
@@ -264,3 +410,52 @@ class NSEData(models.Model):
             models.Index(fields=['symbol']),
             models.Index(fields=['index_type']),
         ]
+        constraints = [
+            models.UniqueConstraint(fields=['symbol', 'snapshot_at', 'index_type'], name='unique_nse_snapshot_row'),
+        ]
+
+class SnapshotFile(models.Model):
+    """A downloaded NSE CSV in the content-addressed archive (see trading.archive)."""
+    name = models.CharField(max_length=255, unique=True)
+    digest = models.CharField(max_length=64, db_index=True, help_text='SHA-256 of the uncompressed file; names the stored blob')
+    index_type = models.CharField(max_length=20, blank=True, choices=[('NIFTY50', 'Nifty 50'), ('FNO', 'F&O')])
+    snapshot_at = models.DateTimeField(null=True, blank=True)
+    size = models.BigIntegerField(help_text='Uncompressed bytes')
+    stored_size = models.BigIntegerField(help_text='Compressed bytes of the shared blob')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-snapshot_at', '-created_at']
+
+    def __str__(self):
+        return self.name
+
+class Job(models.Model):
+    """A unit of background work run by the ``run_jobs`` worker (see trading.jobs)."""
+    STATUS_CHOICES = (
+        ('PENDING', 'Pending'),
+        ('RUNNING', 'Running'),
+        ('DONE', 'Done'),
+        ('FAILED', 'Failed'),
+    )
+
+    kind = models.CharField(max_length=50)
+    key = models.CharField(max_length=200, help_text='Pending jobs with the same key are coalesced into one')
+    payload = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['key'], condition=Q(status='PENDING'), name='unique_pending_job_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} [{self.status}] {self.key}"
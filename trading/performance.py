@@ -0,0 +1,134 @@
+# trading/performance.py
+"""Portfolio value time series built from stored ``PortfolioReport`` snapshots."""
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.core.cache import cache
+from django.db.models import F, Window
+from django.db.models.functions import FirstValue, TruncDate
+from django.utils import timezone
+
+from .models import PortfolioReport
+
+CACHE_TIMEOUT = 60 * 60
+# Request parameters are clamped to these; timedelta overflows long before unbounded ``days``
+MAX_DAYS = 10 * 366
+MAX_POINTS = 5000
+
+
+def _version_key(portfolio_id):
+    return f"performance:version:{portfolio_id}"
+
+
+def invalidate_performance(portfolio_id):
+    """Drop every cached series for ``portfolio_id`` (called on new reports and trades)."""
+    cache.set(_version_key(portfolio_id), time.time_ns(), None)
+
+
+def _daily_points(portfolio_id, start):
+    """One point per day: the values of that day's last snapshot, in a single query."""
+    day = TruncDate('created_at')
+
+    def close(field):
+        return Window(FirstValue(field), partition_by=[day], order_by=[F('created_at').desc(), F('id').desc()])
+
+    rows = (
+        PortfolioReport.objects.filter(portfolio_id=portfolio_id, created_at__gte=start)
+        .annotate(day=day, close_value=close('total_value'), close_cash=close('cash_balance'),
+                  close_invested=close('investment_value'))
+        .values_list('day', 'close_value', 'close_cash', 'close_invested')
+        .distinct()
+        .order_by('day')
+    )
+    points = []
+    last_day = None
+    for day, value, cash, invested in rows:
+        # Carry the last close across days without a snapshot
+        while last_day is not None and last_day + timedelta(days=1) < day:
+            last_day += timedelta(days=1)
+            points.append(dict(points[-1], date=last_day.isoformat()))
+        points.append({'date': day.isoformat(), 'value': float(value), 'cash': float(cash),
+                       'invested': float(invested)})
+        last_day = day
+    return points
+
+
+def _intraday_points(portfolio_id, start):
+    """Every stored snapshot since ``start``."""
+    rows = (
+        PortfolioReport.objects.filter(portfolio_id=portfolio_id, created_at__gte=start)
+        .order_by('created_at', 'id')
+        .values_list('created_at', 'total_value', 'cash_balance', 'investment_value')
+    )
+    return [{'date': created_at.isoformat(), 'value': float(value), 'cash': float(cash),
+             'invested': float(invested)} for created_at, value, cash, invested in rows]
+
+
+def lttb(points, threshold, key='value'):
+    """Largest-Triangle-Three-Buckets downsampling of ``points`` to ``threshold`` points.
+
+    Keeps the first and last point and, from each bucket in between, the point
+    forming the largest triangle with its neighbours, which preserves peaks and
+    troughs far better than striding.
+    """
+    n = len(points)
+    if threshold is None or threshold >= n or threshold < 3:
+        return points
+
+    y = np.fromiter((p[key] for p in points), dtype=np.float64, count=n)
+    x = np.arange(n, dtype=np.float64)
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Average of the next bucket (or the last point) is the third triangle vertex
+        next_start, next_end = end, edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[next_start:next_end].mean()
+        avg_y = y[next_start:next_end].mean()
+        areas = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected.append(a)
+    selected.append(n - 1)
+    return [points[i] for i in selected]
+
+
+def performance_series(portfolio, days=30, interval='daily', points=None):
+    """Value series for ``portfolio`` over the last ``days`` days.
+
+    ``interval`` is ``'daily'`` (last snapshot per day, gaps carried forward) or
+    ``'intraday'`` (every snapshot). Snapshot points are cached per portfolio
+    until a new report or trade invalidates them; the final live point, from
+    the incrementally maintained ``cached_market_value``, is never cached.
+    ``points`` optionally downsamples the result with LTTB. ``days`` is
+    clamped to 1..``MAX_DAYS`` and ``points`` to at most ``MAX_POINTS``.
+    """
+    if interval not in ('daily', 'intraday'):
+        raise ValueError(f"Unknown interval: {interval}")
+    days = min(max(days, 1), MAX_DAYS)
+    if points is not None:
+        points = min(points, MAX_POINTS)
+
+    version = cache.get_or_set(_version_key(portfolio.pk), time.time_ns, None)
+    key = f"performance:{portfolio.pk}:{version}:{interval}:{days}"
+    series = cache.get(key)
+    if series is None:
+        start = timezone.now() - timedelta(days=days)
+        if interval == 'daily':
+            series = _daily_points(portfolio.pk, start)
+        else:
+            series = _intraday_points(portfolio.pk, start)
+        cache.set(key, series, CACHE_TIMEOUT)
+
+    now = timezone.now()
+    live = {
+        'date': timezone.localdate(now).isoformat() if interval == 'daily' else now.isoformat(),
+        'value': float(portfolio.marked_value),
+        'cash': float(portfolio.cash_balance),
+        'invested': float(portfolio.cached_market_value),
+    }
+    if interval == 'daily' and series and series[-1]['date'] == live['date']:
+        series = series[:-1]
+    return lttb(series + [live], points)
@@ -0,0 +1,229 @@
+# trading/price_history.py
+"""Columnar, memory-mapped OHLCV history per symbol.
+
+Each symbol has one file under ``settings.PRICE_HISTORY_DIR``: a 64-byte
+header (magic, row count, capacity) followed by six fixed-width int64
+columns of ``capacity`` slots each -- timestamp (epoch seconds, UTC), open,
+high, low, close (paise) and volume. Rows are kept sorted by timestamp, so
+a date range is a ``searchsorted`` and a zero-copy slice of the memmap.
+``symbols.json`` maps symbols to file names.
+
+Several processes write (the NSE ingest, ``run_market_feed`` and
+``backfill_nse_history``), so writers serialise on an ``fcntl`` lock on
+``.lock`` in the store and re-read ``symbols.json`` once they hold it.
+Readers never lock. Appends write the new slots before bumping the row
+count, and growth or out-of-order merges rewrite the file and atomically
+replace it, so a reader always sees a consistent prefix.
+"""
+import fcntl
+import json
+import os
+import struct
+from contextlib import contextmanager
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+
+MAGIC = b'PXHIST01'
+HEADER = struct.Struct('<8sQQ40x')
+COLUMNS = ('timestamp', 'open', 'high', 'low', 'close', 'volume')
+MIN_CAPACITY = 256
+INDEX_FILE = 'symbols.json'
+LOCK_FILE = '.lock'
+
+
+def to_epoch(value):
+    if value is None or isinstance(value, (int, np.integer)):
+        return value
+    return int(value.timestamp())
+
+
+class PriceSeries:
+    """Column arrays for one symbol; prices in paise, views into the memmap where possible."""
+    __slots__ = COLUMNS
+
+    def __init__(self, *columns):
+        for name, column in zip(COLUMNS, columns):
+            setattr(self, name, column)
+
+    def __len__(self):
+        return len(self.timestamp)
+
+    def prices(self, column='close'):
+        """A price column in rupees as float64 (a copy)."""
+        return getattr(self, column) / 100.0
+
+    def datetimes(self):
+        return [datetime.fromtimestamp(int(ts), tz=dt_timezone.utc) for ts in self.timestamp]
+
+    def points(self, column='close'):
+        """``[{'date': epoch ms, 'value': rupees}]`` for charts."""
+        return [{'date': int(ts) * 1000, 'value': float(value)}
+                for ts, value in zip(self.timestamp, self.prices(column))]
+
+
+EMPTY = PriceSeries(*(np.empty(0, dtype='<i8') for _ in COLUMNS))
+
+
+class PriceHistory:
+    def __init__(self, root=None):
+        self.root = root or settings.PRICE_HISTORY_DIR
+        self._index = None
+        self._lock_depth = 0
+
+    # Reading
+
+    @property
+    def index(self):
+        if self._index is None:
+            path = os.path.join(self.root, INDEX_FILE)
+            if os.path.exists(path):
+                with open(path, encoding='utf-8') as f:
+                    self._index = json.load(f)
+            else:
+                self._index = {}
+        return self._index
+
+    def symbols(self):
+        return sorted(self.index)
+
+    def _path(self, symbol):
+        name = self.index.get(symbol)
+        return os.path.join(self.root, name) if name else None
+
+    def _open(self, path, mode='r'):
+        """Return ``(count, capacity, columns)`` with ``columns`` a (6, capacity) memmap.
+
+        The header and the map come from one open file, so a writer replacing
+        ``path`` in between cannot pair an old header with a new file.
+        """
+        with open(path, 'rb' if mode == 'r' else 'r+b') as f:
+            magic, count, capacity = HEADER.unpack(f.read(HEADER.size))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a price history file")
+            columns = np.memmap(f, dtype='<i8', mode=mode, offset=HEADER.size, shape=(len(COLUMNS), capacity))
+        return count, capacity, columns
+
+    def series(self, symbol, start=None, end=None):
+        """History of ``symbol`` with ``start <= timestamp <= end`` (datetimes or epoch seconds)."""
+        path = self._path(symbol)
+        if path is None or not os.path.exists(path):
+            return EMPTY
+        count, _, columns = self._open(path)
+        timestamps = columns[0, :count]
+        lo = 0 if start is None else int(np.searchsorted(timestamps, to_epoch(start), side='left'))
+        hi = count if end is None else int(np.searchsorted(timestamps, to_epoch(end), side='right'))
+        return PriceSeries(*(columns[i, lo:hi] for i in range(len(COLUMNS))))
+
+    def latest(self, symbol):
+        """The last stored row as a dict, or ``None``."""
+        series = self.series(symbol)
+        if not len(series):
+            return None
+        return {name: int(getattr(series, name)[-1]) for name in COLUMNS}
+
+    # Writing
+
+    @contextmanager
+    def writing(self):
+        """Hold the store's writer lock (re-entrant), with a fresh view of the symbol index."""
+        if self._lock_depth:
+            self._lock_depth += 1
+            try:
+                yield
+            finally:
+                self._lock_depth -= 1
+            return
+        os.makedirs(self.root, exist_ok=True)
+        with open(os.path.join(self.root, LOCK_FILE), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            # Another process may have registered symbols since we last read the index
+            self._index = None
+            self._lock_depth = 1
+            try:
+                yield
+            finally:
+                self._lock_depth = 0
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def append(self, symbol, timestamp, open_, high, low, close, volume):
+        """Add rows for ``symbol``; prices in paise, arrays of equal length.
+
+        Rows whose timestamp is already stored are ignored, so replaying a
+        snapshot is a no-op. Returns the number of rows added.
+        """
+        with self.writing():
+            return self._append(symbol, timestamp, open_, high, low, close, volume)
+
+    def _append(self, symbol, timestamp, open_, high, low, close, volume):
+        new = np.vstack([np.asarray(column, dtype='<i8') for column in (timestamp, open_, high, low, close, volume)])
+        new = new[:, np.argsort(new[0], kind='stable')]
+        path = self._path(symbol)
+        if path is None or not os.path.exists(path):
+            new = new[:, np.unique(new[0], return_index=True)[1]]
+            path = path or self._register(symbol)
+            self._write(path, new)
+            return new.shape[1]
+
+        count, capacity, columns = self._open(path, mode='r+')
+        stored = columns[0, :count]
+        new = new[:, ~np.isin(new[0], stored)]
+        new = new[:, np.unique(new[0], return_index=True)[1]]
+        added = new.shape[1]
+        if not added:
+            return 0
+        if count and new[0, 0] <= stored[-1]:
+            # Out-of-order backfill: merge and rewrite
+            merged = np.hstack([np.array(columns[:, :count]), new])
+            del columns
+            self._write(path, merged[:, np.argsort(merged[0], kind='stable')])
+        elif count + added > capacity:
+            grown = np.hstack([np.array(columns[:, :count]), new])
+            del columns
+            self._write(path, grown)
+        else:
+            columns[:, count:count + added] = new
+            columns.flush()
+            del columns
+            # Publish the rows only after they are on disk
+            with open(path, 'r+b') as f:
+                f.write(HEADER.pack(MAGIC, count + added, capacity))
+        return added
+
+    def append_snapshot(self, snapshot_at, rows):
+        """Append one snapshot of ``(symbol, open, high, low, close, volume)`` rows in rupees."""
+        rows = list(rows)
+        if not rows:
+            return 0
+        ts = to_epoch(snapshot_at)
+        added = 0
+        with self.writing():
+            for symbol, open_, high, low, close, volume in rows:
+                added += self._append(symbol, [ts], [round(open_ * 100)], [round(high * 100)], [round(low * 100)],
+                                      [round(close * 100)], [int(volume)])
+        return added
+
+    def _register(self, symbol):
+        """Give ``symbol`` a file; call with the writer lock held."""
+        taken = set(self.index.values())
+        number = len(self.index)
+        while f"{number:06d}.pxh" in taken:
+            number += 1
+        name = f"{number:06d}.pxh"
+        self.index[symbol] = name
+        path = os.path.join(self.root, INDEX_FILE)
+        with open(f"{path}.tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(f"{path}.tmp", path)
+        return os.path.join(self.root, name)
+
+    def _write(self, path, data):
+        count = data.shape[1]
+        capacity = max(MIN_CAPACITY, 1 << count.bit_length())
+        block = np.zeros((len(COLUMNS), capacity), dtype='<i8')
+        block[:, :count] = data
+        with open(f"{path}.tmp", 'wb') as f:
+            f.write(HEADER.pack(MAGIC, count, capacity))
+            f.write(block.tobytes())
+        os.replace(f"{path}.tmp", path)
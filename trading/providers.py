@@ -0,0 +1,238 @@
+# trading/providers.py
+"""Pluggable market-data providers for ``MarketFeed``.
+
+A provider is an iterable of ``Tick(at, prices, frame)``: ``prices`` maps
+symbols to ``Decimal`` prices and ``frame`` is the raw NSE frame, when
+there is one, for the price history. Providers register under a name with
+``@provider(name)``; ``run_market_feed --provider`` picks one, defaulting
+to ``settings.MARKET_DATA_PROVIDER``.
+"""
+import tempfile
+import time
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.utils import timezone
+
+from .archive import archive_file, list_snapshots, open_snapshot
+from .downloader import download_indices, snapshot_path
+from .feed import Tick, snapshot_prices
+from .ingest import read_nse_csv
+from .models import Stock
+
+PROVIDERS = {}
+INDICES = {'nifty50': 'NIFTY 50', 'fno': 'SECURITIES IN F&O'}
+
+
+def provider(name):
+    """Register a provider class under ``name``."""
+    def register(cls):
+        PROVIDERS[name] = cls
+        return cls
+    return register
+
+
+def get_provider(name=None, **options):
+    name = name or settings.MARKET_DATA_PROVIDER
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown market data provider: {name}")
+    return PROVIDERS[name](**options)
+
+
+class MarketDataProvider:
+    def __iter__(self):
+        return self.ticks()
+
+    def ticks(self):
+        raise NotImplementedError
+
+
+@provider('nse')
+class NSEProvider(MarketDataProvider):
+    """Polls nseindia.com through the shared downloader; every download is archived."""
+
+    def __init__(self, index_names=None, interval=60.0):
+        self.index_names = index_names or list(INDICES.values())
+        self.interval = interval
+
+    def ticks(self):
+        while True:
+            started = time.monotonic()
+            at = timezone.now()
+            prices, frames = {}, []
+            with tempfile.TemporaryDirectory() as tmp:
+                targets = [(name, snapshot_path(name, data_dir=tmp, when=at)) for name in self.index_names]
+                for result in download_indices(targets):
+                    if not result['ok']:
+                        continue
+                    entry, _ = archive_file(result['path'])
+                    with open_snapshot(entry.name, entry) as f:
+                        df = read_nse_csv(f)
+                    prices.update(snapshot_prices(df))
+                    frames.append(df)
+            yield Tick(at, prices, pd.concat(frames, ignore_index=True) if frames else None)
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+def archived_snapshots(names=None):
+    """``(entry, frame)`` for archived snapshots in time order."""
+    entries = list_snapshots().exclude(snapshot_at=None).order_by('snapshot_at', 'name')
+    if names:
+        entries = entries.filter(name__in=names)
+    for entry in entries:
+        with open_snapshot(entry.name, entry) as f:
+            yield entry, read_nse_csv(f)
+
+
+@provider('archive')
+class ArchiveProvider(MarketDataProvider):
+    """Replays archived snapshots as they were, one tick per file."""
+
+    def __init__(self, interval=0.0, names=None):
+        self.interval = interval
+        self.names = names
+
+    def ticks(self):
+        for entry, df in archived_snapshots(self.names):
+            yield Tick(entry.snapshot_at, snapshot_prices(df), df)
+            if self.interval:
+                time.sleep(self.interval)
+
+
+@provider('replay')
+class ReplayProvider(MarketDataProvider):
+    """Simulated intraday ticks interpolated between archived snapshots.
+
+    Market time advances ``step`` seconds per tick and runs ``speed`` times
+    faster than real time (``speed=0`` runs flat out). Each price moves
+    linearly from one snapshot to the next; ``noise`` adds seeded relative
+    jitter, so a run with the same seed always produces the same ticks.
+    Interpolated ticks carry no frame and are kept out of the price history.
+    """
+
+    def __init__(self, step=60.0, speed=60.0, noise=0.0, seed=0, loop=False, names=None):
+        self.step = step
+        self.speed = speed
+        self.noise = noise
+        self.seed = seed
+        self.loop = loop
+        self.names = names
+
+    def load(self):
+        """``(times, symbols, prices)``: snapshot epochs, symbol list and a times x symbols matrix.
+
+        Snapshots at the same time are merged, and a symbol missing from a
+        snapshot keeps its previous price (or its first known one).
+        """
+        by_time = {}
+        for entry, df in archived_snapshots(self.names):
+            by_time.setdefault(entry.snapshot_at.timestamp(), {}).update(snapshot_prices(df))
+        times = np.array(sorted(by_time), dtype=np.float64)
+        frame = pd.DataFrame([by_time[t] for t in times], dtype=np.float64).ffill().bfill()
+        return times, list(frame.columns), frame.to_numpy()
+
+    def ticks(self):
+        times, symbols, prices = self.load()
+        if len(times) < 2:
+            return
+        rng = np.random.default_rng(self.seed)
+        steps = np.arange(times[0], times[-1], self.step)
+        steps = np.append(steps, times[-1])
+        while True:
+            started = time.monotonic()
+            for n, t in enumerate(steps):
+                i = min(int(np.searchsorted(times, t, side='right')) - 1, len(times) - 2)
+                weight = (t - times[i]) / (times[i + 1] - times[i])
+                row = prices[i] + (prices[i + 1] - prices[i]) * weight
+                if self.noise:
+                    row = row * (1 + rng.normal(0.0, self.noise, len(row)))
+                at = datetime.fromtimestamp(t, tz=dt_timezone.utc)
+                yield Tick(at, {s: Decimal(f"{p:.2f}") for s, p in zip(symbols, row)}, None)
+                if self.speed:
+                    # Pace against the start of the run so slow ticks do not accumulate drift
+                    delay = started + (n + 1) * self.step / self.speed - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+            if not self.loop:
+                break
+
+
+# Trading seconds in a year (252 sessions of 6h15m), the GBM time unit
+TRADING_YEAR = 252 * 6.25 * 3600
+
+
+@provider('gbm')
+class GBMProvider(MarketDataProvider):
+    """Synthetic prices for every stock by sector-correlated geometric Brownian motion.
+
+    Each tick advances all prices by ``step`` market-seconds at once:
+    ``log S += (drift - volatility**2 / 2) dt + volatility sqrt(dt) z``, where
+    ``z`` mixes one shock shared by the stock's sector with its own, so
+    stocks in the same sector are correlated by ``correlation``; a stock
+    without a sector has only its own shock. Ticks are
+    emitted at ``rate`` per second (0 runs flat out) and stamped with the
+    wall clock. Prices are kept in floating point between ticks, so rounding
+    to paise never compounds however long the run.
+    """
+
+    def __init__(self, rate=1.0, step=60.0, drift=0.08, volatility=0.25, correlation=0.5, seed=0):
+        self.rate = rate
+        self.step = step
+        self.drift = drift
+        self.volatility = volatility
+        self.correlation = correlation
+        self.seed = seed
+
+    def load(self):
+        """``(symbols, prices, sectors)`` for the priced stocks; ``sectors`` are integer codes, -1 for none."""
+        rows = [row for row in Stock.objects.values_list('symbol', 'current_price', 'sector') if row[1] and row[1] > 0]
+        symbols = [symbol for symbol, _, _ in rows]
+        prices = np.array([float(price) for _, price, _ in rows], dtype=np.float64)
+        sectors, _ = pd.factorize(pd.Series([sector or None for _, _, sector in rows], dtype=object))
+        return symbols, prices, sectors
+
+    def ticks(self):
+        symbols, prices, sectors = self.load()
+        if not symbols:
+            return
+        rng = np.random.default_rng(self.seed)
+        dt = self.step / TRADING_YEAR
+        drift = (self.drift - self.volatility ** 2 / 2) * dt
+        scale = self.volatility * np.sqrt(dt)
+        in_sector = sectors >= 0
+        shared = np.where(in_sector, np.sqrt(self.correlation), 0.0)
+        own = np.where(in_sector, np.sqrt(1 - self.correlation), 1.0)
+        codes = np.where(in_sector, sectors, 0)
+        log_prices = np.log(prices)
+        started = time.monotonic()
+        n = 0
+        while True:
+            z = shared * rng.standard_normal(max(sectors.max() + 1, 1))[codes] + own * rng.standard_normal(len(symbols))
+            log_prices += drift + scale * z
+            rounded = np.round(np.exp(log_prices), 2)
+            yield Tick(timezone.now(), {s: Decimal(f"{p:.2f}") for s, p in zip(symbols, rounded)}, None)
+            n += 1
+            if self.rate:
+                delay = started + n / self.rate - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+
+
+def create_synthetic_stocks(count, sectors=10, seed=0):
+    """Add ``count`` SIMnnnnnn stocks spread over ``sectors`` sectors; returns how many were new."""
+    rng = np.random.default_rng(seed)
+    prices = np.round(np.exp(rng.uniform(np.log(20), np.log(5000), count)), 2)
+    existing = Stock.objects.filter(symbol__startswith='SIM').count()
+    Stock.objects.bulk_create(
+        [
+            Stock(symbol=f"SIM{i:06d}", name=f"Simulated {i}", current_price=Decimal(f"{price:.2f}"),
+                  sector=f"Simulated {i % sectors}")
+            for i, price in enumerate(prices)
+        ],
+        batch_size=500,
+        ignore_conflicts=True,
+    )
+    return Stock.objects.filter(symbol__startswith='SIM').count() - existing
@@ -0,0 +1,121 @@
+# trading/quotes.py
+"""Versioned quote cache in front of ``Stock`` prices.
+
+Each stock's quote is cached under ``quotes:<version>:<stock_id>``, where
+``version`` is one global key that every price writer bumps once it has
+committed (ingestion, the market feed, manual edits). A bump makes every
+cached quote unreachable at once, so readers never see a price older than
+the last write, and between writes they are served from the cache
+without touching the database.
+
+The writers run in other processes (``run_market_feed``, ``run_jobs``),
+so this only holds with a cache shared between processes -- the
+file-based default or Redis, see ``CACHES`` in settings. A per-process
+``LocMemCache`` would leave web workers serving stale quotes.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache
+
+from .models import Stock
+
+CACHE_TIMEOUT = 60 * 60
+VERSION_KEY = 'quotes:version'
+QUOTE_FIELDS = ('id', 'symbol', 'name', 'current_price', 'prev_close', 'change_pct', 'last_updated')
+
+
+class SharedCounters:
+    """Named counters kept in the cache, so every worker process adds to the same totals.
+
+    ``incr`` is ``cache.incr``, seeded with ``cache.add`` the first time:
+    atomic on Redis, best effort on the file-based cache.
+    """
+
+    def __init__(self, prefix, names):
+        self.prefix = prefix
+        self.names = names
+
+    def _key(self, name):
+        return f"counters:{self.prefix}:{name}"
+
+    def incr(self, name, delta=1):
+        if not delta:
+            return
+        key = self._key(name)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            if not cache.add(key, delta, None):
+                # Another process seeded it first
+                cache.incr(key, delta)
+
+    def __getitem__(self, name):
+        return cache.get(self._key(name), 0)
+
+    def clear(self):
+        cache.delete_many([self._key(name) for name in self.names])
+
+
+# Hit/miss counts across all processes, for load tests and the staff stats endpoint
+counters = SharedCounters('quotes', ['hits', 'misses'])
+
+
+def quote_version():
+    return cache.get_or_set(VERSION_KEY, time.time_ns, None)
+
+
+def invalidate_quotes():
+    """Expire every cached quote (and anything else keyed on the quote version)."""
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def _key(version, stock_id):
+    return f"quotes:{version}:{stock_id}"
+
+
+def get_quotes(stock_ids):
+    """``{stock_id: quote}`` for the stocks that exist; quote dicts carry ``QUOTE_FIELDS``.
+
+    One cache multi-get, plus one query and one multi-set for any misses.
+    """
+    version = quote_version()
+    keys = {_key(version, int(stock_id)): int(stock_id) for stock_id in stock_ids}
+    found = cache.get_many(keys)
+    quotes = {keys[key]: quote for key, quote in found.items()}
+    missing = [stock_id for key, stock_id in keys.items() if key not in found]
+    counters.incr('hits', len(quotes))
+    counters.incr('misses', len(missing))
+    if missing:
+        loaded = {row['id']: row for row in Stock.objects.filter(pk__in=missing).values(*QUOTE_FIELDS)}
+        cache.set_many({_key(version, stock_id): quote for stock_id, quote in loaded.items()}, CACHE_TIMEOUT)
+        quotes.update(loaded)
+    return quotes
+
+
+def get_quote(stock_id):
+    """The quote for one stock, or ``None`` if it does not exist."""
+    return get_quotes([stock_id]).get(int(stock_id))
+
+
+def cached_by_version(name, build):
+    """``build()``, cached until the next quote version bump (e.g. search results that carry prices)."""
+    key = f"quotes:{quote_version()}:{hashlib.md5(name.encode()).hexdigest()}"
+    value = cache.get(key)
+    if value is None:
+        counters.incr('misses')
+        value = build()
+        cache.set(key, value, CACHE_TIMEOUT)
+    else:
+        counters.incr('hits')
+    return value
+
+
+def quote_stats():
+    hits, misses = counters['hits'], counters['misses']
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        'version': quote_version(),
+    }
@@ -0,0 +1,116 @@
+# trading/search.py
+"""In-memory symbol/name search index for the stock autocomplete.
+
+Symbols live in a sorted array, so a prefix is two bisections; names and
+symbols are also split into bigrams and trigrams with an inverted index
+of sorted positions, so a substring is an intersection of a few posting
+arrays plus a check of the survivors, stopping at the first ``limit``.
+Results rank exact symbol, then symbol prefix, then substring matches,
+and only ids come back; prices come from the quote cache.
+
+The index is built lazily per process and rebuilt when the search version
+moves, which ingestion and ``Stock`` saves bump. The version lives in the
+cross-process cache (see ``CACHES`` in settings), so an ingest run by the
+``run_jobs`` worker reaches every web worker's index. Price ticks do not
+touch it.
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+import numpy as np
+from django.core.cache import cache
+
+from .models import Stock
+
+VERSION_KEY = 'search:version'
+
+_index = None
+
+
+def _grams(text, n):
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class SymbolIndex:
+    def __init__(self, rows, version=None):
+        """``rows`` are ``(id, symbol, name)``."""
+        rows = sorted(rows, key=lambda row: row[1].upper())
+        self.version = version
+        self.ids = [pk for pk, _, _ in rows]
+        self.symbols = [symbol.upper() for _, symbol, _ in rows]
+        # Position i of every array is the same stock, in symbol order
+        self.texts = [f"{symbol}\n{name or ''}".lower() for _, symbol, name in rows]
+        postings = defaultdict(list)
+        for i, text in enumerate(self.texts):
+            for gram in _grams(text, 2) | _grams(text, 3):
+                postings[gram].append(i)
+        # Sorted position arrays: intersections run in C and keep symbol order
+        self.postings = {gram: np.array(positions, dtype=np.int32) for gram, positions in postings.items()}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _prefix_range(self, prefix):
+        start = bisect_left(self.symbols, prefix)
+        end = bisect_left(self.symbols, prefix + '\uffff', start)
+        return start, end
+
+    def _substring(self, needle, skip, limit):
+        """Positions whose text contains ``needle``, in symbol order, leaving out ``skip``."""
+        if len(needle) == 1:
+            candidates = (i for i, text in enumerate(self.texts) if needle in text)
+        else:
+            grams = sorted(_grams(needle, 3) or {needle}, key=lambda gram: len(self.postings.get(gram, ())))
+            positions = self.postings.get(grams[0])
+            if positions is None:
+                return []
+            for gram in grams[1:]:
+                positions = np.intersect1d(positions, self.postings[gram], assume_unique=True)
+            exact = len(grams) == 1
+            candidates = (i for i in positions.tolist() if exact or needle in self.texts[i])
+        found = []
+        for i in candidates:
+            if i not in skip:
+                found.append(i)
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+    def search(self, query, limit=10):
+        """Ids of matching stocks, best first; ``limit=None`` returns them all."""
+        query = query.strip()
+        if not query or '\n' in query:
+            return []
+        symbol = query.upper()
+        start, end = self._prefix_range(symbol)
+        if limit is not None:
+            end = min(end, start + limit + 1)
+        ranked = [i for i in range(start, end) if self.symbols[i] == symbol]
+        ranked += [i for i in range(start, end) if self.symbols[i] != symbol]
+        ranked = ranked[:limit]
+        if limit is None or len(ranked) < limit:
+            remaining = None if limit is None else limit - len(ranked)
+            ranked += self._substring(query.lower(), set(ranked), remaining)
+        return [self.ids[i] for i in ranked]
+
+
+def search_version():
+    return cache.get_or_set(VERSION_KEY, time.time_ns, None)
+
+
+def invalidate_search_index():
+    """Make every process rebuild its index on its next search."""
+    cache.set(VERSION_KEY, time.time_ns(), None)
+
+
+def get_index():
+    global _index
+    version = search_version()
+    if _index is None or _index.version != version:
+        _index = SymbolIndex(Stock.objects.values_list('id', 'symbol', 'name'), version)
+    return _index
+
+
+def search_stocks(query, limit=10):
+    return get_index().search(query, limit)
@@ -10,13 +10,19 @@ class StockSerializer(serializers.ModelSerializer):
 
 class PortfolioSerializer(serializers.ModelSerializer):
     total_value = serializers.SerializerMethodField()
+    market_value = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    invested_cost = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    unrealized_pl = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    holding_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = Portfolio
-        fields = ['id', 'cash_balance', 'created_at', 'last_updated', 'total_value']
+        fields = ['id', 'cash_balance', 'created_at', 'last_updated', 'total_value',
+                  'market_value', 'invested_cost', 'unrealized_pl', 'holding_count']
 
     def get_total_value(self, obj):
-        return obj.total_value()
+        # Expects a queryset from Portfolio.objects.with_valuation()
+        return obj.total_value
 
 
 class HoldingSerializer(serializers.ModelSerializer):
@@ -60,6 +66,10 @@ class WatchlistSerializer(serializers.ModelSerializer):
 
 
 class PortfolioReportSerializer(serializers.ModelSerializer):
+    # Annotated by PortfolioReport.objects.with_change() on list views
+    profit_loss = serializers.DecimalField(max_digits=15, decimal_places=2, read_only=True)
+    profit_loss_percentage = serializers.DecimalField(max_digits=20, decimal_places=2, read_only=True)
+
     class Meta:
         model = PortfolioReport
         fields = '__all__'
\ No newline at end of file
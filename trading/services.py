@@ -0,0 +1,164 @@
+# trading/services.py
+import random
+import time
+from decimal import Decimal
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import F
+from django.db.models.functions import Round
+from django.utils import timezone
+
+from .models import Holding, Portfolio, Stock, Transaction
+
+
+def next_position(current_qty, avg_price, quantity, price, transaction_type):
+    """Return ``(new_qty, new_avg_price)`` after trading ``quantity`` at ``price``.
+
+    Negative quantities are short positions whose average price is the average
+    sell price; flipping through zero opens the new side at the trade price.
+    """
+    trade_value = Decimal(quantity) * Decimal(price)
+
+    new_qty = current_qty
+    new_avg_price = avg_price
+
+    if transaction_type == 'BUY':
+        # Buying shares
+        if current_qty >= 0:
+            # Case 1: Increasing Long Position (or opening)
+            total_cost = (Decimal(current_qty) * avg_price) + trade_value
+            new_qty = current_qty + quantity
+            if new_qty > 0:
+                new_avg_price = total_cost / Decimal(new_qty)
+            else:
+                new_avg_price = Decimal('0.00')
+        else:
+            # Case 2: Covering Short Position
+            # Buying back shares you owe.
+            if abs(current_qty) >= quantity:
+                # 2a: Partial or Full Cover (remaining is still short or flat)
+                new_qty = current_qty + quantity
+                # Avg Price (Avg Sell Price) remains SAME for the remaining short position.
+                if new_qty == 0:
+                    new_avg_price = Decimal('0.00')
+            else:
+                # 2b: Flip from Short to Long
+                remaining_short = abs(current_qty)
+                excess_buy = quantity - remaining_short
+
+                # Close the short part (P/L realized implicitly by cash change vs initial short proceeds)
+                # Open new Long position
+                new_qty = excess_buy
+                new_avg_price = Decimal(price)
+
+    else: # SELL
+        # Selling shares
+        if current_qty > 0:
+            # Case 3: Decreasing Long Position (or closing)
+            if current_qty >= quantity:
+                # 3a: Partial or Full Sell
+                new_qty = current_qty - quantity
+                # Avg Price (Avg Buy Price) remains SAME for remaining long position.
+                if new_qty == 0:
+                    new_avg_price = Decimal('0.00')
+            else:
+                # 3b: Flip from Long to Short
+                remaining_long = current_qty
+                excess_sell = quantity - remaining_long
+
+                # Close the long part
+                # Open new Short position
+                new_qty = -excess_sell
+                new_avg_price = Decimal(price)
+        else:
+            # Case 4: Increasing Short Position (or opening)
+            # Adding to short position
+            # Weighted Average of SELL prices
+            total_value_short = (Decimal(abs(current_qty)) * avg_price) + trade_value
+            new_qty = current_qty - quantity
+            if new_qty != 0:
+                new_avg_price = total_value_short / Decimal(abs(new_qty))
+            else:
+                new_avg_price = Decimal('0.00')
+
+    return new_qty, new_avg_price
+
+
+class TradeExecutionService:
+    """Execute trades atomically against row-locked portfolio and holding rows.
+
+    The holding update, cash update and ``Transaction`` insert commit together.
+    The stock row is locked first, then the portfolio and the holding, so
+    concurrent orders on one portfolio serialise instead of losing updates. Cash moves
+    through ``F()`` expressions, never a read-modify-write of a stale instance.
+    Lock conflicts the database reports as errors (deadlocks, SQLite's
+    "database is locked") are retried with jittered exponential backoff.
+    """
+
+    def __init__(self, max_retries=10, retry_delay=0.005):
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+    def execute(self, portfolio, stock, quantity, price, transaction_type, user, notes=None):
+        """Apply the trade and record it; returns the saved ``Transaction``."""
+        def run():
+            self.update_position(portfolio, stock, quantity, price, transaction_type)
+            return Transaction.objects.create(
+                portfolio=portfolio,
+                stock=stock,
+                user=user,
+                transaction_type=transaction_type,
+                quantity=quantity,
+                price_per_share=price,
+                notes=notes,
+            )
+        return self._with_retries(run)
+
+    def update_position(self, portfolio, stock, quantity, price, transaction_type):
+        """Update the holding and cash balance for a trade; returns the holding (``None`` if closed)."""
+        with transaction.atomic():
+            # Stock first, as the feed and ingest lock it before marking portfolios to market,
+            # so a tick in flight cannot change the price the cached market value moves by
+            current_price = Stock.objects.select_for_update().values_list('current_price', flat=True).get(pk=stock.pk)
+            Portfolio.objects.select_for_update().only('id').get(pk=portfolio.pk)
+            holding = Holding.objects.select_for_update().filter(portfolio=portfolio, stock=stock).first()
+
+            current_qty = holding.quantity if holding else 0
+            avg_price = holding.average_buy_price if holding else Decimal('0.00')
+            new_qty, new_avg_price = next_position(current_qty, avg_price, quantity, price, transaction_type)
+
+            trade_value = Decimal(quantity) * Decimal(price)
+            cash_change = -trade_value if transaction_type == 'BUY' else trade_value
+            Portfolio.objects.filter(pk=portfolio.pk).update(
+                cash_balance=Round(F('cash_balance') + cash_change, 2),
+                # Keep the cached market value in step with the position change
+                cached_market_value=Round(F('cached_market_value') + Decimal(new_qty - current_qty) * current_price, 2),
+                last_updated=timezone.now(),
+            )
+
+            # Save or Delete Holding
+            if new_qty == 0:
+                if holding:
+                    holding.delete()
+                    holding = None
+            else:
+                if not holding:
+                    holding = Holding(portfolio=portfolio, stock=stock, quantity=0, average_buy_price=0)
+                holding.quantity = new_qty
+                holding.average_buy_price = new_avg_price
+                holding.save()
+        return holding
+
+    def _with_retries(self, func):
+        if connection.in_atomic_block:
+            # An outer transaction owns the locks; retrying here cannot help
+            with transaction.atomic():
+                return func()
+        for attempt in range(self.max_retries + 1):
+            try:
+                with transaction.atomic():
+                    return func()
+            except OperationalError:
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(min(self.retry_delay * 2 ** attempt, 0.5) * random.random())
@@ -0,0 +1,75 @@
+# trading/snapshots.py
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import connection, transaction
+
+from .models import Holding, HoldingReport, Portfolio, PortfolioReport
+from .performance import invalidate_performance
+
+
+def snapshot_portfolios(portfolio_ids, snapshot_run=None):
+    """Write a report for every portfolio in ``portfolio_ids`` in one transaction.
+
+    Portfolios already reported under ``snapshot_run`` are skipped, so a chunk
+    is all-or-nothing and rerunning it is safe. Returns ``(reports, holding_reports)``
+    row counts.
+    """
+    with transaction.atomic():
+        portfolios = Portfolio.objects.filter(pk__in=portfolio_ids)
+        if snapshot_run:
+            done = PortfolioReport.objects.filter(snapshot_run=snapshot_run, portfolio_id__in=portfolio_ids)
+            portfolios = portfolios.exclude(pk__in=done.values('portfolio_id'))
+        portfolios = list(portfolios.only('id', 'cash_balance'))
+        if not portfolios:
+            return 0, 0
+
+        holdings_by_portfolio = defaultdict(list)
+        for holding in Holding.objects.filter(portfolio__in=portfolios).select_related('stock').order_by('id'):
+            holdings_by_portfolio[holding.portfolio_id].append(holding)
+
+        reports = []
+        for portfolio in portfolios:
+            investment_value = sum((h.current_value for h in holdings_by_portfolio[portfolio.pk]), Decimal('0.00'))
+            reports.append(PortfolioReport(
+                portfolio=portfolio,
+                total_value=portfolio.cash_balance + investment_value,
+                cash_balance=portfolio.cash_balance,
+                investment_value=investment_value,
+                snapshot_run=snapshot_run,
+            ))
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            PortfolioReport.objects.bulk_create(reports, batch_size=500)
+        else:
+            for report in reports:
+                report.save()
+
+        holding_reports = [
+            HoldingReport.from_holding(report, holding)
+            for report in reports
+            for holding in holdings_by_portfolio[report.portfolio_id]
+        ]
+        HoldingReport.objects.bulk_create(holding_reports, batch_size=1000)
+
+    # bulk_create sends no post_save, so invalidate cached series here
+    for portfolio in portfolios:
+        invalidate_performance(portfolio.pk)
+    return len(reports), len(holding_reports)
+
+
+def init_worker():
+    """Process-pool initializer: make Django usable in a spawned child.
+
+    The parent must close its database connections before starting the pool so
+    forked children never share a socket with it.
+    """
+    import django
+
+    django.setup()
+
+
+def snapshot_chunk(portfolio_ids, snapshot_run):
+    """Pool entry point; returns ``(portfolio_ids, reports, holding_reports)``."""
+    reports, holding_reports = snapshot_portfolios(portfolio_ids, snapshot_run)
+    return portfolio_ids, reports, holding_reports
@@ -0,0 +1,32 @@
+// trading/static/js/stock_picker.js
+// Remote-search stock picker: typing in a [data-stock-search] input refills its <select>
+// from the autocomplete endpoint. Delegated, so it also works in HTMX-loaded modals.
+(function () {
+    var timers = new WeakMap();
+
+    function label(stock) {
+        return stock.symbol + ' - ' + stock.name + ' (₹' + parseFloat(stock.current_price).toFixed(2) + ')';
+    }
+
+    document.addEventListener('input', function (event) {
+        var input = event.target;
+        if (!input.matches || !input.matches('[data-stock-search]')) return;
+        clearTimeout(timers.get(input));
+        timers.set(input, setTimeout(function () {
+            var query = input.value.trim();
+            if (!query) return;
+            fetch(input.dataset.stockSearch + '?q=' + encodeURIComponent(query))
+                .then(function (response) { return response.json(); })
+                .then(function (stocks) {
+                    if (input.value.trim() !== query) return;  // a newer query is on its way
+                    var select = document.getElementById(input.dataset.target);
+                    select.innerHTML = '';
+                    stocks.forEach(function (stock) {
+                        select.add(new Option(label(stock), stock.id));
+                    });
+                    select.dispatchEvent(new Event('change', {bubbles: true}));
+                })
+                .catch(function (err) { console.error(err); });
+        }, 200));
+    });
+})();
@@ -1,9 +1,66 @@
-from django.test import TestCase
+import glob
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from unittest import mock
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import openpyxl
+from django.db import connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.core.management import call_command
+from django.contrib import admin as django_admin
 from django.contrib.auth.models import User
-from trading.models import Portfolio, Stock, Holding, Transaction, PortfolioReport
-from trading.views import update_portfolio_after_trade, generate_excel_report
+from trading.models import Portfolio, Stock, Holding, Transaction, PortfolioReport, HoldingReport, Job, NSEData, SnapshotFile
+from trading.views import update_portfolio_after_trade
+from trading.valuation import revalue_book, mark_to_market, check_marks
+from trading.services import TradeExecutionService
+from trading.jobs import claim_next, enqueue_snapshot, reclaim_stale, run_pending, metrics
+from trading.snapshots import snapshot_portfolios
+from trading.performance import performance_series, lttb
+from trading.ingest import ingest_nse_csv, parse_snapshot_name
+from trading.price_history import PriceHistory
+from trading.downloader import SessionPool, download_index, download_indices, snapshot_path
+from trading.archive import SnapshotReader, archive_file, open_snapshot
+from trading.exports import counters as export_counters, evict, export_path, export_response, open_export, write_rows
+from trading.admin import PortfolioAdmin
+from trading.active_portfolio import active_portfolio_name, remembered_portfolio
+from trading.feed import MarketFeed, Tick, price_tick
+from trading.quotes import SharedCounters, counters, get_quotes, quote_stats
+from trading.search import SymbolIndex, invalidate_search_index
+from trading.providers import ArchiveProvider, GBMProvider, ReplayProvider, create_synthetic_stocks
+from trading.views import process_nse_csv, get_downloaded_files
+from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
 from decimal import Decimal
 
+
+def isolated_cache():
+    """Settings override giving a fresh in-memory cache, so tests never touch the configured one."""
+    return override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': f'trading-tests-{uuid.uuid4().hex}',
+    }})
+
+
+_module_cache = isolated_cache()
+
+
+def setUpModule():
+    _module_cache.enable()
+
+
+def tearDownModule():
+    _module_cache.disable()
+
 class TradingTests(TestCase):
     def setUp(self):
         self.user = User.objects.create_user(username='testuser', password='password')
@@ -45,7 +102,1021 @@ class TradingTests(TestCase):
         self.assertEqual(report.total_value, self.portfolio.total_value)
 
         # Test Excel generation
-        response = generate_excel_report(report)
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir)
+        with override_settings(EXPORT_CACHE_DIR=export_dir):
+            response = export_response(report, 'excel')
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response['Content-Type'], 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-        self.assertTrue(len(response.content) > 0)
+        self.assertTrue(len(b''.join(response.streaming_content)) > 0)
+
+
+class PortfolioValuationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='valuer', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Valued', cash_balance=Decimal('50000.00'))
+        self.empty = Portfolio.objects.create(user=self.user, name='Empty', cash_balance=Decimal('1000.00'))
+        prices = [Decimal('101.35'), Decimal('2450.05'), Decimal('17.95')]
+        for i, price in enumerate(prices):
+            stock = Stock.objects.create(symbol=f'VAL{i}', name=f'Valued {i}', current_price=price)
+            Holding.objects.create(portfolio=self.portfolio, stock=stock, quantity=(i + 1) * 7 * (-1 if i == 2 else 1),
+                                   average_buy_price=price - Decimal('3.33'))
+
+    def test_with_valuation_matches_properties(self):
+        expected_total = Portfolio.objects.get(pk=self.portfolio.pk).total_value
+        expected_invested = Portfolio.objects.get(pk=self.portfolio.pk).invested_value
+        with self.assertNumQueries(1):
+            valued = list(Portfolio.objects.filter(user=self.user).with_valuation().order_by('pk'))
+        self.assertEqual(valued[0].total_value, expected_total)
+        self.assertEqual(valued[0].invested_value, expected_invested)
+        self.assertEqual(valued[0].holding_count, 3)
+        cost = sum(h.average_buy_price * h.quantity for h in self.portfolio.holdings.all())
+        self.assertEqual(valued[0].unrealized_pl, expected_invested - cost)
+        self.assertEqual(valued[1].total_value, Decimal('1000.00'))
+        self.assertEqual(valued[1].holding_count, 0)
+
+    def test_revalue_book_matches_properties(self):
+        book = revalue_book()
+        for portfolio in Portfolio.objects.all():
+            row = book.get(portfolio.pk)
+            self.assertEqual(row['total_value'], portfolio.total_value)
+            self.assertEqual(row['market_value'], portfolio.invested_value)
+        self.assertEqual(book.get(self.portfolio.pk)['holding_count'], 3)
+        self.assertEqual(book.get(self.empty.pk)['market_value'], Decimal('0.00'))
+        with self.assertRaises(KeyError):
+            book.get(0)
+
+
+class MarkToMarketTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='marker', password='password')
+        self.holder = Portfolio.objects.create(user=self.user, name='Holder', cash_balance=Decimal('100000.00'))
+        self.bystander = Portfolio.objects.create(user=self.user, name='Bystander', cash_balance=Decimal('100000.00'))
+        self.stock = Stock.objects.create(symbol='MTM', name='Marked', current_price=Decimal('100.00'))
+        self.other = Stock.objects.create(symbol='OTH', name='Other', current_price=Decimal('50.00'))
+
+    def test_trades_and_ticks_keep_cache_consistent(self):
+        update_portfolio_after_trade(self.holder, self.stock, 10, Decimal('100.00'), 'BUY')
+        update_portfolio_after_trade(self.bystander, self.other, 4, Decimal('50.00'), 'SELL')
+        self.assertEqual(check_marks(), [])
+
+        old_price = self.stock.current_price
+        Stock.objects.filter(pk=self.stock.pk).update(current_price=Decimal('103.35'))
+        with self.assertNumQueries(2):
+            updated = mark_to_market({self.stock.pk: (old_price, Decimal('103.35'))})
+        self.assertEqual(updated, 1)
+
+        self.holder.refresh_from_db()
+        self.bystander.refresh_from_db()
+        self.assertEqual(self.holder.cached_market_value, Decimal('1033.50'))
+        self.assertEqual(self.holder.marked_value, self.holder.total_value)
+        self.assertEqual(self.bystander.cached_market_value, Decimal('-200.00'))
+        self.assertEqual(check_marks(), [])
+
+    def test_check_marks_repairs_drift(self):
+        update_portfolio_after_trade(self.holder, self.stock, 10, Decimal('100.00'), 'BUY')
+        Portfolio.objects.filter(pk=self.holder.pk).update(cached_market_value=Decimal('1.00'))
+        self.assertEqual(check_marks(fix=True), [(self.holder.pk, Decimal('1.00'), Decimal('1000.00'))])
+        self.assertEqual(check_marks(), [])
+
+
+class ConcurrentTradeTests(TransactionTestCase):
+    orders = 40
+    threads = 8
+
+    def test_parallel_orders_on_one_portfolio_are_exact(self):
+        user = User.objects.create_user(username='stress', password='password')
+        portfolio = Portfolio.objects.create(user=user, name='Stressed', cash_balance=Decimal('1000000.00'))
+        stock = Stock.objects.create(symbol='STRS', name='Stress', current_price=Decimal('12.34'))
+        service = TradeExecutionService(max_retries=50)
+        errors = []
+        pending = list(range(self.orders))
+        lock = threading.Lock()
+
+        def worker():
+            try:
+                while True:
+                    with lock:
+                        if not pending:
+                            return
+                        pending.pop()
+                    service.execute(portfolio, stock, 3, Decimal('12.34'), 'BUY', user)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=worker) for _ in range(self.threads)]
+        for t in workers:
+            t.start()
+        for t in workers:
+            t.join()
+        elapsed = time.perf_counter() - started
+        print(f"\n{self.orders} orders on {self.threads} threads: {self.orders / elapsed:.1f} trades/sec")
+
+        self.assertEqual(errors, [])
+        portfolio.refresh_from_db()
+        holding = Holding.objects.get(portfolio=portfolio, stock=stock)
+        self.assertEqual(holding.quantity, self.orders * 3)
+        self.assertEqual(holding.average_buy_price, Decimal('12.34'))
+        self.assertEqual(portfolio.cash_balance, Decimal('1000000.00') - self.orders * 3 * Decimal('12.34'))
+        self.assertEqual(portfolio.cached_market_value, self.orders * 3 * Decimal('12.34'))
+        self.assertEqual(Transaction.objects.filter(portfolio=portfolio).count(), self.orders)
+
+
+class JobQueueTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='queued', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Queued', cash_balance=100000)
+        self.stock = Stock.objects.create(symbol='QUE', name='Queued Stock', current_price=100)
+        self.client.force_login(self.user)
+
+    def trade(self):
+        return self.client.post('/trading/trade/', {
+            'portfolio': self.portfolio.pk, 'stock': self.stock.pk, 'transaction_type': 'BUY',
+            'quantity': 2, 'price_per_share': '100.00',
+        })
+
+    def test_trades_enqueue_one_coalesced_snapshot(self):
+        self.assertEqual(self.trade().status_code, 302)
+        self.assertEqual(self.trade().status_code, 302)
+        self.assertEqual(PortfolioReport.objects.count(), 0)
+        self.assertEqual(Job.objects.filter(status='PENDING').count(), 1)
+        self.assertEqual(metrics()['pending'], 1)
+
+        self.assertEqual(run_pending(), 1)
+        report = PortfolioReport.objects.get()
+        self.assertEqual(report.total_value, Decimal('100000.00'))
+        self.assertEqual(report.holding_reports.get().quantity, 4)
+        stats = metrics()
+        self.assertEqual((stats['pending'], stats['done']), (0, 1))
+        self.assertIsNotNone(stats['max_latency'])
+
+    def test_stale_running_jobs_are_requeued_then_failed(self):
+        enqueue_snapshot(self.portfolio)
+        job = claim_next()
+        # The worker died mid-run: requeued while attempts remain, failed after that
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(reclaim_stale(), (1, 0))
+        job = claim_next()
+        Job.objects.filter(pk=job.pk).update(started_at=timezone.now() - timedelta(hours=1), attempts=3)
+        self.assertEqual(reclaim_stale(), (0, 1))
+        self.assertIn('after 3 attempts', Job.objects.get(pk=job.pk).error)
+
+    @override_settings(TRADING_JOBS_SYNC=True)
+    def test_sync_mode_runs_inline(self):
+        report = enqueue_snapshot(self.portfolio)
+        self.assertIsInstance(report, PortfolioReport)
+        self.assertFalse(Job.objects.exists())
+
+
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='snapper', password='password')
+        self.stocks = [Stock.objects.create(symbol=f'SNP{i}', name=f'Snap {i}', current_price=10 + i) for i in range(5)]
+        self.portfolios = [Portfolio.objects.create(user=self.user, name=f'Snap {i}', cash_balance=1000) for i in range(3)]
+        for portfolio in self.portfolios:
+            for stock in self.stocks:
+                Holding.objects.create(portfolio=portfolio, stock=stock, quantity=2, average_buy_price=10)
+
+    def test_generate_report_uses_constant_queries(self):
+        # holdings fetch, savepoint, report insert, bulk holding insert, release
+        with self.assertNumQueries(5):
+            report = self.portfolios[0].generate_report()
+        self.assertEqual(report.investment_value, Decimal('120.00'))
+        self.assertEqual(report.total_value, self.portfolios[0].total_value)
+        self.assertEqual(report.holding_reports.count(), 5)
+
+    def test_snapshot_run_resumes_without_duplicates(self):
+        ids = [p.pk for p in self.portfolios]
+        self.assertEqual(snapshot_portfolios(ids[:2], 'eod-test'), (2, 10))
+        self.assertEqual(snapshot_portfolios(ids, 'eod-test'), (1, 5))
+        self.assertEqual(snapshot_portfolios(ids, 'eod-test'), (0, 0))
+        self.assertEqual(PortfolioReport.objects.filter(snapshot_run='eod-test').count(), 3)
+        self.assertEqual(HoldingReport.objects.count(), 15)
+
+
+class ReportListingTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reporter', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Reported', cash_balance=1000)
+        self.other = Portfolio.objects.create(user=self.user, name='Other', cash_balance=500)
+        self.client.force_login(self.user)
+
+    def add_reports(self, count):
+        for i in range(count):
+            for portfolio in (self.portfolio, self.other):
+                PortfolioReport.objects.create(portfolio=portfolio, total_value=Decimal('1000.00') + i * Decimal('12.34'),
+                                               cash_balance=1000, investment_value=0)
+
+    def test_with_change_matches_properties(self):
+        self.add_reports(4)
+        annotated = {r.pk: r for r in PortfolioReport.objects.with_change()}
+        for report in PortfolioReport.objects.all():
+            self.assertEqual(annotated[report.pk].profit_loss, report.profit_loss)
+            self.assertAlmostEqual(annotated[report.pk].profit_loss_percentage, report.profit_loss_percentage, places=6)
+        first = PortfolioReport.objects.filter(portfolio=self.portfolio).order_by('created_at', 'id').first()
+        self.assertIsNone(annotated[first.pk].previous_value)
+        self.assertEqual(annotated[first.pk].profit_loss, Decimal('0.00'))
+
+    def test_reports_page_query_count_is_constant(self):
+        self.add_reports(2)
+        self.client.get('/trading/reports/', HTTP_HX_REQUEST='true')  # settle the session
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get('/trading/reports/', HTTP_HX_REQUEST='true').status_code, 200)
+        self.add_reports(20)
+        with CaptureQueriesContext(connection) as many:
+            response = self.client.get('/trading/reports/', HTTP_HX_REQUEST='true')
+        self.assertContains(response, '12.34')
+        self.assertEqual(len(few), len(many))
+
+
+class PerformanceSeriesTests(TestCase):
+    def setUp(self):
+        self.enterContext(isolated_cache())
+        self.user = User.objects.create_user(username='performer', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Performing', cash_balance=1000)
+
+    def report(self, value, days_ago, hours=0):
+        report = PortfolioReport.objects.create(portfolio=self.portfolio, total_value=value, cash_balance=value,
+                                                investment_value=0)
+        created = timezone.now().replace(hour=12) - timedelta(days=days_ago, hours=hours)
+        PortfolioReport.objects.filter(pk=report.pk).update(created_at=created)
+        return report
+
+    def test_daily_series_uses_last_snapshot_per_day(self):
+        self.report(900, days_ago=5, hours=2)
+        self.report(950, days_ago=5)
+        self.report(990, days_ago=2)
+        self.report(1010, days_ago=1)  # Saved last, so it invalidates the cache for the updates above
+        series = performance_series(self.portfolio, days=30)
+        self.assertEqual([p['value'] for p in series], [950, 950, 950, 990, 1010, 1000])
+        self.assertEqual(series[-1]['date'], timezone.localdate().isoformat())
+
+    def test_series_is_cached_until_a_new_report(self):
+        self.report(900, days_ago=3)
+        performance_series(self.portfolio)
+        with self.assertNumQueries(0):
+            performance_series(self.portfolio)
+        self.report(950, days_ago=1)
+        self.assertEqual([p['value'] for p in performance_series(self.portfolio)], [900, 900, 950, 1000])
+
+    def test_out_of_range_days_are_clamped(self):
+        self.report(900, days_ago=3)
+        self.assertEqual([p['value'] for p in performance_series(self.portfolio, days=10 ** 12)], [900, 1000])
+        self.assertEqual([p['value'] for p in performance_series(self.portfolio, days=-10 ** 12)], [1000])
+
+    def test_lttb_keeps_endpoints_and_peaks(self):
+        points = [{'value': float(i % 50)} for i in range(1000)]
+        points[500]['value'] = 10000.0
+        sampled = lttb(points, 40)
+        self.assertEqual(len(sampled), 40)
+        self.assertIs(sampled[0], points[0])
+        self.assertIs(sampled[-1], points[-1])
+        self.assertIn(points[500], sampled)
+
+
+class NSEIngestTests(TestCase):
+    def setUp(self):
+        history_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, history_dir)
+        self.enterContext(override_settings(PRICE_HISTORY_DIR=history_dir))
+        self.user = User.objects.create_user(username='ingester', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Ingest', cash_balance=Decimal('100000.00'))
+        self.stock = Stock.objects.create(symbol='RELIANCE', name='Reliance Industries', current_price=Decimal('1000.00'))
+        update_portfolio_after_trade(self.portfolio, self.stock, 10, Decimal('1000.00'), 'BUY')
+
+    def write_csv(self, text):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_bulk_upsert_counts_and_marks(self):
+        path = self.write_csv(
+            'SYMBOL ,HIGH ,LTP ,52W H \n'
+            'RELIANCE,"1,420.00","1,410.50","1,600.00"\n'
+            'TCS,"3,100.00","3,050.25",-\n'
+            'BROKEN,100.00,-,-\n'
+            'WAYTOOLONGSYMBOL,1.00,1.00,1.00\n'
+            ',1.00,1.00,1.00\n'
+        )
+        with self.assertNumQueries(6):
+            result = ingest_nse_csv(path)
+        self.assertEqual((result['created'], result['updated'], result['skipped']), (1, 1, 3))
+
+        self.stock.refresh_from_db()
+        self.assertEqual(self.stock.current_price, Decimal('1410.50'))
+        self.assertEqual(self.stock.day_high, Decimal('1420.00'))
+        self.assertEqual(self.stock.name, 'Reliance Industries')
+        tcs = Stock.objects.get(symbol='TCS')
+        self.assertEqual((tcs.name, tcs.current_price, tcs.year_high), ('TCS', Decimal('3050.25'), None))
+        self.assertEqual(check_marks(), [])
+
+    def test_change_recomputed_from_stored_close_without_a_close_column(self):
+        Stock.objects.filter(pk=self.stock.pk).update(prev_close=Decimal('1000.00'), change_pct=Decimal('5.00'))
+        ingest_nse_csv(self.write_csv('SYMBOL,LTP\nRELIANCE,"1,020.00"\nTCS,"3,050.25"\n'))
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.prev_close, self.stock.change_pct), (Decimal('1000.00'), Decimal('2.00')))
+        self.assertIsNone(Stock.objects.get(symbol='TCS').change_pct)
+
+    def test_blank_name_and_sector_keep_the_stored_values(self):
+        Stock.objects.filter(pk=self.stock.pk).update(sector='Energy')
+        ingest_nse_csv(self.write_csv('SYMBOL,COMPANY_NAME,INDUSTRY,LTP\nRELIANCE,,,"1,020.00"\nTCS,,,"3,050.25"\n'))
+        self.stock.refresh_from_db()
+        self.assertEqual((self.stock.name, self.stock.sector), ('Reliance Industries', 'Energy'))
+        tcs = Stock.objects.get(symbol='TCS')
+        self.assertEqual((tcs.name, tcs.sector), ('TCS', None))
+
+
+class TopMoversTests(TestCase):
+    def test_ingest_materialises_change_and_rankings_use_it(self):
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write(
+                'SYMBOL ,PREV. CLOSE ,LTP ,"VOLUME \n(shares)"\n'
+                'INFY,"1,440.00","1,495.10","1,04,13,061"\n'
+                'TCS,"3,000.00","2,940.00","2,00,000"\n'
+                'ITC,400.00,404.00,-\n'
+                'FLAT,100.00,100.00,"5,000"\n'
+            )
+        ingest_nse_csv(path, name='movers.csv')
+        infy = Stock.objects.get(symbol='INFY')
+        self.assertEqual((infy.prev_close, infy.change_pct, infy.volume), (Decimal('1440.00'), Decimal('3.83'), 10413061))
+        self.assertEqual(infy.price_change, Decimal('3.83'))
+
+        self.client.force_login(User.objects.create_user(username='movers', password='password'))
+        with self.assertNumQueries(3):
+            gainers = self.client.get('/trading/api/stocks/top-gainers/', {'n': 5}).json()
+        self.assertEqual([s['symbol'] for s in gainers['stocks']], ['INFY', 'ITC'])
+        losers = self.client.get('/trading/api/stocks/top-losers/').json()
+        self.assertEqual([(s['symbol'], s['change_pct']) for s in losers['stocks']], [('TCS', -2.0)])
+        active = self.client.get('/trading/api/stocks/most-active/', {'n': 2}).json()
+        self.assertEqual([s['symbol'] for s in active['stocks']], ['INFY', 'TCS'])
+        self.assertEqual(self.client.get('/trading/api/stocks/nope/').status_code, 404)
+
+        # A manual price edit keeps the materialised change in step
+        infy.current_price = Decimal('1296.00')
+        infy.save()
+        self.assertEqual(Stock.objects.get(pk=infy.pk).change_pct, Decimal('-10.00'))
+
+
+class NSEHistoryBackfillTests(TestCase):
+    def test_backfill_is_incremental_and_idempotent(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(PRICE_HISTORY_DIR=os.path.join(directory, 'history')))
+        header = 'SYMBOL ,OPEN ,HIGH ,LOW ,LTP ,"VOLUME \n(SHARES)"\n'
+        for name, price in [('NIFTY_50_20250820_163235.csv', '1,410.00'), ('Securities_in_F&O_20250821_154558.csv', '1,420.00')]:
+            with open(os.path.join(directory, name), 'w', encoding='utf-8') as f:
+                f.write(header + f'RELIANCE,"1,400.00","1,425.00","1,395.00","{price}","8,725,641"\nBAD,-,-,-,-,-\n')
+
+        call_command('backfill_nse_history', dir=directory, workers=1, stdout=io.StringIO())
+        rows = NSEData.objects.filter(symbol='RELIANCE').order_by('snapshot_at')
+        self.assertEqual([(r.index_type, r.close_price, r.volume) for r in rows],
+                         [('NIFTY50', Decimal('1410.00'), 8725641), ('FNO', Decimal('1420.00'), 8725641)])
+        self.assertEqual(rows[0].snapshot_at.isoformat(), '2025-08-20T16:32:35+00:00')
+        # Filenames are stamped and parsed in UTC, whatever zone the download time was in
+        ist = datetime(2025, 8, 20, 22, 2, 35, tzinfo=ZoneInfo('Asia/Kolkata'))
+        self.assertEqual(os.path.basename(snapshot_path('NIFTY 50', directory, ist)), 'NIFTY_50_20250820_163235.csv')
+        self.assertEqual(parse_snapshot_name(snapshot_path('NIFTY 50', directory, ist))[1], ist)
+        self.assertEqual(list(PriceHistory().series('RELIANCE').close), [141000, 142000])
+
+        out = io.StringIO()
+        call_command('backfill_nse_history', dir=directory, workers=1, stdout=out)
+        self.assertIn('0 to ingest', out.getvalue())
+        call_command('backfill_nse_history', dir=directory, workers=1, force=True, stdout=io.StringIO())
+        self.assertEqual(NSEData.objects.count(), 2)
+
+
+class PriceHistoryTests(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def test_append_is_idempotent_and_ranges_are_views(self):
+        history = PriceHistory(self.root)
+        self.assertEqual(history.append('TCS', [100, 300], [1, 3], [1, 3], [1, 3], [10000, 30000], [5, 7]), 2)
+        self.assertEqual(history.append('TCS', [300, 400], [3, 4], [3, 4], [3, 4], [30000, 40000], [7, 9]), 1)
+        # Out-of-order backfill is merged into place
+        self.assertEqual(history.append('TCS', [200], [2], [2], [2], [20000], [6]), 1)
+
+        series = PriceHistory(self.root).series('TCS', start=150, end=350)
+        self.assertIsInstance(series.close, np.memmap)
+        self.assertEqual(list(series.timestamp), [200, 300])
+        self.assertEqual(list(series.prices()), [200.0, 300.0])
+        self.assertEqual(PriceHistory(self.root).latest('TCS')['close'], 40000)
+        self.assertEqual(len(PriceHistory(self.root).series('INFY')), 0)
+
+    def test_writers_with_stale_indexes_share_files(self):
+        # Two processes' views of the store, both loaded before either wrote
+        ingest, feed = PriceHistory(self.root), PriceHistory(self.root)
+        self.assertEqual((ingest.index, feed.index), ({}, {}))
+        ingest.append('TCS', [100], [1], [1], [1], [10000], [5])
+        feed.append_snapshot(200, [('TCS', 2, 2, 2, 2, 6), ('INFY', 1, 1, 1, 1, 3)])
+        history = PriceHistory(self.root)
+        self.assertEqual(list(history.series('TCS').timestamp), [100, 200])
+        self.assertEqual(sorted(history.index.values()), ['000000.pxh', '000001.pxh'])
+
+    def test_reader_maps_the_file_whose_header_it_read(self):
+        writer = PriceHistory(self.root)
+        writer.append('TCS', [100, 200], [1, 2], [1, 2], [1, 2], [10000, 20000], [5, 6])
+        memmap, calls = np.memmap, []
+
+        def replaced_before_mapping(*args, **kwargs):
+            if not calls:
+                calls.append(1)
+                # A merge rewrites and swaps the file after the reader read the header
+                writer.append('TCS', [50], [0], [0], [0], [5000], [4])
+            return memmap(*args, **kwargs)
+
+        with mock.patch('trading.price_history.np.memmap', side_effect=replaced_before_mapping):
+            series = PriceHistory(self.root).series('TCS')
+        self.assertEqual(list(series.timestamp), [100, 200])
+        self.assertEqual(list(PriceHistory(self.root).series('TCS').timestamp), [50, 100, 200])
+
+
+class FakeNSEHandler(BaseHTTPRequestHandler):
+    """Stand-in for nseindia.com: cookie warm-up, slow CSV endpoint, scripted failures."""
+    def do_GET(self):
+        url = urlparse(self.path)
+        server = self.server
+        if url.path == '/market-data/live-equity-market':
+            server.warmups += 1
+            self.send_response(200)
+            self.send_header('Set-Cookie', 'nsit=warm; Path=/')
+            self.end_headers()
+            return
+        index = parse_qs(url.query).get('index', [''])[0]
+        if 'nsit=warm' not in self.headers.get('Cookie', ''):
+            self.send_error(401)
+            return
+        if server.failures.get(index):
+            server.failures[index] -= 1
+            self.send_error(503)
+            return
+        if index not in server.files:
+            self.send_error(404)
+            return
+        time.sleep(server.delay)
+        with open(server.files[index], 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/csv')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class NSEDownloaderTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        sources = sorted(glob.glob(os.path.join(settings.BASE_DIR, 'data', 'nse', 'SECURITIES_IN_F&O_*.csv')))
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeNSEHandler)
+        cls.server.files = {f'INDEX {i}': path for i, path in enumerate(sources[:6])}
+        cls.server.delay = 0.2
+        cls.server.warmups = 0
+        cls.server.failures = {}
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_address[1]}"
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.pool = SessionPool(size=6, base_url=self.base_url)
+        self.addCleanup(self.pool.close)
+
+    def test_concurrent_download_speedup(self):
+        targets = [(name, os.path.join(self.directory, f'{i}.csv')) for i, name in enumerate(self.server.files)]
+        started = time.perf_counter()
+        download_indices(targets, pool=self.pool, max_workers=1)
+        sequential = time.perf_counter() - started
+        started = time.perf_counter()
+        results = download_indices(targets, pool=self.pool)
+        concurrent = time.perf_counter() - started
+
+        print(f"\n{len(targets)} indices: sequential {sequential:.2f}s, concurrent {concurrent:.2f}s, "
+              f"speed-up {sequential / concurrent:.1f}x")
+        self.assertTrue(all(r['ok'] for r in results))
+        for (name, path), result in zip(targets, results):
+            with open(path, 'rb') as got, open(self.server.files[name], 'rb') as expected:
+                self.assertEqual(got.read(), expected.read())
+        self.assertLess(concurrent, sequential / 2)
+        # Sessions are warmed once and reused across both runs
+        self.assertLessEqual(self.server.warmups, self.pool.size)
+
+    def test_retries_with_backoff_and_no_partial_files(self):
+        self.server.failures['INDEX 0'] = 2
+        result = download_index('INDEX 0', os.path.join(self.directory, 'ok.csv'), pool=self.pool, backoff=0.01)
+        self.assertEqual((result['ok'], result['attempts']), (True, 3))
+
+        missing = download_index('NO SUCH INDEX', os.path.join(self.directory, 'missing.csv'), pool=self.pool, backoff=0.01)
+        self.assertEqual((missing['ok'], missing['attempts']), (False, 1))
+        self.assertEqual(sorted(os.listdir(self.directory)), ['ok.csv'])
+
+    def test_discarding_a_session_wakes_a_waiter(self):
+        pool = SessionPool(size=1, base_url=self.base_url)
+        with mock.patch.object(SessionPool, '_new_session', side_effect=lambda: mock.Mock()):
+            broken = pool.acquire()
+            got = []
+            waiter = threading.Thread(target=lambda: got.append(pool.acquire()))
+            waiter.start()
+            time.sleep(0.05)
+            self.assertEqual(got, [])
+            # The only session failed: the waiter creates a replacement instead of hanging
+            pool.release(broken, discard=True)
+            waiter.join(timeout=2)
+        self.assertFalse(waiter.is_alive())
+        self.assertIsNot(got[0], broken)
+        broken.close.assert_called_once()
+
+
+class SnapshotArchiveTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.enterContext(override_settings(NSE_ARCHIVE_DIR=os.path.join(self.directory, 'archive'),
+                                            PRICE_HISTORY_DIR=os.path.join(self.directory, 'history'),
+                                            NSE_DATA_DIR=self.directory))
+
+    def write(self, name, text):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        return path
+
+    def test_duplicates_share_one_blob_and_readers_go_through_archive(self):
+        csv = 'SYMBOL ,OPEN ,HIGH ,LOW ,LTP \nINFY,"1,500.00","1,520.00","1,490.00","1,510.00"\n'
+        _, stored = archive_file(self.write('NIFTY_50_20250820_163235.csv', csv))
+        self.assertTrue(stored)
+        created, updated, skipped = process_nse_csv(self.write('NIFTY_50_20250820_164134.csv', csv))
+        self.assertEqual((created, updated, skipped), (1, 0, 0))
+
+        # Raw downloads are removed once archived
+        self.assertFalse([name for name in os.listdir(self.directory) if name.endswith('.csv')])
+        self.assertEqual(SnapshotFile.objects.values('digest').distinct().count(), 1)
+        self.assertEqual([f['name'] for f in get_downloaded_files()],
+                         ['NIFTY_50_20250820_164134.csv', 'NIFTY_50_20250820_163235.csv'])
+        with open_snapshot('NIFTY_50_20250820_163235.csv') as f:
+            self.assertEqual(f.read().decode('utf-8'), csv)
+        self.assertEqual(Stock.objects.get(symbol='INFY').current_price, Decimal('1510.00'))
+
+        # Raw files (legacy or from older downloads) are readable, and listed once a sweep archives them
+        self.write('nifty50.csv', csv)
+        with mock.patch('os.listdir', side_effect=AssertionError('listing scanned the directory')):
+            self.assertNotIn('nifty50.csv', [f['name'] for f in get_downloaded_files()])
+        with open_snapshot('nifty50.csv') as f:
+            self.assertEqual(f.read().decode('utf-8'), csv)
+        call_command('archive_nse_files', stdout=io.StringIO())
+        self.assertIn('nifty50.csv', [f['name'] for f in get_downloaded_files()])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, 'nifty50.csv')))
+
+
+class SnapshotViewerTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(NSE_ARCHIVE_DIR=os.path.join(directory, 'archive')))
+        lines = ['SYMBOL,LTP\n'] + [f'SYM{i:05d},"{i:,}.00"\n' for i in range(20000)]
+        self.content = ''.join(lines).encode('utf-8')
+        path = os.path.join(directory, 'NIFTY_50_20250820_163235.csv')
+        with open(path, 'wb') as f:
+            f.write(self.content)
+        archive_file(path)
+        self.url = '/trading/view-file/NIFTY_50_20250820_163235.csv/'
+
+    def test_range_requests_stream_exact_bytes(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=70000-70099')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), self.content[70000:70100])
+        self.assertEqual(response['Content-Range'], f'bytes 70000-70099/{len(self.content)}')
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-').status_code, 416)
+        # Last byte before the first is invalid, not unsatisfiable: the header is ignored
+        reversed_range = self.client.get(self.url, HTTP_RANGE='bytes=100-50')
+        self.assertEqual(reversed_range.status_code, 200)
+        self.assertEqual(b''.join(reversed_range.streaming_content), self.content)
+        full = self.client.get(self.url)
+        self.assertEqual(b''.join(full.streaming_content), self.content)
+
+    def test_tail_reads_backwards_and_pages_are_parsed(self):
+        blocks = []
+        original = SnapshotReader._block
+        with mock.patch.object(SnapshotReader, '_block', autospec=True,
+                               side_effect=lambda reader, i: blocks.append(i) or original(reader, i)):
+            response = self.client.get(self.url, {'tail': 2})
+        self.assertEqual(response.content, b'SYM19998,"19,998.00"\nSYM19999,"19,999.00"\n')
+        self.assertEqual(len(set(blocks)), 1)
+
+        page = self.client.get(self.url, {'page': 3, 'page_size': 2}).json()
+        self.assertEqual(page['header'], ['SYMBOL', 'LTP'])
+        self.assertEqual(page['rows'], [['SYM00004', '4.00'], ['SYM00005', '5.00']])
+        self.assertTrue(page['has_next'])
+
+
+class MarketFeedTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.enterContext(override_settings(NSE_ARCHIVE_DIR=os.path.join(directory, 'archive')))
+        self.user = User.objects.create_user(username='feeder', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Feed', cash_balance=Decimal('100000.00'))
+        self.infy = Stock.objects.create(symbol='INFY', name='Infosys', current_price=Decimal('1500.00'))
+        self.tcs = Stock.objects.create(symbol='TCS', name='TCS', current_price=Decimal('3000.00'),
+                                        day_high=Decimal('3000.00'), day_low=Decimal('3000.00'),
+                                        year_high=Decimal('3100.00'), year_low=Decimal('2500.00'))
+        update_portfolio_after_trade(self.portfolio, self.infy, 10, Decimal('1500.00'), 'BUY')
+        for name, infy in [('NIFTY_50_20250820_163235.csv', '1,500.00'), ('NIFTY_50_20250820_164134.csv', '1,512.50')]:
+            path = os.path.join(directory, name)
+            with open(path, 'w', encoding='utf-8') as f:
+                f.write(f'SYMBOL ,LTP \nINFY,"{infy}"\nTCS,"3,000.00"\nNEWCO,10.00\n')
+            archive_file(path)
+
+    def test_replay_writes_and_publishes_only_changes(self):
+        received = []
+        price_tick.connect(lambda sender, changes, at, **kwargs: received.append((at, changes)), weak=False,
+                           dispatch_uid='test-feed')
+        self.addCleanup(price_tick.disconnect, dispatch_uid='test-feed')
+        before = Stock.objects.get(pk=self.tcs.pk).last_updated
+
+        feed = MarketFeed(history=False)
+        results = [feed.apply(tick) for tick in ArchiveProvider()]
+
+        self.assertEqual([len(changes) for changes in results], [0, 1])
+        self.assertEqual(len(received), 1)
+        self.assertEqual(received[0][1], [(self.infy.pk, 'INFY', Decimal('1500.00'), Decimal('1512.50'))])
+        self.assertEqual(Stock.objects.get(pk=self.infy.pk).current_price, Decimal('1512.50'))
+        self.assertEqual(Stock.objects.get(pk=self.tcs.pk).last_updated, before)
+        self.assertFalse(Stock.objects.filter(symbol='NEWCO').exists())
+        self.assertEqual(check_marks(), [])
+
+    def test_feed_started_on_a_new_day_rolls_the_close(self):
+        Stock.objects.filter(pk=self.tcs.pk).update(prev_close=Decimal('2900.00'), day_high=Decimal('3050.00'),
+                                                    last_updated=timezone.now() - timedelta(days=1))
+        feed = MarketFeed(history=False)
+        feed.apply(Tick(timezone.now(), {'TCS': Decimal('3030.00')}, None))
+        tcs = Stock.objects.get(pk=self.tcs.pk)
+        self.assertEqual((tcs.prev_close, tcs.change_pct), (Decimal('3000.00'), Decimal('1.00')))
+        self.assertEqual((tcs.day_high, tcs.day_low), (Decimal('3030.00'), Decimal('3030.00')))
+        # Later ticks the same day keep the rolled close and widen the range
+        feed.apply(Tick(timezone.now(), {'TCS': Decimal('2970.00')}, None))
+        tcs = Stock.objects.get(pk=self.tcs.pk)
+        self.assertEqual((tcs.prev_close, tcs.day_high, tcs.day_low),
+                         (Decimal('3000.00'), Decimal('3030.00'), Decimal('2970.00')))
+
+    def test_ticks_after_an_outside_price_change_do_not_drift(self):
+        feed = MarketFeed(history=False)
+        # Another writer moves the price after the feed loaded its last prices
+        Stock.objects.filter(pk=self.infy.pk).update(current_price=Decimal('1600.00'))
+        mark_to_market({self.infy.pk: (Decimal('1500.00'), Decimal('1600.00'))})
+        changes = feed.apply(Tick(timezone.now(), {'INFY': Decimal('1550.00')}, None))
+        self.assertEqual(changes, [(self.infy.pk, 'INFY', Decimal('1600.00'), Decimal('1550.00'))])
+        self.assertEqual(check_marks(), [])
+
+    def test_replay_interpolates_between_snapshots_and_tracks_ranges(self):
+        # The snapshots are 539s apart: ticks every 60 market-seconds plus the last snapshot, unpaced
+        ticks = list(ReplayProvider(step=60, speed=0))
+        self.assertEqual(len(ticks), 10)
+        self.assertEqual(ticks[-1].prices['INFY'], Decimal('1512.50'))
+        self.assertEqual(ticks[0].prices['INFY'], Decimal('1500.00'))
+        self.assertEqual(ticks[1].prices['INFY'], Decimal('1501.39'))
+        self.assertEqual(ticks[1].at - ticks[0].at, timedelta(seconds=60))
+        self.assertTrue(all(tick.frame is None for tick in ticks))
+
+        feed = MarketFeed(history=False)
+        for tick in ticks:
+            feed.apply(tick)
+        infy = Stock.objects.get(pk=self.infy.pk)
+        self.assertEqual(infy.current_price, ticks[-1].prices['INFY'])
+        self.assertEqual((infy.day_low, infy.year_low), (Decimal('1500.00'), Decimal('1500.00')))
+        self.assertEqual(infy.day_high, ticks[-1].prices['INFY'])
+        self.assertEqual(Stock.objects.get(pk=self.tcs.pk).year_high, Decimal('3100.00'))
+        self.assertEqual(check_marks(), [])
+
+
+class GBMSimulatorTests(TestCase):
+    def test_sector_moves_together_and_feed_persists_ticks(self):
+        create_synthetic_stocks(6, sectors=2)
+        Stock.objects.create(symbol='NOPRICE', name='Unpriced', current_price=Decimal('0.00'))
+        ticks = GBMProvider(rate=0, step=3600, volatility=0.5, correlation=1.0, seed=7).ticks()
+        first = next(ticks)
+        self.assertEqual(len(first.prices), 6)
+
+        # With full correlation every stock in a sector takes the same log return
+        start = dict(Stock.objects.values_list('symbol', 'current_price'))
+        returns = {s: float(first.prices[s] / start[s]) for s in first.prices}
+        self.assertAlmostEqual(returns['SIM000000'], returns['SIM000002'], places=3)
+        self.assertNotAlmostEqual(returns['SIM000000'], returns['SIM000001'], places=3)
+
+        feed = MarketFeed(history=False, batch_size=4)
+        feed.apply(first)
+        feed.apply(next(ticks))
+        stock = Stock.objects.get(symbol='SIM000003')
+        self.assertEqual(stock.current_price, feed.last_prices['SIM000003'].price)
+        self.assertEqual(stock.day_high, max(first.prices['SIM000003'], stock.current_price))
+
+    def test_stocks_without_a_sector_move_independently(self):
+        for symbol in ('LONE1', 'LONE2', 'LONE3'):
+            Stock.objects.create(symbol=symbol, name=symbol, current_price=Decimal('100.00'))
+        tick = next(GBMProvider(rate=0, step=3600, volatility=0.5, correlation=1.0, seed=7).ticks())
+        self.assertEqual(len(set(tick.prices.values())), 3)
+
+
+class ActivePortfolioTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='active', password='password')
+        self.first = Portfolio.objects.create(user=self.user, name='First', cash_balance=Decimal('1000.00'))
+        self.second = Portfolio.objects.create(user=self.user, name='Second', cash_balance=Decimal('1000.00'))
+        self.client.force_login(self.user)
+
+    def test_portfolio_resolved_once_and_only_when_used(self):
+        self.client.get('/trading/transactions/', {'portfolio': self.second.pk}, HTTP_HX_REQUEST='true')
+        # Session, user, one active-portfolio lookup, the selector and the transactions:
+        # previously the context processor and view added exists() and two get()s
+        with self.assertNumQueries(5):
+            response = self.client.get('/trading/transactions/', HTTP_HX_REQUEST='true')
+        self.assertEqual(response.context['portfolio'], self.second)
+        # Session, user, the conditional-GET validator and stocks: the lazy context processor costs nothing
+        with self.assertNumQueries(4):
+            self.client.get('/trading/stocks/', HTTP_HX_REQUEST='true')
+
+    def test_remembered_name_expires_on_portfolio_changes(self):
+        self.client.get('/trading/transactions/', {'portfolio': self.second.pk}, HTTP_HX_REQUEST='true')
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = self.client.session
+        self.assertEqual(active_portfolio_name(request), 'Second')
+
+        self.second.visibility = 'PRIVATE'
+        self.second.save()
+        self.assertIsNone(remembered_portfolio(request))
+        self.assertEqual(active_portfolio_name(request), 'First')
+        self.first.delete()
+        del request._active_portfolio
+        self.assertEqual(active_portfolio_name(request), '')
+
+    def test_admin_visibility_actions_expire_the_remembered_name(self):
+        self.client.get('/trading/transactions/', {'portfolio': self.second.pk}, HTTP_HX_REQUEST='true')
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = self.client.session
+        self.assertIsNotNone(remembered_portfolio(request))
+
+        admin = PortfolioAdmin(Portfolio, django_admin.site)
+        admin.make_private(request, Portfolio.objects.filter(pk=self.second.pk))
+        self.assertIsNone(remembered_portfolio(request))
+
+
+class QuoteCacheTests(TestCase):
+    def setUp(self):
+        self.enterContext(isolated_cache())
+        counters.clear()
+        self.stock = Stock.objects.create(symbol='INFY', name='Infosys', current_price=Decimal('1500.00'))
+        self.other = Stock.objects.create(symbol='TCS', name='TCS', current_price=Decimal('3000.00'))
+        self.client.force_login(User.objects.create_user(username='quoter', password='password'))
+
+    def test_prices_served_from_cache_until_ingest_bumps_version(self):
+        url = f'/trading/api/stock-price/{self.stock.pk}/'
+        self.client.get(url)
+        # Session and user only: the price comes from the cache
+        with self.assertNumQueries(2):
+            self.assertEqual(self.client.get(url).json()['price'], 1500.0)
+        # A multi-get loads only the missing quote, in one query
+        with self.assertNumQueries(1):
+            get_quotes([self.stock.pk, self.other.pk])
+        with self.assertNumQueries(0):
+            quotes = get_quotes([self.stock.pk, self.other.pk])
+        self.assertEqual(quotes[self.other.pk]['current_price'], Decimal('3000.00'))
+        self.assertEqual((counters['hits'], counters['misses']), (4, 2))
+
+        handle, path = tempfile.mkstemp(suffix='.csv')
+        self.addCleanup(os.remove, path)
+        with os.fdopen(handle, 'w', encoding='utf-8') as f:
+            f.write('SYMBOL ,LTP \nINFY,"1,512.50"\n')
+        history_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, history_dir)
+        with override_settings(PRICE_HISTORY_DIR=history_dir), self.captureOnCommitCallbacks(execute=True):
+            ingest_nse_csv(path, name='quotes.csv')
+        self.assertEqual(self.client.get(url).json()['price'], 1512.5)
+
+    def test_stats_count_every_process(self):
+        get_quotes([self.stock.pk])
+        # Another worker's counters, sharing the cache
+        SharedCounters('quotes', ['hits', 'misses']).incr('hits', 3)
+        stats = quote_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['hit_rate']), (3, 1, 0.75))
+
+
+class StockSearchTests(TestCase):
+    def setUp(self):
+        self.enterContext(isolated_cache())
+        for symbol, name in [('INFY', 'Infosys'), ('INFRATEL', 'Bharti Infratel'), ('TCS', 'Tata Consultancy'),
+                             ('NAUKRI', 'Info Edge'), ('INF', 'Inf Holdings')]:
+            Stock.objects.create(symbol=symbol, name=name, current_price=Decimal('100.00'))
+        self.client.force_login(User.objects.create_user(username='searcher', password='password'))
+
+    def test_ranks_exact_prefix_then_substring(self):
+        index = SymbolIndex(Stock.objects.values_list('id', 'symbol', 'name'))
+        symbols = dict(Stock.objects.values_list('id', 'symbol'))
+        self.assertEqual([symbols[pk] for pk in index.search('inf')], ['INF', 'INFRATEL', 'INFY', 'NAUKRI'])
+        self.assertEqual([symbols[pk] for pk in index.search('consult')], ['TCS'])
+        self.assertEqual([symbols[pk] for pk in index.search('a', limit=2)], ['INFRATEL', 'NAUKRI'])
+        self.assertEqual(index.search('zzz'), [])
+
+    def test_autocomplete_needs_no_database_query_once_warm(self):
+        self.client.get('/trading/stock-search/', {'q': 'inf'})
+        with self.assertNumQueries(0):
+            results = self.client.get('/trading/stock-search/', {'q': 'inf'}).json()
+        self.assertEqual([r['symbol'] for r in results], ['INF', 'INFRATEL', 'INFY', 'NAUKRI'])
+        Stock.objects.create(symbol='INFIBEAM', name='Infibeam Avenues', current_price=Decimal('20.00'))
+        invalidate_search_index()
+        self.assertIn('INFIBEAM', [r['symbol'] for r in self.client.get('/trading/stock-search/', {'q': 'infi'}).json()])
+
+    def test_stock_list_filter_does_not_bind_every_match(self):
+        Stock.objects.bulk_create([Stock(symbol=f'A{i:04d}', name='Alpha', current_price=Decimal('1.00'))
+                                   for i in range(2000)])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/trading/stocks/', {'q': 'a'}, HTTP_HX_REQUEST='true')
+        self.assertEqual(len(response.context['stocks']), 2003)
+        stock_query = queries.captured_queries[-1]['sql']
+        self.assertLess(len(stock_query), 2000)
+
+
+class TradeStockPickerTests(TestCase):
+    def setUp(self):
+        self.enterContext(isolated_cache())
+        self.user = User.objects.create_user(username='picker', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Picker', cash_balance=Decimal('100000.00'))
+        self.stock = Stock.objects.create(symbol='INFY', name='Infosys', current_price=Decimal('1500.00'))
+        self.client.force_login(self.user)
+
+    def modal(self):
+        return self.client.get(f'/trading/trade/{self.stock.pk}/', HTTP_HX_REQUEST='true').content.decode()
+
+    def test_modal_size_does_not_grow_with_the_stock_universe(self):
+        small = self.modal()
+        self.assertIn('INFY - Infosys (₹1500.00)', small)
+        Stock.objects.bulk_create(
+            [Stock(symbol=f'S{i:05d}', name=f'Stock {i}', current_price=Decimal('10.00')) for i in range(500)]
+        )
+        invalidate_search_index()
+        large = self.modal()
+        self.assertEqual(len(large.replace(self.client.cookies['csrftoken'].value, '')),
+                         len(small.replace(self.client.cookies['csrftoken'].value, '')))
+        self.assertNotIn('S00001', large)
+
+    def test_posted_stock_resolved_by_primary_key(self):
+        response = self.client.post('/trading/trade/', {
+            'portfolio': self.portfolio.pk, 'stock': self.stock.pk, 'transaction_type': 'BUY',
+            'quantity': 1, 'price_per_share': '1500.00',
+        })
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Transaction.objects.get().stock, self.stock)
+        response = self.client.post('/trading/trade/', {
+            'portfolio': self.portfolio.pk, 'stock': 'INFY', 'transaction_type': 'BUY',
+            'quantity': 1, 'price_per_share': '1500.00',
+        }, HTTP_HX_REQUEST='true')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Transaction.objects.count(), 1)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.enterContext(isolated_cache())
+        self.user = User.objects.create_user(username='etag', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Main', cash_balance=Decimal('1000.00'))
+        self.stock = Stock.objects.create(symbol='INFY', name='Infosys', current_price=Decimal('1500.00'))
+        self.client.force_login(self.user)
+
+    def test_price_not_modified_until_the_stock_changes(self):
+        url = f'/trading/api/stock-price/{self.stock.pk}/'
+        etag = self.client.get(url)['ETag']
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.stock.current_price = Decimal('1512.50')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stock.save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['price'], 1512.5)
+
+    def test_report_export_is_immutable(self):
+        export_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, export_dir)
+        self.enterContext(override_settings(EXPORT_CACHE_DIR=export_dir))
+        report = PortfolioReport.objects.create(portfolio=self.portfolio, total_value=Decimal('1000.00'),
+                                                cash_balance=Decimal('1000.00'), investment_value=Decimal('0.00'))
+        url = f'/trading/reports/{report.pk}/'
+        response = self.client.get(url, {'export': 'excel'})
+        self.assertIn('immutable', response['Cache-Control'])
+        response = self.client.get(url, {'export': 'excel'}, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+
+class ExportCacheTests(TestCase):
+    def setUp(self):
+        export_counters.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.enterContext(override_settings(EXPORT_CACHE_DIR=self.directory))
+        user = User.objects.create_user(username='exporter', password='password')
+        portfolio = Portfolio.objects.create(user=user, name='Export', cash_balance=Decimal('100000.00'))
+        for i in range(3):
+            stock = Stock.objects.create(symbol=f'EXP{i}', name=f'Export {i}', current_price=Decimal('100.00') + i)
+            Holding.objects.create(portfolio=portfolio, stock=stock, quantity=10, average_buy_price=Decimal('90.00'))
+        self.report = portfolio.generate_report()
+        self.client.force_login(user)
+
+    def test_rendered_once_then_served_from_disk(self):
+        url = f'/trading/reports/{self.report.pk}/'
+        # Holding snapshots and their stocks in one query, whatever the number of rows
+        with CaptureQueriesContext(connection) as queries:
+            first = b''.join(self.client.get(url, {'export': 'pdf'}).streaming_content)
+        self.assertEqual(sum('trading_holdingreport' in q['sql'] for q in queries.captured_queries), 1)
+        # Session, user and the validator's report lookup; the view's get() and no rendering
+        with self.assertNumQueries(4):
+            second = b''.join(self.client.get(url, {'export': 'pdf'}).streaming_content)
+        self.assertEqual(first, second)
+        self.assertEqual((export_counters['hits'], export_counters['misses'], export_counters['renders']), (1, 1, 1))
+
+    @override_settings(TRADING_JOBS_SYNC=True)
+    def test_generate_prerenders_and_evicts_least_recently_served(self):
+        self.client.get('/trading/reports/generate/')
+        report = PortfolioReport.objects.latest('id')
+        self.assertEqual(export_counters['renders'], 2)
+        for fmt in ('pdf', 'excel'):
+            open_export(report, fmt).close()
+        self.assertEqual(export_counters['hits'], 2)
+        pdf, excel = export_path(report, 'pdf'), export_path(report, 'excel')
+        os.utime(pdf, (0, 0))
+        self.assertEqual(evict(os.path.getsize(excel)), 1)
+        self.assertFalse(os.path.exists(pdf))
+        self.assertTrue(os.path.exists(excel))
+
+    def test_export_larger_than_the_cache_is_still_served(self):
+        url = f'/trading/reports/{self.report.pk}/'
+        with override_settings(EXPORT_CACHE_MAX_BYTES=1):
+            response = self.client.get(url, {'export': 'pdf'})
+            content = b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(content.startswith(b'%PDF'))
+            self.assertTrue(os.path.exists(export_path(self.report, 'pdf')))
+            # The next render evicts it; the one just written is kept
+            open_export(self.report, 'excel').close()
+        self.assertFalse(os.path.exists(export_path(self.report, 'pdf')))
+        self.assertTrue(os.path.exists(export_path(self.report, 'excel')))
+
+
+class StreamingExportTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='streamer', password='password')
+        self.portfolio = Portfolio.objects.create(user=self.user, name='Stream', cash_balance=Decimal('100000.00'))
+        self.stock = Stock.objects.create(symbol='INFY', name='Infosys', current_price=Decimal('100.00'))
+        self.client.force_login(self.user)
+
+    def trades(self, count):
+        Transaction.objects.bulk_create([
+            Transaction(portfolio=self.portfolio, stock=self.stock, user=self.user, transaction_type='BUY',
+                        quantity=i + 1, price_per_share=Decimal('100.00')) for i in range(count)
+        ])
+
+    def test_transaction_csv_streams_in_constant_queries(self):
+        url = f'/trading/portfolios/{self.portfolio.pk}/transactions.csv'
+        self.trades(5)
+        # Session, user, portfolio and one joined transaction query, whatever the history length
+        with self.assertNumQueries(4):
+            lines = b''.join(self.client.get(url).streaming_content).decode().splitlines()
+        self.assertEqual(len(lines), 6)
+        self.assertEqual(lines[1].split(',')[1:6], ['INFY', 'BUY', '1', '100.00', '100.00'])
+        self.trades(500)
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+            self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 506)
+        other = User.objects.create_user(username='other', password='password')
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_write_only_sheet_sized_from_sample(self):
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet('Rows')
+        write_rows(ws, (['row', 'x' * i] for i in range(50)), sample=10)
+        self.assertEqual(ws.column_dimensions['A'].width, 5)
+        self.assertEqual(ws.column_dimensions['B'].width, 11)
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        rows = list(openpyxl.load_workbook(buffer).active.values)
+        self.assertEqual(len(rows), 50)
+        self.assertEqual(rows[-1][1], 'x' * 49)
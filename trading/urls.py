@@ -21,6 +21,8 @@ urlpatterns = [
     path('portfolios/create/', views.create_portfolio, name='create_portfolio'),
     path('portfolios/manage/', views.portfolio_list, name='portfolio_manage'),
     path('portfolios/<int:pk>/delete/', views.delete_portfolio, name='portfolio_delete'),
+    path('portfolios/<int:pk>/transactions.csv', views.export_transactions_csv, name='export_transactions_csv'),
+    path('portfolios/<int:pk>/reports.csv', views.export_reports_csv, name='export_reports_csv'),
 
     # Stocks
     path('stocks/', views.stock_list, name='stock_list'),
@@ -75,6 +77,9 @@ urlpatterns = [
     path('view-file/<str:filename>/', views.view_file, name='view_file'),
 
     path('api/stock-price/<int:stock_id>/', views.get_stock_price_api, name='stock_price_api'),
+    path('api/stocks/<slug:ranking>/', views.top_movers_api, name='top_movers_api'),
+    path('api/quote-cache-stats/', views.quote_cache_stats_api, name='quote_cache_stats_api'),
+    path('api/export-cache-stats/', views.export_cache_stats_api, name='export_cache_stats_api'),
     path('api/stock-transactions/<int:stock_id>/', views.stock_transactions_api, name='stock_transactions_api'),
     path('reports/<int:pk>/', views.report_detail, name='report_detail'),
     path('reports/generate/', views.generate_report, name='generate_report'),
@@ -0,0 +1,181 @@
+# trading/valuation.py
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.db.models import BigIntegerField, F, Value
+from django.db.models.functions import Cast, Round
+
+from .models import Holding, Portfolio, Stock
+
+
+def _paise(field):
+    """SQL expression converting a 2dp rupee column to integer paise."""
+    return Cast(Round(F(field) * 100), output_field=BigIntegerField())
+
+
+def _to_rupees(paise):
+    return Decimal(int(paise)).scaleb(-2)
+
+
+def _columns(queryset, *fields):
+    """Load ``fields`` from ``queryset`` as a 2-D int64 array, one column per field."""
+    rows = list(queryset.values_list(*fields))
+    return np.array(rows, dtype=np.int64).reshape(len(rows), len(fields))
+
+
+def _group_sum(index, values, size):
+    """Exact int64 sum of ``values`` grouped by ``index`` (bincount without the float weights)."""
+    totals = np.zeros(size, dtype=np.int64)
+    np.add.at(totals, index, values)
+    return totals
+
+
+class BookValuation:
+    """Per-portfolio valuation arrays, all money amounts in int64 paise."""
+
+    def __init__(self, portfolio_ids, cash, market_value, invested_cost, holding_count):
+        self.portfolio_ids = portfolio_ids
+        self.cash = cash
+        self.market_value = market_value
+        self.invested_cost = invested_cost
+        self.holding_count = holding_count
+        self.unrealized_pl = market_value - invested_cost
+        self.total_value = cash + market_value
+
+    def __len__(self):
+        return len(self.portfolio_ids)
+
+    def _index(self, portfolio_id):
+        i = int(np.searchsorted(self.portfolio_ids, portfolio_id))
+        if i >= len(self.portfolio_ids) or self.portfolio_ids[i] != portfolio_id:
+            raise KeyError(portfolio_id)
+        return i
+
+    def get(self, portfolio_id):
+        """Return one portfolio's figures as Decimals, matching the model properties."""
+        return self._row(self._index(portfolio_id))
+
+    def rows(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+    def _row(self, i):
+        return {
+            'portfolio_id': int(self.portfolio_ids[i]),
+            'cash_balance': _to_rupees(self.cash[i]),
+            'market_value': _to_rupees(self.market_value[i]),
+            'invested_cost': _to_rupees(self.invested_cost[i]),
+            'unrealized_pl': _to_rupees(self.unrealized_pl[i]),
+            'total_value': _to_rupees(self.total_value[i]),
+            'holding_count': int(self.holding_count[i]),
+        }
+
+    def totals(self):
+        """Whole-book sums as Decimals."""
+        return {
+            'portfolios': len(self),
+            'cash_balance': _to_rupees(self.cash.sum()),
+            'market_value': _to_rupees(self.market_value.sum()),
+            'invested_cost': _to_rupees(self.invested_cost.sum()),
+            'unrealized_pl': _to_rupees(self.unrealized_pl.sum()),
+            'total_value': _to_rupees(self.total_value.sum()),
+            'holdings': int(self.holding_count.sum()),
+        }
+
+
+def revalue_book(portfolios=None):
+    """Value every portfolio in ``portfolios`` (default: all) with vectorised NumPy reductions.
+
+    Holdings, stock prices and cash balances are each loaded in a single query as
+    columnar int64 arrays; prices are gathered by stock id and reduced per portfolio.
+    """
+    if portfolios is None:
+        portfolios = Portfolio.objects.all()
+    portfolios = portfolios.order_by('id')
+
+    portfolio_rows = _columns(portfolios.annotate(cash_paise=_paise('cash_balance')), 'id', 'cash_paise')
+    portfolio_ids, cash = portfolio_rows[:, 0], portfolio_rows[:, 1]
+
+    holdings = Holding.objects.filter(portfolio__in=portfolios.values('id')).annotate(
+        avg_paise=_paise('average_buy_price'))
+    holding_rows = _columns(holdings, 'portfolio_id', 'stock_id', 'quantity', 'avg_paise')
+    holding_portfolios, holding_stocks = holding_rows[:, 0], holding_rows[:, 1]
+    quantities, avg_prices = holding_rows[:, 2], holding_rows[:, 3]
+
+    stock_rows = _columns(Stock.objects.annotate(price_paise=_paise('current_price')), 'id', 'price_paise')
+    price_by_stock = np.zeros(int(stock_rows[:, 0].max(initial=0)) + 1, dtype=np.int64)
+    price_by_stock[stock_rows[:, 0]] = stock_rows[:, 1]
+
+    index = np.searchsorted(portfolio_ids, holding_portfolios)
+    size = len(portfolio_ids)
+    return BookValuation(
+        portfolio_ids,
+        cash,
+        _group_sum(index, quantities * price_by_stock[holding_stocks], size),
+        _group_sum(index, quantities * avg_prices, size),
+        np.bincount(index, minlength=size),
+    )
+
+
+def revalue_with_properties(portfolios=None):
+    """Reference path: value each portfolio through the ``Portfolio.total_value`` property."""
+    if portfolios is None:
+        portfolios = Portfolio.objects.all()
+    return {p.id: p.total_value for p in portfolios.order_by('id')}
+
+
+def mark_to_market(price_changes, batch_size=500):
+    """Apply price ticks to ``Portfolio.cached_market_value`` incrementally.
+
+    ``price_changes`` maps stock id to ``(old_price, new_price)``. Only portfolios
+    holding a changed stock are touched: each receives ``sum(qty * (new - old))``
+    through the (stock, portfolio, quantity) holding index, in one bulk update.
+    Returns the number of portfolios updated.
+    """
+    deltas = {
+        stock_id: Decimal(new) - Decimal(old)
+        for stock_id, (old, new) in price_changes.items()
+        if old is not None and Decimal(new) != Decimal(old)
+    }
+    if not deltas:
+        return 0
+
+    adjustments = {}
+    rows = Holding.objects.filter(stock_id__in=deltas).values_list('portfolio_id', 'stock_id', 'quantity')
+    for portfolio_id, stock_id, quantity in rows:
+        adjustments[portfolio_id] = adjustments.get(portfolio_id, Decimal('0.00')) + quantity * deltas[stock_id]
+
+    Portfolio.objects.bulk_update(
+        [Portfolio(pk=portfolio_id, cached_market_value=Round(F('cached_market_value') + Value(delta), 2))
+         for portfolio_id, delta in adjustments.items() if delta],
+        ['cached_market_value'],
+        batch_size=batch_size,
+    )
+    return len(adjustments)
+
+
+def check_marks(portfolios=None, fix=False):
+    """Compare ``cached_market_value`` against a full recompute.
+
+    Returns ``[(portfolio_id, cached, actual), ...]`` for every portfolio that
+    drifted; with ``fix=True`` the cached values are overwritten with ``actual``.
+    """
+    if portfolios is None:
+        portfolios = Portfolio.objects.all()
+    book = revalue_book(portfolios)
+    cached = dict(portfolios.values_list('id', 'cached_market_value'))
+
+    drift = []
+    for row in book.rows():
+        if cached.get(row['portfolio_id']) != row['market_value']:
+            drift.append((row['portfolio_id'], cached.get(row['portfolio_id']), row['market_value']))
+
+    if fix and drift:
+        with transaction.atomic():
+            Portfolio.objects.bulk_update(
+                [Portfolio(pk=portfolio_id, cached_market_value=actual) for portfolio_id, _, actual in drift],
+                ['cached_market_value'],
+                batch_size=500,
+            )
+    return drift
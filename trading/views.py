@@ -1,157 +1,66 @@
 import json
-import io
 import os
-import glob
-import requests
-import pandas as pd
-from decimal import Decimal, InvalidOperation
+from decimal import Decimal
 from datetime import timedelta
 
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib.admin.views.decorators import staff_member_required
-from django.views.decorators.http import require_GET, require_POST
+from django.views.decorators.http import condition, require_GET, require_POST
+from django.views.decorators.vary import vary_on_headers
 from django.views.decorators.csrf import csrf_exempt
-from django.http import JsonResponse, HttpResponse
+from django.http import Http404, JsonResponse, HttpResponse, StreamingHttpResponse
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.contrib.auth import login
 from django.contrib.auth.models import User
-from django.db.models import Q
 from django.contrib.auth.views import LoginView, LogoutView, PasswordResetView, PasswordResetDoneView, PasswordResetConfirmView, PasswordResetCompleteView
 
-from reportlab.lib.pagesizes import A4
-from reportlab.lib.units import inch
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle
-from reportlab.lib import colors
-
-import openpyxl
-from openpyxl.styles import Font, PatternFill, Alignment
-
-from .models import Stock, Portfolio, Transaction, Holding, PortfolioReport, HoldingReport, Watchlist, Profile, NSEData
+from .models import Stock, Portfolio, Transaction, Holding, PortfolioReport, HoldingReport, Watchlist, Profile, NSEData, Job
 from .forms import TradeForm, PortfolioForm, WatchlistForm, UserRegisterForm, UserUpdateForm, ProfileUpdateForm
+from .valuation import mark_to_market
+from .services import TradeExecutionService
+from .jobs import enqueue, enqueue_exports, enqueue_snapshot
+from .exports import csv_response, export_cache_stats, export_response, report_csv_rows, transaction_csv_rows
+from .performance import performance_series, lttb
+from .ingest import ingest_nse_csv
+from .price_history import PriceHistory
+from .archive import SnapshotReader, archive_file, list_downloads, open_snapshot
+from .quotes import cached_by_version, get_quote, get_quotes, quote_stats
+from .search import get_index, search_stocks
+from .conditional import (
+    IMMUTABLE_MAX_AGE, report_etag, report_last_modified, request_quote, stock_list_etag, stock_list_last_modified,
+    stock_price_etag, stock_price_last_modified,
+)
+from .active_portfolio import get_active_portfolio, invalidate_active_portfolio, set_active_portfolio
 
 # Helper function to handle trade logic
 def update_portfolio_after_trade(portfolio, stock, quantity, price, transaction_type):
-    # Fetch existing holding or create dummy if None
-    holding = Holding.objects.filter(portfolio=portfolio, stock=stock).first()
-
-    current_qty = holding.quantity if holding else 0
-    avg_price = holding.average_buy_price if holding else Decimal('0.00')
-
-    trade_value = Decimal(quantity) * Decimal(price)
-
-    # Update Cash Balance
-    if transaction_type == 'BUY':
-        portfolio.cash_balance -= trade_value
-    else: # SELL
-        portfolio.cash_balance += trade_value
-
-    # Calculate New Holding State
-    new_qty = current_qty
-    new_avg_price = avg_price
-
-    if transaction_type == 'BUY':
-        # Buying shares
-        if current_qty >= 0:
-            # Case 1: Increasing Long Position (or opening)
-            total_cost = (Decimal(current_qty) * avg_price) + trade_value
-            new_qty = current_qty + quantity
-            if new_qty > 0:
-                new_avg_price = total_cost / Decimal(new_qty)
-            else:
-                new_avg_price = Decimal('0.00')
-        else:
-            # Case 2: Covering Short Position
-            # Buying back shares you owe.
-            if abs(current_qty) >= quantity:
-                # 2a: Partial or Full Cover (remaining is still short or flat)
-                new_qty = current_qty + quantity
-                # Avg Price (Avg Sell Price) remains SAME for the remaining short position.
-                if new_qty == 0:
-                    new_avg_price = Decimal('0.00')
-            else:
-                # 2b: Flip from Short to Long
-                remaining_short = abs(current_qty)
-                excess_buy = quantity - remaining_short
-
-                # Close the short part (P/L realized implicitly by cash change vs initial short proceeds)
-                # Open new Long position
-                new_qty = excess_buy
-                new_avg_price = Decimal(price)
-
-    else: # SELL
-        # Selling shares
-        if current_qty > 0:
-            # Case 3: Decreasing Long Position (or closing)
-            if current_qty >= quantity:
-                # 3a: Partial or Full Sell
-                new_qty = current_qty - quantity
-                # Avg Price (Avg Buy Price) remains SAME for remaining long position.
-                if new_qty == 0:
-                    new_avg_price = Decimal('0.00')
-            else:
-                # 3b: Flip from Long to Short
-                remaining_long = current_qty
-                excess_sell = quantity - remaining_long
-
-                # Close the long part
-                # Open new Short position
-                new_qty = -excess_sell
-                new_avg_price = Decimal(price)
-        else:
-            # Case 4: Increasing Short Position (or opening)
-            # Adding to short position
-            # Weighted Average of SELL prices
-            total_value_short = (Decimal(abs(current_qty)) * avg_price) + trade_value
-            new_qty = current_qty - quantity
-            if new_qty != 0:
-                new_avg_price = total_value_short / Decimal(abs(new_qty))
-            else:
-                new_avg_price = Decimal('0.00')
-
-    # Save or Delete Holding
-    if new_qty == 0:
-        if holding:
-            holding.delete()
-            holding = None
-    else:
-        if not holding:
-            holding = Holding(portfolio=portfolio, stock=stock, quantity=0, average_buy_price=0)
-        holding.quantity = new_qty
-        holding.average_buy_price = new_avg_price
-        holding.save()
-
-    portfolio.save()
+    holding = TradeExecutionService().update_position(portfolio, stock, quantity, price, transaction_type)
+    # Cash moves via F() expressions; reload the values the caller holds
+    portfolio.refresh_from_db(fields=['cash_balance', 'cached_market_value', 'last_updated'])
     return holding
 
 @login_required
 def dashboard(request):
-    portfolio_id = request.GET.get('portfolio') or request.session.get('active_portfolio_id')
+    portfolio = get_active_portfolio(request, request.GET.get('portfolio'))
     portfolios = Portfolio.objects.filter(user=request.user, visibility='PUBLIC')
 
-    if not portfolios.exists():
+    if portfolio is None:
         template_name = 'trading/partials/dashboard_content.html' if request.headers.get('HX-Request') == 'true' else 'trading/dashboard.html'
         return render(request, template_name, {
             'portfolios': None, 'holdings': [], 'transactions': [], 'performance_data': json.dumps([])
         })
 
-    if portfolio_id:
-        try:
-            portfolio = portfolios.get(id=portfolio_id)
-        except Portfolio.DoesNotExist:
-            portfolio = portfolios.first()
-    else:
-        portfolio = portfolios.first()
-
-    request.session['active_portfolio_id'] = portfolio.id
-    holdings = Holding.objects.filter(portfolio=portfolio)
-    transactions = Transaction.objects.filter(portfolio=portfolio).order_by('-timestamp')[:10]
+    holdings = Holding.objects.filter(portfolio=portfolio).select_related('stock')
+    transactions = Transaction.objects.filter(portfolio=portfolio).select_related('stock').order_by('-timestamp')[:10]
     performance_data = generate_performance_data(portfolio)
 
-    total_value = portfolio.total_value # Use property
+    total_value = portfolio.marked_value # Cached, maintained by trades and price ticks
     initial_cash = getattr(portfolio, 'initial_cash', portfolio.cash_balance) # Fallback logic
 
     # Calculate total P/L
@@ -177,14 +86,7 @@ def dashboard(request):
     return render(request, 'trading/dashboard.html', context)
 
 def generate_performance_data(portfolio):
-    total_value = float(portfolio.total_value)
-    performance_data = []
-    today = timezone.now().date()
-    for i in range(30, 0, -1):
-        date = today - timedelta(days=i)
-        value = total_value * (0.95 + 0.1 * (i / 30))
-        performance_data.append({"date": date.isoformat(), "value": round(value, 2)})
-    return performance_data
+    return performance_series(portfolio, days=30, interval='daily')
 
 def signup(request):
     if request.method == 'POST':
@@ -197,25 +99,45 @@ def signup(request):
         form = UserCreationForm()
     return render(request, 'registration/signup.html', {'form': form})
 
+STOCK_SORTS = {'symbol', 'change_pct', '-change_pct', '-volume'}
+
+# Top-N rankings, each read straight off a Stock index: (ordering, filter)
+TOP_MOVERS = {
+    'top-gainers': ('-change_pct', {'change_pct__gt': 0}),
+    'top-losers': ('change_pct', {'change_pct__lt': 0}),
+    'most-active': ('-volume', {'volume__gt': 0}),
+}
+
+
 @login_required
+@vary_on_headers('HX-Request')
+@condition(etag_func=stock_list_etag, last_modified_func=stock_list_last_modified)
 def stock_list(request):
     stocks = Stock.objects.all()
     query = request.GET.get('q')
     if query:
+        # The full list is unbounded: one icontains query, not thousands of index ids bound into pk__in
         stocks = stocks.filter(Q(symbol__icontains=query) | Q(name__icontains=query))
+    sort = request.GET.get('sort')
+    if sort in STOCK_SORTS:
+        stocks = stocks.order_by(sort, 'symbol')
 
-    context = {'stocks': stocks, 'query': query}
+    context = {'stocks': stocks, 'query': query, 'sort': sort}
     if request.headers.get('HX-Request') == 'true':
         return render(request, 'trading/partials/stock_list_content.html', context)
     return render(request, 'trading/stock_list.html', context)
 
 def stock_search(request):
     query = request.GET.get('q', '')
-    if query:
-        stocks = Stock.objects.filter(Q(symbol__icontains=query) | Q(name__icontains=query))[:10]
-    else:
-        stocks = Stock.objects.none()
-    results = [{'id': s.id, 'symbol': s.symbol, 'name': s.name, 'current_price': str(s.current_price)} for s in stocks]
+    if not query:
+        return JsonResponse([], safe=False)
+
+    ids = search_stocks(query)
+    quotes = get_quotes(ids)
+    results = [
+        {'id': q['id'], 'symbol': q['symbol'], 'name': q['name'], 'current_price': str(q['current_price'])}
+        for q in (quotes[pk] for pk in ids if pk in quotes)
+    ]
     return JsonResponse(results, safe=False)
 
 @login_required
@@ -226,61 +148,55 @@ def stock_detail(request, pk):
         recent_transactions = Transaction.objects.filter(stock=stock).order_by('-timestamp')[:10]
     else:
         recent_transactions = Transaction.objects.filter(portfolio__user=request.user, stock=stock).order_by('-timestamp')[:10]
-    return render(request, 'trading/stock_detail.html', {'stock': stock, 'user_holdings': user_holdings, 'recent_transactions': recent_transactions})
+    history = PriceHistory().series(stock.symbol, start=timezone.now() - timedelta(days=30))
+    price_history = lttb(history.points(), 500)
+    return render(request, 'trading/stock_detail.html', {
+        'stock': stock, 'user_holdings': user_holdings, 'recent_transactions': recent_transactions,
+        'price_history': json.dumps(price_history),
+    })
 
 @login_required
 def trade_stock(http_request, stock_id=None):
     portfolios = Portfolio.objects.filter(user=http_request.user, visibility='PUBLIC')
-    if not portfolios.exists():
+    portfolio = get_active_portfolio(http_request)
+    if portfolio is None:
         messages.error(http_request, "You need to create a portfolio first!")
         if http_request.headers.get('HX-Request') == 'true':
              return HttpResponse(status=204, headers={'HX-Redirect': '/portfolios/create/'})
         return redirect('trading:create_portfolio')
 
-    portfolio_id = http_request.session.get('active_portfolio_id')
-    portfolio = None
-    if portfolio_id:
-        try:
-            portfolio = portfolios.get(id=portfolio_id)
-        except Portfolio.DoesNotExist:
-            portfolio = portfolios.first()
-    else:
-        portfolio = portfolios.first()
-
-    stocks = Stock.objects.all()
     initial_data = {}
     selected_stock = None
     if stock_id:
-        selected_stock = get_object_or_404(Stock, id=stock_id)
-        initial_data['stock'] = selected_stock
-        initial_data['price_per_share'] = float(selected_stock.current_price)
+        selected_stock = get_quote(stock_id)
+        if selected_stock is None:
+            raise Http404("Stock not found")
+        initial_data['stock'] = selected_stock['id']
+        initial_data['price_per_share'] = float(selected_stock['current_price'])
 
     if http_request.method == 'POST':
         form = TradeForm(http_request.POST, initial=initial_data, user=http_request.user)
         if form.is_valid():
-            transaction = form.save(commit=False)
             selected_portfolio = form.cleaned_data['portfolio']
-            transaction.portfolio = selected_portfolio
-            transaction.user = http_request.user
 
-            # Using helper to update logic
-            update_portfolio_after_trade(
+            # Holding, cash and transaction row commit together under row locks
+            transaction = TradeExecutionService().execute(
                 selected_portfolio,
-                transaction.stock,
-                transaction.quantity,
-                transaction.price_per_share,
-                transaction.transaction_type
+                form.cleaned_data['stock'],
+                form.cleaned_data['quantity'],
+                form.cleaned_data['price_per_share'],
+                form.cleaned_data['transaction_type'],
+                http_request.user,
+                notes=form.cleaned_data.get('notes'),
             )
 
-            transaction.save()
-
-            # Generate Report Automatically
+            # Snapshot the portfolio in the background (coalesced per portfolio)
             try:
-                selected_portfolio.generate_report()
+                enqueue_snapshot(selected_portfolio)
             except Exception as e:
-                print(f"Failed to generate report: {e}")
+                print(f"Failed to queue report: {e}")
 
-            http_request.session['active_portfolio_id'] = selected_portfolio.id
+            set_active_portfolio(http_request, selected_portfolio)
             messages.success(http_request, f"Successfully {transaction.transaction_type.lower()}ed {transaction.quantity} shares of {transaction.stock.symbol}")
 
             if http_request.headers.get('HX-Request') == 'true':
@@ -292,16 +208,13 @@ def trade_stock(http_request, stock_id=None):
         if portfolio:
             form.fields['portfolio'].initial = portfolio
 
-    if not selected_stock and stocks.exists():
-        selected_stock = stocks.first()
-
     context = {
         'form': form,
         'portfolio': portfolio,
         'portfolios': portfolios,
-        'stocks': stocks,
         'selected_stock': selected_stock,
-        'stocks_count': stocks.count(),
+        # The picker searches remotely; only whether there is anything to find matters here
+        'stocks_count': len(get_index()),
         'portfolio_cash_balance': float(portfolio.cash_balance) if portfolio else 0
     }
 
@@ -336,7 +249,9 @@ def calculate_order_summary(http_request):
         if not stock_id:
             return JsonResponse({"success": False, "error": "Stock ID is required"}, status=400)
 
-        stock = get_object_or_404(Stock, id=stock_id)
+        stock = get_quote(stock_id)
+        if stock is None:
+            return JsonResponse({"success": False, "error": "Stock not found"}, status=404)
 
         if portfolio_id:
             portfolio = get_object_or_404(Portfolio, id=portfolio_id, user=http_request.user, visibility='PUBLIC')
@@ -356,7 +271,7 @@ def calculate_order_summary(http_request):
 
         # Check existing shares
         try:
-            holding = Holding.objects.get(portfolio=portfolio, stock=stock)
+            holding = Holding.objects.get(portfolio=portfolio, stock_id=stock_id)
             owned_shares = holding.quantity
         except Holding.DoesNotExist:
             owned_shares = 0
@@ -367,7 +282,7 @@ def calculate_order_summary(http_request):
             "price": float(price),
             "total": float(total_amount),
             "cash_after": float(cash_after),
-            "current_price": float(stock.current_price),
+            "current_price": float(stock['current_price']),
             "owned_shares": owned_shares,
             "portfolio_cash": float(portfolio.cash_balance)
         }
@@ -377,23 +292,15 @@ def calculate_order_summary(http_request):
 
 @login_required
 def transaction_list(request):
-    portfolio_id = request.GET.get('portfolio') or request.session.get('active_portfolio_id')
+    portfolio = get_active_portfolio(request, request.GET.get('portfolio'))
     portfolios = Portfolio.objects.filter(user=request.user, visibility='PUBLIC')
 
-    if not portfolios.exists():
+    if portfolio is None:
         context = {'transactions': [], 'portfolios': None}
         if request.headers.get('HX-Request') == 'true':
             return render(request, 'trading/partials/transaction_list_content.html', context)
         return render(request, 'trading/transaction_list.html', context)
 
-    if portfolio_id:
-        try:
-            portfolio = portfolios.get(id=portfolio_id)
-        except Portfolio.DoesNotExist:
-            portfolio = portfolios.first()
-    else:
-        portfolio = portfolios.first()
-
     transactions = portfolio.transaction_set.all().select_related('stock').order_by('-timestamp')
     context = {'transactions': transactions, 'portfolio': portfolio, 'portfolios': portfolios}
 
@@ -404,7 +311,7 @@ def transaction_list(request):
 @login_required
 def reports(request):
     user_portfolios = Portfolio.objects.filter(user=request.user)
-    reports = PortfolioReport.objects.filter(portfolio__in=user_portfolios).order_by('-report_date', '-created_at')
+    reports = PortfolioReport.objects.filter(portfolio__in=user_portfolios).with_change().order_by('-report_date', '-created_at')
     context = {'reports': reports}
     if request.headers.get('HX-Request') == 'true':
         return render(request, 'trading/partials/reports_content.html', context)
@@ -431,10 +338,13 @@ def watchlists(request):
 @login_required
 def update_stock_price(request, pk):
     if request.method == 'POST' and request.htmx:
-        stock = get_object_or_404(Stock, pk=pk)
         new_price = Decimal(request.POST.get('price'))
-        stock.current_price = new_price # Direct update or method? Model had update_price method? No, just field.
-        stock.save() # Assuming no method
+        with transaction.atomic():
+            stock = get_object_or_404(Stock.objects.select_for_update(), pk=pk)
+            old_price = stock.current_price
+            stock.current_price = new_price # Direct update or method? Model had update_price method? No, just field.
+            stock.save() # Assuming no method
+            mark_to_market({stock.id: (old_price, new_price)})
         return render(request, 'trading/partials/stock_price.html', {'stock': stock})
     return JsonResponse({'error': 'Invalid request'}, status=400)
 
@@ -463,7 +373,7 @@ def manage_portfolio_visibility(request):
             portfolio.visibility = visibility
             portfolio.save()
             messages.success(request, f"Updated visibility for {portfolio.name}")
-    portfolios = Portfolio.objects.all().select_related('user').order_by('user__username', 'name')
+    portfolios = Portfolio.objects.all().select_related('user').with_valuation().order_by('user__username', 'name')
     return render(request, 'trading/admin_portfolio_visibility.html', {'portfolios': portfolios})
 
 @login_required
@@ -482,7 +392,7 @@ def profile(request):
     return render(request, 'registration/profile.html', {'u_form': u_form, 'p_form': p_form})
 
 def portfolio_list(request):
-    portfolios = Portfolio.objects.filter(user=request.user) # All user portfolios
+    portfolios = Portfolio.objects.filter(user=request.user).with_valuation() # All user portfolios
     context = {'portfolios': portfolios}
     if request.headers.get('HX-Request') == 'true':
         return render(request, 'trading/partials/portfolio_list_content.html', context)
@@ -518,15 +428,18 @@ def delete_portfolio(request, pk):
     return render(request, 'trading/portfolio_confirm_delete.html', {'portfolio': portfolio})
 
 @login_required
+@vary_on_headers('HX-Request')
+@condition(etag_func=report_etag, last_modified_func=report_last_modified)
 def report_detail(request, pk):
     report = get_object_or_404(PortfolioReport, pk=pk, portfolio__user=request.user)
-    recent_transactions = Transaction.objects.filter(portfolio=report.portfolio).select_related('stock').order_by('-timestamp')[:10]
 
-    if request.GET.get('export') == 'pdf':
-        return generate_pdf_report(report)
-    elif request.GET.get('export') == 'excel':
-        return generate_excel_report(report)
+    if request.GET.get('export') in ('pdf', 'excel'):
+        response = export_response(report, request.GET['export'])
+        # A report never changes after it is created: let the browser keep the file
+        patch_cache_control(response, private=True, max_age=IMMUTABLE_MAX_AGE, immutable=True)
+        return response
 
+    recent_transactions = Transaction.objects.filter(portfolio=report.portfolio).select_related('stock').order_by('-timestamp')[:10]
     context = {'report': report, 'recent_transactions': recent_transactions}
     if request.headers.get('HX-Request') == 'true':
         return render(request, 'trading/partials/report_detail_content.html', context)
@@ -549,114 +462,22 @@ def stock_transactions_api(request, stock_id):
     except Exception as e:
         return JsonResponse({'success': False, 'error': str(e)}, status=500)
 
-def generate_pdf_report(report):
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4)
-    elements = []
-    styles = getSampleStyleSheet()
-
-    elements.append(Paragraph(f"Portfolio Report - {report.report_date}", styles['Title']))
-
-    data = [
-        ['Total Value', f'{report.total_value:,.2f}'],
-        ['Cash Balance', f'{report.cash_balance:,.2f}'],
-        ['Invested Value', f'{report.investment_value:,.2f}']
-    ]
-    t = Table(data)
-    t.setStyle(TableStyle([('GRID', (0,0), (-1,-1), 1, colors.black)]))
-    elements.append(t)
-    elements.append(Spacer(1, 20))
-
-    if report.holding_reports.exists():
-        elements.append(Paragraph("Holdings", styles['Heading2']))
-        h_data = [['Symbol', 'Qty', 'Avg Price', 'Current', 'P/L %']]
-        for hr in report.holding_reports.all():
-            h_data.append([
-                hr.holding.stock.symbol,
-                str(hr.quantity),
-                f'{hr.average_price:.2f}',
-                f'{hr.current_price:.2f}',
-                f'{hr.profit_loss_percentage:.2f}%'
-            ])
-        t2 = Table(h_data)
-        t2.setStyle(TableStyle([('GRID', (0,0), (-1,-1), 1, colors.black)]))
-        elements.append(t2)
-
-    doc.build(elements)
-    buffer.seek(0)
-    response = HttpResponse(buffer, content_type='application/pdf')
-    response['Content-Disposition'] = f'attachment; filename="report_{report.id}.pdf"'
-    return response
+@login_required
+def export_transactions_csv(request, pk):
+    portfolio = get_object_or_404(Portfolio, pk=pk, user=request.user)
+    return csv_response(transaction_csv_rows(portfolio), f"transactions_{portfolio.pk}.csv")
 
-def generate_excel_report(report):
-    wb = openpyxl.Workbook()
-    ws = wb.active
-    ws.title = f"Report {report.report_date}"
-
-    # Headers
-    ws['A1'] = "Portfolio Report"
-    ws['A1'].font = Font(size=14, bold=True)
-
-    ws['A3'] = "Date"
-    ws['B3'] = report.report_date
-
-    ws['A4'] = "Total Value"
-    ws['B4'] = report.total_value
-
-    ws['A5'] = "Cash Balance"
-    ws['B5'] = report.cash_balance
-
-    ws['A6'] = "Invested Value"
-    ws['B6'] = report.investment_value
-
-    # Holdings
-    ws['A8'] = "Holdings Breakdown"
-    ws['A8'].font = Font(bold=True)
-
-    headers = ['Symbol', 'Quantity', 'Avg Price', 'Current Price', 'Current Value', 'P/L', 'P/L %']
-    for col_num, header in enumerate(headers, 1):
-        cell = ws.cell(row=9, column=col_num)
-        cell.value = header
-        cell.font = Font(bold=True)
-        cell.fill = PatternFill(start_color="DDDDDD", end_color="DDDDDD", fill_type="solid")
-
-    row_num = 10
-    for hr in report.holding_reports.all():
-        ws.cell(row=row_num, column=1).value = hr.holding.stock.symbol
-        ws.cell(row=row_num, column=2).value = hr.quantity
-        ws.cell(row=row_num, column=3).value = hr.average_price
-        ws.cell(row=row_num, column=4).value = hr.current_price
-        ws.cell(row=row_num, column=5).value = hr.current_value
-        ws.cell(row=row_num, column=6).value = hr.profit_loss
-        ws.cell(row=row_num, column=7).value = hr.profit_loss_percentage
-        row_num += 1
-
-    # Auto-adjust column widths
-    for col in ws.columns:
-        max_length = 0
-        column = col[0].column_letter
-        for cell in col:
-            try:
-                if len(str(cell.value)) > max_length:
-                    max_length = len(str(cell.value))
-            except:
-                pass
-        adjusted_width = (max_length + 2)
-        ws.column_dimensions[column].width = adjusted_width
-
-    buffer = io.BytesIO()
-    wb.save(buffer)
-    buffer.seek(0)
-
-    response = HttpResponse(buffer, content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
-    response['Content-Disposition'] = f'attachment; filename="portfolio_report_{report.report_date}.xlsx"'
-    return response
+@login_required
+def export_reports_csv(request, pk):
+    portfolio = get_object_or_404(Portfolio, pk=pk, user=request.user)
+    return csv_response(report_csv_rows(portfolio), f"reports_{portfolio.pk}.csv")
 
 @login_required
 def generate_report(request):
     portfolio = Portfolio.objects.filter(user=request.user).first()
     try:
         report = portfolio.generate_report()
+        enqueue_exports(report)
         messages.success(request, f"Report generated for {report.report_date}")
         return redirect('trading:report_detail', pk=report.id)
     except Exception as e:
@@ -665,13 +486,18 @@ def generate_report(request):
 
 @staff_member_required
 def portfolio_manager(request):
-    portfolios = Portfolio.objects.all()
+    portfolios = Portfolio.objects.select_related('user').with_valuation()
     return render(request, 'trading/portfolio_manager.html', {'portfolios': portfolios})
 
 @staff_member_required
 def bulk_update_visibility(request):
     if request.method == 'POST':
-        Portfolio.objects.filter(id__in=request.POST.getlist('portfolio_ids')).update(visibility=request.POST.get('visibility'))
+        portfolios = Portfolio.objects.filter(id__in=request.POST.getlist('portfolio_ids'))
+        user_ids = set(portfolios.values_list('user_id', flat=True))
+        portfolios.update(visibility=request.POST.get('visibility'))
+        # update() sends no signals: expire the owners' remembered portfolios here
+        for user_id in user_ids:
+            invalidate_active_portfolio(user_id)
     return redirect('trading:portfolio_manager')
 
 @staff_member_required
@@ -719,12 +545,43 @@ def calculate_order(request):
         return JsonResponse({'error': str(e)}, status=500)
 
 @login_required
-def get_stock_price_api(request, stock_id):
+def top_movers_api(request, ranking):
+    """The top ``?n=`` (default 10, at most 100) stocks of a ranking as JSON."""
+    if ranking not in TOP_MOVERS:
+        return JsonResponse({'success': False, 'error': 'Unknown ranking'}, status=404)
     try:
-        stock = Stock.objects.get(id=stock_id)
-        return JsonResponse({'success': True, 'price': float(stock.current_price), 'symbol': stock.symbol})
-    except Stock.DoesNotExist:
+        n = min(max(int(request.GET.get('n', 10)), 1), 100)
+    except ValueError:
+        return JsonResponse({'success': False, 'error': 'n must be an integer'}, status=400)
+    ordering, filters = TOP_MOVERS[ranking]
+
+    def top():
+        rows = Stock.objects.filter(**filters).order_by(ordering, 'symbol').values(
+            'id', 'symbol', 'name', 'current_price', 'prev_close', 'change_pct', 'volume'
+        )[:n]
+        return [
+            {**row, **{k: None if row[k] is None else float(row[k]) for k in ('current_price', 'prev_close', 'change_pct')}}
+            for row in rows
+        ]
+
+    stocks = cached_by_version(f"{ranking}:{n}", top)
+    return JsonResponse({'success': True, 'ranking': ranking, 'stocks': stocks})
+
+@login_required
+@condition(etag_func=stock_price_etag, last_modified_func=stock_price_last_modified)
+def get_stock_price_api(request, stock_id):
+    quote = request_quote(request, stock_id)
+    if quote is None:
         return JsonResponse({'success': False, 'error': 'Stock not found'}, status=404)
+    return JsonResponse({'success': True, 'price': float(quote['current_price']), 'symbol': quote['symbol']})
+
+@staff_member_required
+def quote_cache_stats_api(request):
+    return JsonResponse(quote_stats())
+
+@staff_member_required
+def export_cache_stats_api(request):
+    return JsonResponse(export_cache_stats())
 
 def is_admin(user):
     return user.is_superuser
@@ -735,27 +592,24 @@ def download_nse_data(request):
     downloaded_files = get_downloaded_files()
 
     if request.method == 'POST':
-        index_name = request.POST.get('index_name')
-        if not index_name:
+        index_names = request.POST.getlist('index_name')
+        if not index_names:
             messages.error(request, "No index selected")
             return redirect('trading:data_download')
 
-        timestamp = timezone.now().strftime('%Y%m%d_%H%M%S')
-        file_name = f"{index_name.replace(' ', '_')}_{timestamp}.csv"
-        save_path = os.path.join(settings.BASE_DIR, 'data', 'nse', file_name)
-
-        success = download_nse_csv(index_name, save_path)
-        if success:
-            messages.success(request, f"Successfully downloaded {index_name} data")
-            try:
-                # Corrected line to unpack all three values
-                created_count, updated_count, skipped_count = process_nse_csv(save_path)
-                messages.success(request,
-                                 f"Updated stocks: {created_count} created, {updated_count} updated, {skipped_count} skipped due to invalid data")
-            except Exception as e:
-                messages.error(request, f"Failed to process CSV: {str(e)}")
+        # All indices download concurrently in the background worker
+        results = enqueue('download_nse', key=f"download_nse:{','.join(sorted(index_names))}", index_names=index_names)
+        if isinstance(results, Job):
+            messages.success(request, f"Download of {', '.join(index_names)} queued; files appear below when done")
         else:
-            messages.error(request, f"Failed to download {index_name} data")
+            for result in results:
+                if not result['ok']:
+                    messages.error(request, f"Failed to download {result['index']} data: {result['error']}")
+                    continue
+                ingest = result['ingest']
+                messages.success(request,
+                                 f"Downloaded {result['index']}: {ingest['created']} created, {ingest['updated']} updated, "
+                                 f"{ingest['skipped']} skipped due to invalid data")
 
         return redirect('trading:data_download')
 
@@ -765,101 +619,109 @@ def download_nse_data(request):
     return render(request, 'trading/data_download.html', context)
 
 
-def download_nse_csv(index_name, save_path):
-    url = (
-        "https://www.nseindia.com/api/equity-stockIndices"
-        f"?csv=true&index={index_name.replace(' ', '%20').replace('&', '%26')}"
-        "&selectValFormat=crores"
-    )
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Referer": "https://www.nseindia.com/market-data/live-equity-market",
-    }
-    try:
-        with requests.Session() as session:
-            session.get("https://www.nseindia.com/market-data/live-equity-market", headers=headers)
-            response = session.get(url, headers=headers)
-            response.raise_for_status()
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
-            with open(save_path, "wb") as f:
-                f.write(response.content)
-        return True
-    except Exception as e:
-        print(f"Failed to download {index_name}: {str(e)}")
-        return False
-
 def get_downloaded_files():
-    data_dir = os.path.join(settings.BASE_DIR, 'data', 'nse')
     downloaded_files = []
-    os.makedirs(data_dir, exist_ok=True)
-    csv_files = glob.glob(os.path.join(data_dir, '*.csv'))
-    for file_path in csv_files:
-        file_name = os.path.basename(file_path)
-        file_size = os.path.getsize(file_path)
-        modified_time = os.path.getmtime(file_path)
-        size_mb = file_size / (1024 * 1024)
+    for entry in list_downloads():
         downloaded_files.append({
-            'name': file_name,
-            'size': f"{size_mb:.2f} MB",
-            'path': file_path,
-            'modified': modified_time
+            'name': entry.name,
+            'size': f"{entry.size / (1024 * 1024):.2f} MB",
+            'stored_size': f"{entry.stored_size / 1024:.1f} KB",
+            'digest': entry.digest[:12],
+            'index_type': entry.get_index_type_display(),
+            'modified': (entry.snapshot_at or entry.created_at).timestamp()
         })
     return downloaded_files
 
+def parse_byte_range(header, size):
+    """``(start, end)`` (end exclusive) for a single ``bytes=`` range, ``None`` to
+    serve the whole file, or ``False`` when the range cannot be satisfied."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    first, _, last = header[len('bytes='):].strip().partition('-')
+    try:
+        if not first:
+            start, end = max(0, size - int(last)), size
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                # Invalid, not unsatisfiable: ignore the header (RFC 9110 section 14.2)
+                return None
+            end = min(int(last) + 1, size) if last else size
+    except ValueError:
+        return None
+    if start >= size or start >= end:
+        return False
+    return start, end
+
+
 def view_file(request, filename):
-    file_path = os.path.join(settings.BASE_DIR, 'data', 'nse', filename)
-    if not os.path.exists(file_path):
-        return HttpResponse("File not found", status=404)
+    """Stream a snapshot CSV from the archive.
+
+    Honours single HTTP ``Range`` requests. ``?head=N`` and ``?tail=N`` return
+    the first or last N lines, the tail found by reading backwards from the
+    end. ``?page=P&page_size=S`` returns parsed rows of that window as JSON,
+    reading no further than its last row.
+    """
     if not filename.endswith('.csv') or '..' in filename or '/' in filename:
         return HttpResponse("Invalid file", status=400)
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return HttpResponse(content, content_type='text/plain')
+        reader = SnapshotReader(filename)
+    except FileNotFoundError:
+        return HttpResponse("File not found", status=404)
     except Exception as e:
         return HttpResponse(f"Error reading file: {str(e)}", status=500)
 
+    try:
+        if 'page' in request.GET:
+            with reader:
+                page = max(1, int(request.GET['page']))
+                page_size = min(max(1, int(request.GET.get('page_size', 50))), 1000)
+                header, rows = reader.rows((page - 1) * page_size, page_size + 1)
+            return JsonResponse({
+                'header': header, 'rows': rows[:page_size], 'page': page,
+                'page_size': page_size, 'has_next': len(rows) > page_size,
+            })
+        for mode in ('head', 'tail'):
+            if mode in request.GET:
+                with reader:
+                    lines = max(0, int(request.GET[mode]))
+                    content = reader.head(lines) if mode == 'head' else reader.tail(lines)
+                return HttpResponse(content, content_type='text/plain; charset=utf-8')
+    except ValueError:
+        reader.close()
+        return HttpResponse("Invalid parameters", status=400)
+
+    byte_range = parse_byte_range(request.headers.get('Range'), reader.size)
+    if byte_range is False:
+        reader.close()
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f"bytes */{reader.size}"
+        return response
+    start, end = byte_range or (0, reader.size)
+
+    def stream():
+        with reader:
+            yield from reader.iter_range(start, end)
+
+    response = StreamingHttpResponse(stream(), status=206 if byte_range else 200,
+                                     content_type='text/csv' if request.GET.get('download') else 'text/plain')
+    response['Content-Length'] = str(end - start)
+    response['Accept-Ranges'] = 'bytes'
+    if byte_range:
+        response['Content-Range'] = f"bytes {start}-{end - 1}/{reader.size}"
+    if request.GET.get('download'):
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 def process_nse_csv(file_path):
+    """Archive a freshly downloaded CSV (if still on disk) and ingest it from the archive."""
     try:
-        df = pd.read_csv(file_path, encoding='utf-8', skipinitialspace=True)
-        df.columns = df.columns.str.strip().str.upper()
-        if 'SYMBOL' not in df.columns:
-            raise ValueError("CSV file missing 'SYMBOL' column")
-        created_count = 0
-        updated_count = 0
-        skipped_count = 0
-        for index, row in df.iterrows():
-            symbol = row['SYMBOL']
-            if not symbol or pd.isna(symbol):
-                skipped_count += 1
-                continue
-            price = row.get('LTP', row.get('PREV_CLOSE', row.get('PREV. CLOSE', '0.0')))
-            try:
-                price = str(price).replace(',', '')
-                price_decimal = Decimal(price)
-            except (InvalidOperation, ValueError, TypeError) as e:
-                skipped_count += 1
-                continue
-            stock, created = Stock.objects.get_or_create(
-                symbol=symbol,
-                defaults={
-                    'name': row.get('COMPANY_NAME', row.get('SERIES', symbol)),
-                    'current_price': price_decimal,
-                    'sector': row.get('INDUSTRY', row.get('SECTOR', None)),
-                    'exchange': 'NSE'
-                }
-            )
-            if created:
-                created_count += 1
-            else:
-                stock.name = row.get('COMPANY_NAME', row.get('SERIES', stock.name))
-                stock.current_price = price_decimal
-                stock.sector = row.get('INDUSTRY', row.get('SECTOR', stock.sector))
-                stock.exchange = 'NSE'
-                stock.save()
-                updated_count += 1
-        return created_count, updated_count, skipped_count
+        name = os.path.basename(file_path)
+        if os.path.exists(file_path):
+            archive_file(file_path)
+        with open_snapshot(name) as f:
+            result = ingest_nse_csv(f, name=name)
+        return result['created'], result['updated'], result['skipped']
     except Exception as e:
         print(f"Error processing CSV: {str(e)}")
         raise Exception(f"Error processing CSV: {str(e)}")